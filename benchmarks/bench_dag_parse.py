@@ -0,0 +1,81 @@
+"""Airflow parse time of a generated DAG file, in the python and json output formats.
+
+    python benchmarks/bench_dag_parse.py [--tasks 1000 5000 20000] [--repeat 5]
+
+To be run in an Airflow environment where the operators package of the Composer dags
+folder is importable, as for the DAGs themselves. The DAG has a run and a test task per
+model of a synthetic manifest.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DEVOPS_DIR = Path(__file__).resolve().parent.parent / "devops"
+sys.path.insert(0, str(DEVOPS_DIR))
+
+from airflow.models import DagBag  # noqa: E402
+
+from dbt_graph import ModelsGraph  # noqa: E402
+from generate_dbt_dag import OUTPUT_FORMATS, Graph, Node, get_dag_file_path, get_jinja_template, write_dag_files  # noqa: E402
+from synthetic_manifest import make_manifest  # noqa: E402
+
+# modules of the dags folder, imported again by each parse as in a new file processor
+DAGS_MODULES = ("dbt_operators", "dbt_loader")
+
+
+def make_dag(tasks_number: int) -> Graph:
+    models_graph = ModelsGraph.from_manifest(make_manifest(tasks_number // 2))
+    models_nodes = [Node(name, is_source=False, has_tests=True) for name in models_graph.names]
+    return Graph(
+        selector_name="bench",
+        selector_schedule=None,
+        models_graph=models_graph,
+        models_nodes=models_nodes,
+        sources_nodes=[]
+    )
+
+
+def parse_time(dags_dir: Path, dag_file_path: str, repeat: int) -> float:
+    dag_bag = DagBag(dag_folder=str(dags_dir), include_examples=False, collect_dags=False)
+    sys.path.insert(0, str(dags_dir))
+    try:
+        durations = []
+        for _ in range(repeat):
+            for module in DAGS_MODULES:
+                sys.modules.pop(module, None)
+            start = time.perf_counter()
+            dags = dag_bag.process_file(dag_file_path, only_if_updated=False)
+            durations.append(time.perf_counter() - start)
+            assert dags, dag_bag.import_errors
+        return min(durations)
+    finally:
+        sys.path.remove(str(dags_dir))
+
+
+def main(tasks_numbers, repeat: int):
+    template = get_jinja_template()
+    print(f"{'tasks':>8} {'format':>8} {'file size':>12} {'parse':>10}")
+    for tasks_number in tasks_numbers:
+        dag = make_dag(tasks_number)
+        for output_format in OUTPUT_FORMATS:
+            with tempfile.TemporaryDirectory() as dags_dir:
+                dags_dir = Path(dags_dir)
+                for module in DAGS_MODULES:
+                    shutil.copy(DEVOPS_DIR / f"{module}.py", dags_dir)
+                dag_file_path = get_dag_file_path(str(dags_dir), "bench")
+                write_dag_files(dag, dag_file_path, output_format, fingerprint="", template=template)
+
+                files_size = sum(path.stat().st_size for path in dags_dir.glob("dbt_dag_bench.*"))
+                duration = parse_time(dags_dir, dag_file_path, repeat)
+                print(f"{tasks_number:>8} {output_format:>8} {files_size / 1024:>10.0f}kB {duration:>9.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.tasks, args.repeat)
@@ -0,0 +1,59 @@
+"""Compare the per-job latency of the warm dbt engine with one `dbt` process per job.
+
+Usage (Postgres must be reachable with the PG_* variables of profiles.yml):
+
+    python benchmarks/bench_dbt_engine.py --command "run --select my_model" --jobs 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Callable, List
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent / "dbt_airflow"
+sys.path.insert(0, str(PROJECT_DIR))
+os.environ.setdefault("DBT_PROFILES_DIR", str(PROJECT_DIR))
+os.chdir(PROJECT_DIR)
+
+from lib.dbt_engine import DBTEngine, run_dbt_subprocess  # noqa: E402
+
+
+def time_jobs(execute: Callable[[List[str]], bool], arguments_list: List[str], jobs: int) -> List[float]:
+    durations = []
+    for _ in range(jobs):
+        start = time.perf_counter()
+        success = execute(arguments_list)
+        durations.append(time.perf_counter() - start)
+        assert success, f"dbt {' '.join(arguments_list)} failed"
+    return durations
+
+
+def report(name: str, durations: List[float]):
+    durations = sorted(durations)
+    p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+    print(
+        f"{name:<12} jobs={len(durations):<4} mean={statistics.mean(durations):.3f}s "
+        f"p50={statistics.median(durations):.3f}s p95={p95:.3f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--command", default="ls --resource-type model")
+    parser.add_argument("--jobs", type=int, default=10)
+    args = parser.parse_args()
+    arguments_list = args.command.split(" ")
+
+    report("subprocess", time_jobs(run_dbt_subprocess, arguments_list, args.jobs))
+
+    engine = DBTEngine(project_dir=str(PROJECT_DIR))
+    start = time.perf_counter()
+    engine.warm_up()
+    print(f"warm engine: initial parse took {time.perf_counter() - start:.3f}s")
+    report("warm engine", time_jobs(engine.invoke, arguments_list, args.jobs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Latency of the submission dedupe and job status lookups as the dbt_jobs history grows.
+
+The status of a job is looked up in the partition of the day of its id, and, as for the
+ids without a day, in all the partitions of the history.
+
+The database (PG_* variables) must be migrated to the head revision and disposable:
+the dbt_jobs table is emptied first.
+
+    python benchmarks/bench_dbt_jobs_table.py --rows 100000 1000000 3000000 --days 90
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "dbt_airflow"))
+
+from lib.db import create_connection  # noqa: E402
+from lib.jobs import get_latest_job, read_job_status  # noqa: E402
+
+MODELS_NUMBER = 2000
+
+# days of history, one partition each, DBT_JOBS_RETENTION_DAYS by default
+HISTORY_DAYS = 30
+
+LOOKUPS = 500
+
+
+async def add_history(connection, start: int, end: int, history_days: int):
+    """Jobs spread over the last days, on the daily partitions, their ids starting with their day"""
+    await connection.execute(f"""
+    INSERT INTO dbt_jobs (job_id, model_name, test_or_run, status, c_date)
+    SELECT
+        to_char(c_date, 'YYYYMMDD') || '-' || md5(i::TEXT),
+        'model_' || (i % {MODELS_NUMBER}),
+        CASE WHEN i % 2 = 0 THEN 'run' ELSE 'test' END,
+        CASE WHEN i % 10 = 0 THEN 'failed' ELSE 'success' END,
+        c_date
+    FROM generate_series($1::INTEGER, $2::INTEGER - 1) AS i,
+        LATERAL (SELECT timezone('utc', now()) - (i % ({history_days} * 24 * 60)) * INTERVAL '1 minute' AS c_date) AS job
+    """, start, end)
+    await connection.execute("ANALYZE dbt_jobs")
+
+
+async def time_lookups(lookup) -> float:
+    durations = []
+    for i in range(LOOKUPS):
+        start = time.perf_counter()
+        await lookup(i)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations) * 1000
+
+
+async def main(rows_steps, history_days: int):
+    connection = await create_connection()
+    await connection.execute(
+        "SELECT dbt_jobs_create_partitions(timezone('utc', now())::DATE - $1::INTEGER, timezone('utc', now())::DATE + 1)",
+        history_days
+    )
+    await connection.execute("DELETE FROM dbt_jobs")
+    # without a day, the status of a job is looked up in all the partitions
+    all_partitions_query = await connection.prepare("SELECT status FROM dbt_jobs WHERE job_id=$1")
+    partitions = await connection.fetchval(
+        "SELECT COUNT(*) FROM pg_inherits WHERE inhparent = 'public.dbt_jobs'::REGCLASS"
+    )
+    print(f"{partitions} partitions")
+
+    rows = 0
+    print(f"{'rows':>10} {'dedupe (ms)':>12} {'status (ms)':>12} {'all partitions (ms)':>20}")
+    for rows_step in sorted(rows_steps):
+        await add_history(connection, rows, rows_step, history_days)
+        rows = rows_step
+        jobs_ids = [row["job_id"] for row in await connection.fetch(
+            "SELECT job_id FROM dbt_jobs ORDER BY random() LIMIT $1", LOOKUPS
+        )]
+
+        dedupe = await time_lookups(
+            lambda i: get_latest_job(connection, model_name=f"model_{i % MODELS_NUMBER}", run_or_test="run")
+        )
+        status = await time_lookups(lambda i: read_job_status(connection, jobs_ids[i % len(jobs_ids)]))
+        all_partitions = await time_lookups(lambda i: all_partitions_query.fetchval(jobs_ids[i % len(jobs_ids)]))
+        print(f"{rows:>10} {dedupe:>12.3f} {status:>12.3f} {all_partitions:>20.3f}")
+
+    await connection.execute("DELETE FROM dbt_jobs")
+    await connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000, 3000000])
+    parser.add_argument("--days", type=int, default=HISTORY_DAYS)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.days))
@@ -0,0 +1,75 @@
+"""Duration of the DAG generation steps on a synthetic manifest.
+
+    python benchmarks/bench_generate_dbt_dag.py --models 20000 [--transitive-reduction] [--max-group-size 10]
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "devops"))
+
+from dbt_graph import ModelsGraph  # noqa: E402
+from dbt_selectors import ManifestSelector  # noqa: E402
+from generate_dbt_dag import build_dag_for_selector, build_tests_index, get_jinja_template  # noqa: E402
+from synthetic_manifest import make_manifest, make_selectors  # noqa: E402
+
+
+class Timer:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        print(f"{self.name:<28} {time.perf_counter() - self.start:8.3f}s")
+
+
+def main(models_number: int, transitive_reduction: bool, max_group_size: Optional[int]):
+    manifest = make_manifest(models_number)
+    selectors = make_selectors()
+
+    with Timer("models graph"):
+        models_graph = ModelsGraph.from_manifest(manifest)
+    with Timer("selectors index"):
+        manifest_selector = ManifestSelector(manifest=manifest, selectors=selectors)
+    with Timer("tests index"):
+        tests_index = build_tests_index(manifest)
+    if transitive_reduction:
+        # on the graph of all the models, with the peak memory of its descendants bitsets
+        reduced_graph = models_graph.subgraph(models_graph.names)
+        tracemalloc.start()
+        with Timer("transitive reduction"):
+            reduced_graph.transitive_reduction()
+        print(f"{'transitive reduction peak':<28} {tracemalloc.get_traced_memory()[1] / 1e6:8.1f}MB")
+        tracemalloc.stop()
+
+    dags = []
+    for selector in selectors:
+        with Timer(f"dag {selector['name']}"):
+            dags.append(build_dag_for_selector(
+                selector_name=selector["name"],
+                selector_schedule=None,
+                models_graph=models_graph,
+                manifest_selector=manifest_selector,
+                tests_index=tests_index,
+                transitive_reduction=transitive_reduction,
+                max_group_size=max_group_size
+            ))
+            dags[-1].build()
+    with Timer("render"):
+        template = get_jinja_template()
+        for dag in dags:
+            template.render(dags=[dag], fingerprint="")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=int, default=20000)
+    parser.add_argument("--transitive-reduction", action="store_true")
+    parser.add_argument("--max-group-size", type=int, help="collapse the models to dbt build tasks")
+    args = parser.parse_args()
+    main(args.models, args.transitive_reduction, args.max_group_size)
@@ -0,0 +1,101 @@
+"""Load time and peak memory of the manifest loading modes, on a synthetic manifest with
+compiled SQL, columns and macros.
+
+    python benchmarks/bench_manifest_loader.py --models 20000
+
+Each mode runs in a new process, the peak RSS is the process maximum resident set size.
+The manifest is also written by a child process: the maximum resident set size is kept
+through exec, the main process has to stay small.
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "devops"))
+
+import manifest_loader  # noqa: E402
+from synthetic_manifest import make_manifest  # noqa: E402
+
+MACROS_NUMBER = 2000
+
+COLUMNS_NUMBER = 20
+
+
+def write_manifest(manifest_path: str, models_number: int):
+    manifest = make_manifest(models_number)
+    for node in manifest["nodes"].values():
+        node["raw_code"] = "select * from {{ ref('upstream') }} where id is not null\n" * 40
+        node["compiled_code"] = node["raw_code"].replace("{{ ref('upstream') }}", '"db"."schema"."upstream"')
+        node["description"] = "Some documentation of the node. " * 10
+        node["columns"] = {
+            f"column_{i}": {"name": f"column_{i}", "description": "A column", "meta": {}, "tags": []}
+            for i in range(COLUMNS_NUMBER)
+        }
+    manifest["metadata"] = {"dbt_version": "1.5.1"}
+    manifest["macros"] = {
+        f"macro.pkg.macro_{i}": {"name": f"macro_{i}", "macro_sql": "{% macro m() %} select 1 {% endmacro %}\n" * 20}
+        for i in range(MACROS_NUMBER)
+    }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+
+def load(mode: str, manifest_path: str, cache_dir: str, results):
+    start = time.perf_counter()
+    if mode == "setup":
+        manifest_loader.load_manifest(manifest_path, cache_dir=cache_dir)
+    elif mode == "json.load":
+        with open(manifest_path) as f:
+            json.load(f)
+    else:
+        if mode == "compact (json)":
+            manifest_loader.ijson = None
+        manifest_loader.load_manifest(manifest_path, cache_dir=cache_dir if mode == "snapshot" else None)
+    results.put((time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def run_in_process(context, target, *args):
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def write_manifest_in_process(manifest_path: str, models_number: int, results):
+    write_manifest(manifest_path, models_number)
+    results.put(None)
+
+
+def main(models_number: int):
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        manifest_path = str(Path(tmp_dir) / "manifest.json")
+        cache_dir = str(Path(tmp_dir) / "cache")
+        run_in_process(context, write_manifest_in_process, manifest_path, models_number)
+        print(f"manifest: {Path(manifest_path).stat().st_size / 1024 / 1024:.0f} MB")
+        # the snapshot of the manifest is written before it is timed
+        run_in_process(context, load, "setup", manifest_path, cache_dir)
+
+        modes = ["json.load", "compact (json)"]
+        if manifest_loader.ijson is not None:
+            modes.append("compact (ijson)")
+        modes.append("snapshot")
+
+        print(f"{'mode':<18} {'load (s)':>9} {'peak RSS (MB)':>14}")
+        for mode in modes:
+            duration, peak_rss = run_in_process(context, load, mode, manifest_path, cache_dir)
+            print(f"{mode:<18} {duration:>9.3f} {peak_rss:>14.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.models)
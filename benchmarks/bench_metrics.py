@@ -0,0 +1,110 @@
+"""Overhead of the Prometheus instrumentation on a request, in the gunicorn multiprocess mode.
+
+    python benchmarks/bench_metrics.py [--requests 20000]
+
+The same route is called through the ASGI interface of an app with and without the metrics
+middleware, without network nor database. The database pool metrics recorded by
+acquire_db_connection are timed apart and added to the request overhead, to be kept under
+the 50 µs budget.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "dbt_airflow"))
+
+# the metrics values are written in files, as under gunicorn
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prometheus-")
+
+from fastapi import FastAPI  # noqa: E402
+
+from lib.metrics import DB_POOL_ACQUIRE_DURATION, MetricsMiddleware, set_db_pool_connections  # noqa: E402
+
+BUDGET_US = 50
+
+ROUNDS = 5
+
+POOL_STATS = {"min_size": 1, "max_size": 10, "size": 4, "idle": 3, "in_use": 1}
+
+
+def make_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/job")
+    async def get_job_status(job_id: str):
+        return {"job_status": "success"}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def call(app, requests: int) -> float:
+    """Mean duration of a request in µs"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/job",
+        "raw_path": b"/job",
+        "root_path": "",
+        "query_string": b"job_id=some-job",
+        "headers": [],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8000),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def time_pool_metrics(requests: int) -> float:
+    """Mean duration in µs of the pool metrics of one request: acquire duration, pool gauges on acquire and release"""
+    start = time.perf_counter()
+    for _ in range(requests):
+        DB_POOL_ACQUIRE_DURATION.observe(0.0001)
+        set_db_pool_connections(POOL_STATS)
+        set_db_pool_connections(POOL_STATS)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main(requests: int):
+    loop = asyncio.new_event_loop()
+    plain_app, instrumented_app = make_app(instrumented=False), make_app(instrumented=True)
+    # warm up the apps, their middleware stack is built on the first call
+    loop.run_until_complete(call(plain_app, 100))
+    loop.run_until_complete(call(instrumented_app, 100))
+
+    plain = statistics.median(loop.run_until_complete(call(plain_app, requests)) for _ in range(ROUNDS))
+    instrumented = statistics.median(loop.run_until_complete(call(instrumented_app, requests)) for _ in range(ROUNDS))
+    pool_metrics = statistics.median(time_pool_metrics(requests) for _ in range(ROUNDS))
+    overhead = instrumented - plain + pool_metrics
+
+    print(f"request without metrics: {plain:.1f} µs")
+    print(f"request with metrics:    {instrumented:.1f} µs")
+    print(f"pool metrics:            {pool_metrics:.1f} µs")
+    print(f"overhead per request:    {overhead:.1f} µs (budget {BUDGET_US} µs)")
+    if overhead > BUDGET_US:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    main(args.requests)
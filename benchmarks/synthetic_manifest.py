@@ -0,0 +1,90 @@
+"""Synthetic manifest.json and selectors for the DAG generation benchmarks.
+
+The models are layered: each model depends on 1 to 3 models of the previous layers
+and has 2 generic tests. The first layer reads from sources, each with a test.
+"""
+import random
+from typing import Any, Dict, List
+
+PACKAGE_NAME = "wine_services_dbt"
+
+LAYER_SIZE = 500
+
+SOURCES_NUMBER = 200
+
+# tags of the selectors, each set on a share of the models
+SELECTORS_TAGS = {"hourly": 0.01, "daily": 0.05, "stats": 0.1}
+
+
+def _test_node(test_name: str, attached_node, depends_on: List[str]) -> Dict[str, Any]:
+    return {
+        "unique_id": f"test.{PACKAGE_NAME}.{test_name}",
+        "resource_type": "test",
+        "package_name": PACKAGE_NAME,
+        "name": test_name,
+        "fqn": [PACKAGE_NAME, test_name],
+        "tags": [],
+        "config": {"enabled": True},
+        "attached_node": attached_node,
+        "depends_on": {"macros": [], "nodes": depends_on},
+    }
+
+
+def make_manifest(models_number: int, seed: int = 0) -> Dict[str, Any]:
+    generator = random.Random(seed)
+    nodes = {}
+    sources = {}
+
+    for source_index in range(SOURCES_NUMBER):
+        source_id = f"source.{PACKAGE_NAME}.raw.table_{source_index}"
+        sources[source_id] = {
+            "unique_id": source_id,
+            "resource_type": "source",
+            "package_name": PACKAGE_NAME,
+            "source_name": "raw",
+            "name": f"table_{source_index}",
+            "fqn": [PACKAGE_NAME, "raw", f"table_{source_index}"],
+            "tags": [],
+            "config": {"enabled": True},
+        }
+        test_name = f"source_not_null_raw_table_{source_index}_id"
+        nodes[f"test.{PACKAGE_NAME}.{test_name}"] = _test_node(test_name, None, [source_id])
+
+    models_ids = []
+    for model_index in range(models_number):
+        model_id = f"model.{PACKAGE_NAME}.model_{model_index}"
+        if model_index < LAYER_SIZE:
+            depends_on = [f"source.{PACKAGE_NAME}.raw.table_{model_index % SOURCES_NUMBER}"]
+        else:
+            layer_start = (model_index // LAYER_SIZE - 1) * LAYER_SIZE
+            candidates = models_ids[max(0, layer_start - LAYER_SIZE):layer_start + LAYER_SIZE]
+            depends_on = generator.sample(candidates, generator.randint(1, 3))
+
+        tags = [tag for tag, share in SELECTORS_TAGS.items() if generator.random() < share]
+        nodes[model_id] = {
+            "unique_id": model_id,
+            "resource_type": "model",
+            "package_name": PACKAGE_NAME,
+            "name": f"model_{model_index}",
+            "fqn": [PACKAGE_NAME, f"model_{model_index}"],
+            "tags": tags,
+            "config": {"enabled": True, "materialized": "table", "tags": tags},
+            "depends_on": {"macros": [], "nodes": depends_on},
+        }
+        models_ids.append(model_id)
+
+        for test_type in ("not_null", "unique"):
+            test_name = f"{test_type}_model_{model_index}_id"
+            nodes[f"test.{PACKAGE_NAME}.{test_name}"] = _test_node(test_name, model_id, [model_id])
+
+    return {"nodes": nodes, "sources": sources, "exposures": {}, "metrics": {}}
+
+
+def make_selectors() -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": tag,
+            "definition": {"method": "tag", "value": tag, "parents": True, "indirect_selection": "eager"},
+        }
+        for tag in SELECTORS_TAGS
+    ]
@@ -1,114 +1,124 @@
-from datetime import datetime, timedelta
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import timedelta
+import hashlib
+import json
 import os
-import subprocess
+import time
 import uuid
-from typing import List, Optional
-from requests import request
-from psycopg2.pool import ThreadedConnectionPool
-from psycopg2.extras import DictCursor
-from fastapi.responses import JSONResponse
-from fastapi import APIRouter, HTTPException, status, Depends, BackgroundTasks, Request
-import google
-import google.auth.transport.requests
-from google.oauth2 import id_token
-
+from typing import Any, Dict, List, Optional
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
+from pydantic import BaseModel
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from lib.admission import Priority, admit_model_job, admit_models_jobs, get_capacity, get_retry_after
+from lib.db import get_pool, get_pool_settings, get_pool_stats
+from lib.dbt_engine import execute_dbt, list_selector_models, terminate_dbt_subprocesses
+from lib.job_notifier import get_job_notifier
+from lib.job_status_cache import get_job_status_cache
+from lib.jobs import (
+    BUILD_ACTION,
+    REJECTED_STATUS,
+    SUCCESS_STATUS,
+    TERMINAL_STATUSES,
+    AdmittedJob,
+    cancel_backend_queries,
+    cancel_job,
+    get_active_jobs_counts,
+    get_job_application_name,
+    get_jobs_statuses,
+    get_last_success,
+    get_nodes_results,
+    read_job_status,
+    set_input_fingerprint,
+)
 from lib.logger import get_logger
+from lib.metrics import (
+    DB_POOL_ACQUIRE_DURATION,
+    DB_POOL_ACQUIRE_TIMEOUTS,
+    JOBS_REJECTED,
+    JOBS_SKIPPED_UNCHANGED,
+    generate_metrics,
+    set_db_pool_connections,
+)
+from lib.model_inputs import get_input_fingerprint
+from lib.model_timings import get_models_stats
 
 logger = get_logger()
 
 router = APIRouter()
 
-DBT_JOBS_TABLE = "dbt_jobs"
+# upper bound of the time a /job call can wait for a status change
+MAX_JOB_WAIT = int(os.environ.get("MAX_JOB_WAIT", "120"))
+
+# comment sent on idle event streams so that proxies keep the connection open
+EVENTS_KEEP_ALIVE_INTERVAL = 15
 
-START_STATUS = "started"
+# jobs submitted or read by one /jobs call
+MAX_JOBS_BATCH_SIZE = int(os.environ.get("MAX_JOBS_BATCH_SIZE", "500"))
 
-SUCCESS_STATUS = "success"
+# actions of the jobs submitted to /jobs
+JOBS_ACTIONS = {"run", "test", BUILD_ACTION}
 
-FAILED_STATUS = "failed"
+# seconds a /command call waits for dbt before stopping it
+DBT_COMMAND_TIMEOUT = int(os.environ.get("DBT_COMMAND_TIMEOUT", "1200"))
 
+# days of timings read by the /stats calls, by default
+DEFAULT_STATS_DAYS = 7
 
-def run_dbt_command(arguments_list: List[str]):
-    command_arguments = ["dbt"] + arguments_list
-    res = subprocess.run(command_arguments, check=True)
-    if res.returncode == 1:
+# seconds a scrape waits for the jobs counts, the other metrics are served without them
+METRICS_DB_TIMEOUT = float(os.environ.get("METRICS_DB_TIMEOUT", "2"))
+
+
+async def run_dbt_command(arguments_list: List[str]):
+    # the sessions of the command are named to cancel their queries on timeout, and it runs in a
+    # dbt subprocess: a command of the warm engine cannot be stopped and would hold its lock
+    application_name = f"dbt-command-{uuid.uuid4()}"
+    loop = asyncio.get_event_loop()
+    execution = loop.run_in_executor(None, execute_dbt, arguments_list, application_name, True)
+    try:
+        success = await asyncio.wait_for(asyncio.shield(execution), timeout=DBT_COMMAND_TIMEOUT)
+    except asyncio.TimeoutError as e:
+        logger.error(f"dbt command {arguments_list} timed out after {DBT_COMMAND_TIMEOUT}s, stopping it")
+        async with acquire_db_connection() as connection:
+            await cancel_backend_queries(connection, application_name)
+        await loop.run_in_executor(None, terminate_dbt_subprocesses, application_name)
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="The dbt command timed out"
+        ) from e
+    if not success:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="The server could not execute your request"
         )
 
 
-async def get_db_cursor():
-    db_name = os.environ.get("PG_DBNAME", "postgres")
-    db_host = os.environ.get("PG_HOST", "localhost")
-    db_user = os.environ.get("PG_USER", "postgres")
-    db_password = os.environ.get("PG_PASSWORD", "postgres")
-    db_port = 5432
-    dsn = f"dbname='{db_name}' host='{db_host}' user='{db_user}' password='{db_password}' port={db_port}"
-    connection_pool = ThreadedConnectionPool(1, 10, dsn=dsn)
-    con = connection_pool.getconn()
-    con.autocommit = True
+@asynccontextmanager
+async def acquire_db_connection():
+    pool = get_pool()
+    start = time.perf_counter()
+    try:
+        connection = await pool.acquire(timeout=get_pool_settings()["acquire_timeout"])
+    except asyncio.TimeoutError as e:
+        DB_POOL_ACQUIRE_TIMEOUTS.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="No database connection available"
+        ) from e
+    DB_POOL_ACQUIRE_DURATION.observe(time.perf_counter() - start)
+    set_db_pool_connections(get_pool_stats())
     try:
-        yield con.cursor(cursor_factory=DictCursor)
+        yield connection
     finally:
-        connection_pool.putconn(con)
-
-
-def _start_job(cursor, model_name: str, run_or_test: str):
-    job_id = str(uuid.uuid4())
-    query = f"""
-    INSERT INTO {DBT_JOBS_TABLE} 
-    (job_id, model_name, test_or_run, status, c_date)
-    VALUES 
-    (%s, %s, %s, %s, %s)
-    """
-    cursor.execute(query, (job_id, model_name, run_or_test, START_STATUS, datetime.utcnow()))
-    return job_id
-
-
-def _update_job_status(cursor, job_id, job_status):
-    query = f"""
-    UPDATE {DBT_JOBS_TABLE}
-    SET status = %s
-    WHERE job_id = %s
-    """
-    cursor.execute(query, (job_status, job_id))
-
-
-def mark_job_as_success(cursor, job_id):
-    _update_job_status(cursor, job_id=job_id, job_status=SUCCESS_STATUS)
-
-
-def mark_job_as_failed(cursor, job_id):
-    _update_job_status(cursor, job_id=job_id, job_status=FAILED_STATUS)
-
-
-from pydantic import BaseModel
-
+        await pool.release(connection)
+        set_db_pool_connections(get_pool_stats())
 
-class DBTJob(BaseModel):
-    job_id: str
-    c_date: datetime
-    status: str
 
-
-def get_latest_job(cursor, model_name: str, run_or_test: str) -> Optional[DBTJob]:
-
-    query = f"""
-    SELECT 
-        job_id, 
-        c_date, 
-        status
-    FROM {DBT_JOBS_TABLE} 
-    WHERE model_name = %s and test_or_run = %s AND c_date >= %s
-    ORDER BY c_date DESC
-    LIMIT 1
-    """
-    cursor.execute(query, (model_name, run_or_test, datetime.utcnow() - timedelta(hours=1)))
-    res = cursor.fetchone()
-    if res:
-        return DBTJob(**dict(res))
-
-    return None
+async def get_db_connection():
+    async with acquire_db_connection() as connection:
+        yield connection
 
 
 @router.get("/")
@@ -117,104 +127,346 @@ def root():
 
 
 @router.post("/command", status_code=status.HTTP_201_CREATED)
-def run_dbt_command_api(command: str):
+async def run_dbt_command_api(command: str):
 
-    run_dbt_command(command.split(" "))
+    await run_dbt_command(command.split(" "))
 
 
-def run_dbt_job(cursor, job_id: str, model_name: str, run_or_test: str, current_url: str):
-    command = [run_or_test, "--select", model_name]
-    try:
+@router.get("/pool")
+async def get_db_pool_stats():
+    return get_pool_stats()
 
-        logger.info(f"Running job: {job_id}, command {command}")
-        current_url = current_url.replace("http://", "https://")
 
-        audiance = current_url
-        if not current_url.endswith("/"):
-            audiance += "/"
+async def read_active_jobs_counts():
+    async with get_pool().acquire() as connection:
+        return await get_active_jobs_counts(connection)
 
-        auth_req = google.auth.transport.requests.Request()
-        id_token = google.oauth2.id_token.fetch_id_token(auth_req, audiance)
 
-        command_endpoint = os.path.join(current_url, "command")
-        res = request(
-            method="POST",
-            url=command_endpoint,
-            params={"command": " ".join(command)},
-            headers={"Authorization": f"Bearer {id_token}"}
-        )
-        res.raise_for_status()
+@router.get("/metrics")
+async def get_metrics():
+    """Metrics of the web and job workers, in the Prometheus text format"""
+    # the metrics matter most when the database or its pool is unavailable
+    try:
+        jobs_counts = await asyncio.wait_for(read_active_jobs_counts(), timeout=METRICS_DB_TIMEOUT)
     except Exception as e:
-        logger.error(f"Encountered error for job {job_id}: {str(e)}")
-        mark_job_as_failed(cursor, job_id=job_id)
-        raise Exception(str(e)) from e
-    logger.info(f"Job {job_id} is successfull")
-    mark_job_as_success(cursor, job_id=job_id)
+        logger.warning(f"Jobs counts could not be read for the metrics: {str(e) or type(e).__name__}")
+        jobs_counts = None
+    return Response(content=generate_metrics(jobs_counts), media_type=CONTENT_TYPE_LATEST)
 
 
-def run_on_test_one_model(
-        cursor,
-        request: Request,
-        background_tasks: BackgroundTasks,
+async def run_on_test_one_model(
+        connection,
         model_name: str,
-        run_or_test: str
+        run_or_test: str,
+        priority: Priority = Priority.NORMAL,
+        skip_unchanged: bool = False
 ):
-    latest_job = get_latest_job(
-        cursor=cursor,
-        model_name=model_name,
-        run_or_test=run_or_test
-    )
+    input_fingerprint = None
+    if skip_unchanged:
+        input_fingerprint = await get_input_fingerprint(connection, model_name)
+    if input_fingerprint is not None:
+        last_success = await get_last_success(connection, model_name=model_name, run_or_test=run_or_test)
+        if last_success is not None and last_success["input_fingerprint"] == input_fingerprint:
+            JOBS_SKIPPED_UNCHANGED.labels(action=run_or_test).inc()
+            return {
+                "message": f"Model {run_or_test} {model_name} is skipped, its inputs did not change since the last success",
+                "job_id": last_success["job_id"],
+                "skip_job": True,
+            }
+
+    job = await admit_model_job(connection, model_name=model_name, action=run_or_test, priority=priority)
+    if job.created and input_fingerprint is not None:
+        await set_input_fingerprint(connection, job.job_id, input_fingerprint)
+
+    result = get_admission_result(job, model_name=model_name, run_or_test=run_or_test)
+    if job.status == REJECTED_STATUS:
+        retry_after = get_retry_after()
+        return JSONResponse(
+            content={**result, "retry_after": retry_after},
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(retry_after)}
+        )
+    return result
+
+
+def get_admission_result(job: AdmittedJob, model_name: str, run_or_test: str) -> Dict[str, Any]:
+    if job.status == REJECTED_STATUS:
+        JOBS_REJECTED.labels(action=run_or_test, limit=job.rejected_by).inc()
+        return {
+            "message": f"Model {run_or_test} {model_name} is rejected, the {job.rejected_by} limit is reached",
+            "job_id": None,
+            "skip_job": False,
+            "rejected_by": job.rejected_by,
+        }
 
     skip_job = False
-    if latest_job is None or latest_job.status == FAILED_STATUS:
-        # In this case we launch a new job
+    if job.created:
+        # the job is queued, it is run by the job workers
         message = f"Model {run_or_test} {model_name} is launched"
-        job_id = _start_job(cursor, model_name=model_name, run_or_test=run_or_test)
-        background_tasks.add_task(
-            run_dbt_job,
-            cursor=cursor,
-            job_id=job_id,
-            model_name=model_name,
-            run_or_test=run_or_test,
-            current_url=os.path.dirname(request.url._url)
-        )
     else:
         message = f"Model {run_or_test} {model_name} is already launched during a previous call"
-        job_id = latest_job.job_id
-        if latest_job.status == SUCCESS_STATUS:
+        if job.status == SUCCESS_STATUS:
             skip_job = True
 
-    return {"message": message, "job_id": job_id, "skip_job": skip_job}
+    return {"message": message, "job_id": job.job_id, "skip_job": skip_job}
 
 
 @router.post("/run_model", status_code=status.HTTP_201_CREATED)
-def run_one_model(model_name: str, request: Request, background_tasks: BackgroundTasks, cursor=Depends(get_db_cursor)):
-
-    return run_on_test_one_model(
-        cursor=cursor,
-        request=request,
-        background_tasks=background_tasks,
+async def run_one_model(
+        model_name: str,
+        priority: Priority = Priority.NORMAL,
+        skip_unchanged: bool = False,
+        connection=Depends(get_db_connection)
+):
+    """With skip_unchanged, the run is skipped when the inputs of the model did not change since its last success"""
+    return await run_on_test_one_model(
+        connection=connection,
         run_or_test="run",
-        model_name=model_name
+        model_name=model_name,
+        priority=priority,
+        skip_unchanged=skip_unchanged
     )
 
 
 @router.post("/test_model", status_code=status.HTTP_202_ACCEPTED)
-def test_one_model(model_name: str, request: Request, background_tasks: BackgroundTasks, cursor=Depends(get_db_cursor)):
-    return run_on_test_one_model(
-        cursor=cursor,
-        request=request,
-        background_tasks=background_tasks,
+async def test_one_model(model_name: str, priority: Priority = Priority.NORMAL, connection=Depends(get_db_connection)):
+    return await run_on_test_one_model(
+        connection=connection,
         run_or_test="test",
-        model_name=model_name
+        model_name=model_name,
+        priority=priority
+    )
+
+
+@router.post("/build_model", status_code=status.HTTP_201_CREATED)
+async def build_models(model_name: str, priority: Priority = Priority.NORMAL, connection=Depends(get_db_connection)):
+    """Run and test the models of model_name, separated by spaces, with one dbt build"""
+    models_names = model_name.split()
+    if not models_names:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="No model to build")
+
+    return await run_on_test_one_model(
+        connection=connection,
+        run_or_test=BUILD_ACTION,
+        model_name=" ".join(models_names),
+        priority=priority
     )
 
 
+class JobRequest(BaseModel):
+    model_name: str
+    run_or_test: str
+    priority: Priority = Priority.NORMAL
+
+
+@router.post("/jobs")
+async def submit_jobs(job_requests: List[JobRequest], connection=Depends(get_db_connection)):
+    """
+    Admit the jobs of several models in one transaction, each answered as by /run_model,
+    /test_model or /build_model, in the order of the requests. The rejected jobs have a
+    rejected_by and no job_id: the response has a Retry-After, and is a 429 when all the
+    jobs are rejected, a 200 otherwise.
+    """
+    if not job_requests or len(job_requests) > MAX_JOBS_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Between 1 and {MAX_JOBS_BATCH_SIZE} jobs can be submitted at once"
+        )
+    submissions = []
+    for job_request in job_requests:
+        models_names = job_request.model_name.split()
+        if job_request.run_or_test not in JOBS_ACTIONS or not models_names:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Invalid job: {job_request.run_or_test} {job_request.model_name}"
+            )
+        submissions.append((" ".join(models_names), job_request.run_or_test, job_request.priority))
+
+    jobs = await admit_models_jobs(connection, submissions)
+    results = [
+        {"model_name": model_name, "run_or_test": run_or_test, **get_admission_result(job, model_name, run_or_test)}
+        for (model_name, run_or_test, _), job in zip(submissions, jobs)
+    ]
+    rejected_jobs = sum(job.status == REJECTED_STATUS for job in jobs)
+    if rejected_jobs:
+        retry_after = get_retry_after()
+        return JSONResponse(
+            content={"jobs": results, "retry_after": retry_after},
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS if rejected_jobs == len(jobs) else status.HTTP_200_OK,
+            headers={"Retry-After": str(retry_after)}
+        )
+    return {"jobs": results}
+
+
+@router.get("/jobs")
+async def get_jobs_statuses_api(request: Request, ids: str):
+    """
+    Status of the jobs of ids, separated by commas, None for the unknown ones. Answered 304
+    when the statuses match the ETag sent in If-None-Match.
+    """
+    jobs_ids = list(dict.fromkeys(job_id.strip() for job_id in ids.split(",") if job_id.strip()))
+    if not jobs_ids or len(jobs_ids) > MAX_JOBS_BATCH_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Between 1 and {MAX_JOBS_BATCH_SIZE} jobs can be read at once"
+        )
+
+    cache = get_job_status_cache()
+    cached_jobs = {}
+    for job_id in jobs_ids:
+        cached, job_status = cache.get(job_id)
+        if cached:
+            cached_jobs[job_id] = job_status
+    uncached_jobs_ids = [job_id for job_id in jobs_ids if job_id not in cached_jobs]
+    if uncached_jobs_ids:
+        # no connection is taken when all the statuses are cached
+        async with acquire_db_connection() as connection:
+            statuses = await get_jobs_statuses(connection, uncached_jobs_ids)
+        uncached_jobs = {job_id: statuses.get(job_id) for job_id in uncached_jobs_ids}
+        cache.put_many(uncached_jobs)
+        cached_jobs.update(uncached_jobs)
+    jobs = {job_id: cached_jobs[job_id] for job_id in jobs_ids}
+    etag = '"' + hashlib.sha1(json.dumps(jobs, sort_keys=True).encode()).hexdigest() + '"'
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return JSONResponse(content={"jobs": jobs}, headers={"ETag": etag})
+
+
+@router.get("/capacity")
+async def get_jobs_capacity(connection=Depends(get_db_connection)):
+    """Limits and active jobs of the actions and schemas, for the callers to back off"""
+    return await get_capacity(connection)
+
+
+async def fetch_job_status(job_id: str) -> Optional[str]:
+    cache = get_job_status_cache()
+    cached, job_status = cache.get(job_id)
+    if cached:
+        return job_status
+
+    # the connection is only held for the query, not while waiting for a status change
+    async with acquire_db_connection() as connection:
+        job_status = await read_job_status(connection, job_id)
+    cache.put(job_id, job_status)
+    return job_status
+
+
+def _job_not_found(job_id: str) -> JSONResponse:
+    return JSONResponse(content={"message": f"job {job_id} not found"}, status_code=status.HTTP_404_NOT_FOUND)
+
+
 @router.get("/job")
-def get_job_status(job_id: str, cursor=Depends(get_db_cursor)):
-    query = """SELECT status FROM dbt_jobs WHERE job_id=%s"""
-    cursor.execute(query, (job_id,))
-    res = cursor.fetchone()
-    if res is None:
-        return JSONResponse(content={"message": f"job {job_id} not found"}, status_code=status.HTTP_404_NOT_FOUND)
-    return {"job_status": res[0]}
\ No newline at end of file
+async def get_job_status(job_id: str, wait: int = Query(0, ge=0, le=MAX_JOB_WAIT)):
+    """
+    Status of the job. With wait > 0, a running job is answered as soon as its status
+    changes, or after wait seconds.
+    """
+    notifier = get_job_notifier()
+    # subscribe before reading the status, to not miss a change in between
+    status_queue = notifier.subscribe(job_id)
+    try:
+        job_status = await fetch_job_status(job_id)
+        if job_status is None:
+            return _job_not_found(job_id)
+
+        if wait and job_status not in TERMINAL_STATUSES:
+            try:
+                job_status = await asyncio.wait_for(status_queue.get(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        notifier.unsubscribe(job_id, status_queue)
+
+    return {"job_status": job_status}
+
+
+@router.post("/job/{job_id}/cancel")
+async def cancel_running_job(job_id: str, connection=Depends(get_db_connection)):
+    """Cancel a queued or started job, its queries are cancelled at once"""
+    cancelled, job_status = await cancel_job(connection, job_id)
+    if job_status is None:
+        return _job_not_found(job_id)
+    if not cancelled:
+        return JSONResponse(
+            content={"message": f"job {job_id} is already finished", "job_status": job_status},
+            status_code=status.HTTP_409_CONFLICT
+        )
+
+    # the worker of a started job stops its dbt command once notified
+    await cancel_backend_queries(connection, get_job_application_name(job_id))
+    return {"job_status": job_status}
+
+
+@router.get("/job/nodes")
+async def get_job_nodes(job_id: str, connection=Depends(get_db_connection)):
+    """Status of each node run by a build job"""
+    if await read_job_status(connection, job_id) is None:
+        return _job_not_found(job_id)
+
+    return {"nodes": await get_nodes_results(connection, job_id)}
+
+
+async def _job_status_events(job_id: str, job_status: str, status_queue: asyncio.Queue):
+    try:
+        yield f"event: status\ndata: {json.dumps({'job_status': job_status})}\n\n"
+        while job_status not in TERMINAL_STATUSES:
+            try:
+                job_status = await asyncio.wait_for(status_queue.get(), timeout=EVENTS_KEEP_ALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: status\ndata: {json.dumps({'job_status': job_status})}\n\n"
+    finally:
+        get_job_notifier().unsubscribe(job_id, status_queue)
+
+
+@router.get("/job/events")
+async def stream_job_status(job_id: str):
+    """Server-sent events stream of the job statuses, closed once the job is finished"""
+    notifier = get_job_notifier()
+    status_queue = notifier.subscribe(job_id)
+    try:
+        job_status = await fetch_job_status(job_id)
+    except Exception:
+        notifier.unsubscribe(job_id, status_queue)
+        raise
+    if job_status is None:
+        notifier.unsubscribe(job_id, status_queue)
+        return _job_not_found(job_id)
+
+    return StreamingResponse(
+        _job_status_events(job_id, job_status, status_queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
+
+
+@router.get("/stats/models")
+async def get_models_durations(
+        days: int = Query(DEFAULT_STATS_DAYS, ge=1),
+        model_name: Optional[List[str]] = Query(None),
+        connection=Depends(get_db_connection)
+):
+    """p50 and p95 durations of the successful runs of the models (or of each model_name) over the last days"""
+    models_stats = await get_models_stats(connection, window=timedelta(days=days), models_names=model_name)
+    return {"days": days, "models": models_stats}
+
+
+@router.get("/stats/selectors/{selector_name}")
+async def get_selector_slowest_models(
+        selector_name: str,
+        days: int = Query(DEFAULT_STATS_DAYS, ge=1),
+        limit: int = Query(10, ge=1),
+        connection=Depends(get_db_connection)
+):
+    """Slowest models of the selector over the last days, by p95 duration"""
+    models_names = await asyncio.get_event_loop().run_in_executor(None, list_selector_models, selector_name)
+    if models_names is None:
+        return JSONResponse(
+            content={"message": f"selector {selector_name} not found"}, status_code=status.HTTP_404_NOT_FOUND
+        )
+
+    models_stats = await get_models_stats(
+        connection, window=timedelta(days=days), models_names=models_names, limit=limit
+    )
+    return {"selector": selector_name, "days": days, "models": models_stats}
@@ -1,8 +1,59 @@
 """gunicorn server configuration."""
 import os
+import shutil
+import subprocess
+import sys
 
 threads = 2  # pylint: disable=invalid-name
 workers = 2  # pylint: disable=invalid-name
 timeout = 0  # pylint: disable=invalid-name
 bind = f":{os.environ.get('PORT', '8000')}"  # pylint: disable=invalid-name
 worker_class = "uvicorn.workers.UvicornWorker"  # pylint: disable=invalid-name
+
+# the web and job workers write their metrics in this directory, aggregated by /metrics
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_metrics")
+
+# seconds given to the supervisor to stop the job workers before it is killed
+SUPERVISOR_STOP_TIMEOUT = 30
+
+# process of the job queue supervisor, the master only keeps its handle: the application is not
+# imported in the master, whose forked web workers would inherit its threads and clients
+SUPERVISOR_PROCESS = None
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Remove the metrics files of the workers of a previous server"""
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def when_ready(server):  # pylint: disable=unused-argument
+    """Start the dbt job workers once, next to the web workers"""
+    global SUPERVISOR_PROCESS  # pylint: disable=global-statement
+    SUPERVISOR_PROCESS = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "lib.job_queue"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+
+
+def on_exit(server):  # pylint: disable=unused-argument
+    if SUPERVISOR_PROCESS is not None:
+        SUPERVISOR_PROCESS.terminate()
+        try:
+            SUPERVISOR_PROCESS.wait(SUPERVISOR_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            SUPERVISOR_PROCESS.kill()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drop the live gauges of an exited web worker"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def worker_exit(server, worker):  # pylint: disable=unused-argument
+    """Write the log records still queued by the web worker"""
+    from lib.logger import shutdown_logger  # pylint: disable=import-outside-toplevel
+
+    shutdown_logger()
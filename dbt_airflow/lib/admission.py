@@ -0,0 +1,145 @@
+"""Admission control of the dbt jobs submitted to the API.
+
+The queued and started jobs of an action, and of a target schema (the schema of the first
+model of the job), are limited: a new job over a limit is rejected and the caller told when
+to retry. A low priority job over a limit waits in the queue instead, claimed after the
+other jobs, as long as the queued low priority jobs fit in the wait queue.
+
+    DBT_RUN_MAX_ACTIVE_JOBS / DBT_TEST_MAX_ACTIVE_JOBS / DBT_BUILD_MAX_ACTIVE_JOBS
+    DBT_SCHEMA_MAX_ACTIVE_JOBS, overridden by schema with DBT_SCHEMAS_MAX_ACTIVE_JOBS=public=20,marts=5
+    DBT_WAIT_QUEUE_SIZE, DBT_ADMISSION_RETRY_AFTER
+
+A limit of 0 disables it.
+"""
+import asyncio
+import os
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+from lib.dbt_engine import get_model_schema
+from lib.jobs import (
+    BUILD_ACTION,
+    QUEUED_STATUS,
+    AdmittedJob,
+    JobSubmission,
+    admit_job,
+    admit_jobs,
+    get_active_jobs_groups,
+)
+
+# queued and started jobs of each action, DBT_<ACTION>_MAX_ACTIVE_JOBS
+DEFAULT_ACTIONS_LIMITS = {
+    "run": 100,
+    "test": 100,
+    BUILD_ACTION: 20,
+}
+
+
+class Priority(str, Enum):
+    NORMAL = "normal"
+    # waits in the queue rather than being rejected over the limits
+    LOW = "low"
+
+
+def _get_limit(value: str) -> Optional[int]:
+    limit = int(value)
+    return limit if limit > 0 else None
+
+
+def get_action_limit(action: str) -> Optional[int]:
+    return _get_limit(os.environ.get(f"DBT_{action.upper()}_MAX_ACTIVE_JOBS", str(DEFAULT_ACTIONS_LIMITS.get(action, 0))))
+
+
+def get_schemas_limits() -> Dict[str, Optional[int]]:
+    schemas_limits = {}
+    for schema_limit in os.environ.get("DBT_SCHEMAS_MAX_ACTIVE_JOBS", "").split(","):
+        if schema_limit.strip():
+            schema, limit = schema_limit.split("=")
+            schemas_limits[schema.strip()] = _get_limit(limit)
+    return schemas_limits
+
+
+def get_schema_limit(schema: str) -> Optional[int]:
+    schemas_limits = get_schemas_limits()
+    if schema in schemas_limits:
+        return schemas_limits[schema]
+    return _get_limit(os.environ.get("DBT_SCHEMA_MAX_ACTIVE_JOBS", "0"))
+
+
+def get_wait_queue_size() -> int:
+    return int(os.environ.get("DBT_WAIT_QUEUE_SIZE", "100"))
+
+
+def get_retry_after() -> int:
+    """Seconds a rejected caller waits before submitting again"""
+    return int(os.environ.get("DBT_ADMISSION_RETRY_AFTER", "30"))
+
+
+async def get_target_schemas(models_names: List[str]) -> List[Optional[str]]:
+    """Schemas of the first model of each job, read out of the event loop, the manifest file may be loaded"""
+    def get_schemas():
+        return [get_model_schema(model_name.split()[0]) for model_name in models_names]
+
+    return await asyncio.get_event_loop().run_in_executor(None, get_schemas)
+
+
+async def admit_model_job(connection, model_name: str, action: str, priority: Priority = Priority.NORMAL) -> AdmittedJob:
+    """Admit a job of the models of model_name, separated by spaces, within the limits"""
+    target_schema, = await get_target_schemas([model_name])
+    return await admit_job(
+        connection,
+        model_name=model_name,
+        run_or_test=action,
+        target_schema=target_schema,
+        low_priority=priority == Priority.LOW,
+        action_limit=get_action_limit(action),
+        schema_limit=get_schema_limit(target_schema) if target_schema is not None else None,
+        wait_queue_size=get_wait_queue_size(),
+    )
+
+
+async def admit_models_jobs(connection, submissions: List[Tuple[str, str, Priority]]) -> List[AdmittedJob]:
+    """Admit the jobs of the (model_name, action, priority) submissions within the limits, in one transaction"""
+    jobs_submissions = []
+    target_schemas = await get_target_schemas([model_name for model_name, _, _ in submissions])
+    for (model_name, action, priority), target_schema in zip(submissions, target_schemas):
+        jobs_submissions.append(JobSubmission(
+            model_name=model_name,
+            run_or_test=action,
+            target_schema=target_schema,
+            low_priority=priority == Priority.LOW,
+            action_limit=get_action_limit(action),
+            schema_limit=get_schema_limit(target_schema) if target_schema is not None else None,
+        ))
+    return await admit_jobs(connection, jobs_submissions, wait_queue_size=get_wait_queue_size())
+
+
+def _get_capacity_entry(limit: Optional[int]) -> Dict[str, Any]:
+    return {"limit": limit, "queued": 0, "started": 0}
+
+
+async def get_capacity(connection) -> Dict[str, Any]:
+    """Active jobs and limits of the actions and schemas, and the low priority jobs waiting"""
+    actions = {action: _get_capacity_entry(get_action_limit(action)) for action in DEFAULT_ACTIONS_LIMITS}
+    schemas = {schema: _get_capacity_entry(limit) for schema, limit in get_schemas_limits().items()}
+    waiting = 0
+    for group in await get_active_jobs_groups(connection):
+        action, schema, job_status = group["test_or_run"], group["target_schema"], group["status"]
+        if action not in actions:
+            actions[action] = _get_capacity_entry(get_action_limit(action))
+        actions[action][job_status] += group["jobs"]
+        if schema is not None:
+            if schema not in schemas:
+                schemas[schema] = _get_capacity_entry(get_schema_limit(schema))
+            schemas[schema][job_status] += group["jobs"]
+        if group["low_priority"] and job_status == QUEUED_STATUS:
+            waiting += group["jobs"]
+
+    for entry in [*actions.values(), *schemas.values()]:
+        entry["available"] = None if entry["limit"] is None else max(0, entry["limit"] - entry["queued"] - entry["started"])
+    return {
+        "actions": actions,
+        "schemas": schemas,
+        "wait_queue": {"size": get_wait_queue_size(), "waiting": waiting},
+        "retry_after": get_retry_after(),
+    }
@@ -0,0 +1,72 @@
+"""Postgres connection pool shared by all the requests of a worker process."""
+import os
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+POOL: Optional[asyncpg.Pool] = None
+
+
+def get_pool_settings() -> Dict[str, Any]:
+    return {
+        "min_size": int(os.environ.get("PG_POOL_MIN_SIZE", "1")),
+        "max_size": int(os.environ.get("PG_POOL_MAX_SIZE", "10")),
+        # seconds to wait for a free connection before giving up
+        "acquire_timeout": float(os.environ.get("PG_POOL_ACQUIRE_TIMEOUT", "10")),
+        # milliseconds, enforced by the server on every statement
+        "statement_timeout": int(os.environ.get("PG_STATEMENT_TIMEOUT", "30000")),
+    }
+
+
+def get_connection_settings() -> Dict[str, Any]:
+    return {
+        "database": os.environ.get("PG_DBNAME", "postgres"),
+        "host": os.environ.get("PG_HOST", "localhost"),
+        "user": os.environ.get("PG_USER", "postgres"),
+        "password": os.environ.get("PG_PASSWORD", "postgres"),
+        "port": 5432,
+    }
+
+
+async def create_connection() -> asyncpg.Connection:
+    """A connection kept outside of the pool, for long-lived sessions such as LISTEN"""
+    return await asyncpg.connect(**get_connection_settings())
+
+
+async def create_pool() -> asyncpg.Pool:
+    global POOL
+    if POOL is None:
+        settings = get_pool_settings()
+        POOL = await asyncpg.create_pool(
+            **get_connection_settings(),
+            min_size=settings["min_size"],
+            max_size=settings["max_size"],
+            server_settings={"statement_timeout": str(settings["statement_timeout"])},
+        )
+    return POOL
+
+
+async def close_pool():
+    global POOL
+    if POOL is not None:
+        await POOL.close()
+        POOL = None
+
+
+def get_pool() -> asyncpg.Pool:
+    if POOL is None:
+        raise RuntimeError("The database pool is not created, it is done at application startup")
+    return POOL
+
+
+def get_pool_stats() -> Dict[str, int]:
+    pool = get_pool()
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    return {
+        "min_size": pool.get_min_size(),
+        "max_size": pool.get_max_size(),
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+    }
@@ -0,0 +1,336 @@
+"""In-process dbt execution engine.
+
+The engine keeps the parsed manifest of the project in memory and hands it to
+dbt's programmatic runner, so a job only pays for the SQL it executes. The
+project is parsed again only when one of its files changes.
+"""
+import hashlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from dbt.cli.main import dbtRunner
+
+from lib.logger import get_logger, use_cloud_logger
+from lib.metrics import observe_dbt_command
+
+logger = get_logger()
+
+WARM_ENGINE = "warm"
+
+SUBPROCESS_ENGINE = "subprocess"
+
+# files and directories whose changes invalidate the parsed manifest
+PROJECT_FILES = ["dbt_project.yml", "profiles.yml", "selectors.yml", "packages.yml"]
+
+PROJECT_DIRECTORIES = ["models", "macros", "tests", "snapshots", "analysis", "data", "seeds"]
+
+# artifact of the dbt commands with the result of each node
+RUN_RESULTS_FILE = "run_results.json"
+
+# artifact of the dbt commands with the parsed project, in the default target path
+MANIFEST_FILE = os.path.join("target", "manifest.json")
+
+# application_name of the dbt database sessions, read by profiles.yml
+APPLICATION_NAME_VARIABLE = "DBT_APPLICATION_NAME"
+
+DEFAULT_APPLICATION_NAME = "dbt"
+
+# seconds given to a stopped dbt process to exit before it is killed
+TERMINATE_GRACE_PERIOD = 10
+
+# dbt processes being run, by the application name of their sessions
+RUNNING_PROCESSES: Dict[str, subprocess.Popen] = {}
+
+# levels of the dbt events forwarded to the logger, the debug events are not
+DBT_EVENTS_LEVELS = {"info": logging.INFO, "warn": logging.WARNING, "error": logging.ERROR}
+
+ENGINE = None
+
+# modification time and inputs of the models of the manifest file, read by the subprocess engine
+MANIFEST_MODELS: Tuple[Optional[float], Dict[str, "ModelInputs"]] = (None, {})
+
+
+class DBTEngineError(Exception):
+    pass
+
+
+class ModelInputs(NamedTuple):
+    """What a model is built from, according to the manifest"""
+    schema: str
+    # of the SQL and config of the model
+    checksum: str
+    # relation names and loaded_at_field (None without freshness) of the upstream sources
+    sources: List[Tuple[str, Optional[str]]]
+    # upstream models, and seeds with the checksum of their file
+    models: List[str]
+    seeds: List[Tuple[str, str]]
+    # upstream nodes whose changes can not be known: snapshots, ephemeral models
+    opaque: bool
+
+
+def get_models_inputs(nodes: Dict[str, Any], sources: Dict[str, Any]) -> Dict[str, ModelInputs]:
+    """Inputs of the models of the manifest nodes, read as attributes (dbt objects or the parsed manifest.json)"""
+    models_inputs = {}
+    for node in nodes.values():
+        if node.resource_type != "model":
+            continue
+        upstream_sources, models, seeds, opaque = [], [], [], False
+        for unique_id in node.depends_on.nodes:
+            if unique_id in sources:
+                source = sources[unique_id]
+                upstream_sources.append((source.relation_name, source.loaded_at_field))
+                continue
+            upstream_node = nodes.get(unique_id)
+            if upstream_node is None:
+                opaque = True
+            elif upstream_node.resource_type == "seed":
+                seeds.append((upstream_node.name, upstream_node.checksum.checksum))
+            elif upstream_node.resource_type == "model" and upstream_node.config.materialized != "ephemeral":
+                models.append(upstream_node.name)
+            else:
+                opaque = True
+        models_inputs[node.name] = ModelInputs(
+            schema=node.schema,
+            checksum=node.checksum.checksum,
+            sources=upstream_sources,
+            models=models,
+            seeds=seeds,
+            opaque=opaque,
+        )
+    return models_inputs
+
+
+def log_dbt_event(event):
+    """Log a dbt event as a structured record, with the node it is about"""
+    level = DBT_EVENTS_LEVELS.get(event.info.level)
+    if level is None:
+        return
+    json_fields = {"dbt_event": event.info.name}
+    node_info = getattr(event.data, "node_info", None)
+    if node_info is not None and node_info.unique_id:
+        json_fields["node_id"] = node_info.unique_id
+    logging.getLogger("dbt_events").log(level, event.info.msg, extra={"json_fields": json_fields})
+
+
+def get_project_fingerprint(project_dir: str) -> str:
+    """Hash of the paths, sizes and modification times of the project files"""
+    fingerprint = hashlib.sha1()
+    paths = [os.path.join(project_dir, file_name) for file_name in PROJECT_FILES]
+    for directory in PROJECT_DIRECTORIES:
+        for root, _, files_names in os.walk(os.path.join(project_dir, directory)):
+            paths.extend(os.path.join(root, file_name) for file_name in files_names)
+
+    for file_path in sorted(paths):
+        try:
+            file_stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        fingerprint.update(f"{file_path}:{file_stat.st_size}:{file_stat.st_mtime_ns};".encode())
+
+    return fingerprint.hexdigest()
+
+
+class DBTEngine:
+    """Runs dbt commands in the current process, reusing the parsed manifest between jobs.
+
+    dbt keeps global state (flags, adapters, event logger) while a command runs, so the
+    commands of one process are serialized.
+    """
+
+    def __init__(self, project_dir: Optional[str] = None):
+        self.project_dir = project_dir or os.environ.get("DBT_PROJECT_DIR", os.getcwd())
+        self._lock = threading.Lock()
+        self._manifest = None
+        self._fingerprint = None
+        self._models_inputs: Optional[Dict[str, ModelInputs]] = None
+        # with Cloud Logging, the dbt events are logged as structured records rather than printed
+        self._callbacks = [log_dbt_event] if use_cloud_logger() else []
+        self._global_flags = ["--quiet", "--no-use-colors"] if self._callbacks else []
+
+    def _parse_project(self):
+        fingerprint = get_project_fingerprint(self.project_dir)
+        if self._manifest is not None and fingerprint == self._fingerprint:
+            return
+
+        logger.info(f"Parsing dbt project {self.project_dir}")
+        res = dbtRunner(callbacks=self._callbacks).invoke([*self._global_flags, "parse", "--project-dir", self.project_dir])
+        if not res.success:
+            raise DBTEngineError(f"dbt project could not be parsed: {res.exception}")
+
+        self._manifest = res.result
+        self._fingerprint = fingerprint
+        self._models_inputs = get_models_inputs(self._manifest.nodes, self._manifest.sources)
+
+    def warm_up(self):
+        with self._lock:
+            self._parse_project()
+
+    def invoke(self, arguments_list: List[str], application_name: Optional[str] = None) -> bool:
+        with self._lock:
+            self._parse_project()
+            # read by profiles.yml when dbt opens its connections, restored for the next commands
+            process_application_name = os.environ.get(APPLICATION_NAME_VARIABLE)
+            os.environ[APPLICATION_NAME_VARIABLE] = application_name or get_application_name()
+            try:
+                res = dbtRunner(manifest=self._manifest, callbacks=self._callbacks).invoke(
+                    [*self._global_flags, *arguments_list]
+                )
+            finally:
+                if process_application_name is None:
+                    os.environ.pop(APPLICATION_NAME_VARIABLE, None)
+                else:
+                    os.environ[APPLICATION_NAME_VARIABLE] = process_application_name
+
+        if res.exception is not None:
+            logger.error(f"dbt command {arguments_list} raised: {res.exception}")
+        return res.success
+
+    def list_models(self, selector_name: str) -> Optional[List[str]]:
+        with self._lock:
+            self._parse_project()
+            res = dbtRunner(manifest=self._manifest).invoke(["--quiet", *get_list_models_arguments(selector_name)])
+        return res.result if res.success else None
+
+    def get_models_inputs(self) -> Optional[Dict[str, ModelInputs]]:
+        """
+        Inputs of the models of the last parsed manifest, None if the project was never parsed.
+        The project is not parsed here, to never wait for the running command.
+        """
+        return self._models_inputs
+
+
+def get_list_models_arguments(selector_name: str) -> List[str]:
+    return ["ls", "--selector", selector_name, "--resource-type", "model", "--output", "name"]
+
+
+def get_dbt_engine() -> DBTEngine:
+    global ENGINE
+    if ENGINE is None:
+        ENGINE = DBTEngine()
+    return ENGINE
+
+
+def use_warm_engine() -> bool:
+    return os.environ.get("DBT_EXECUTION_ENGINE", WARM_ENGINE) != SUBPROCESS_ENGINE
+
+
+def get_application_name() -> str:
+    return os.environ.get(APPLICATION_NAME_VARIABLE, DEFAULT_APPLICATION_NAME)
+
+
+def run_dbt_subprocess(arguments_list: List[str], application_name: Optional[str] = None) -> bool:
+    """Run dbt in a fresh interpreter, paying for imports and project parsing on each call"""
+    application_name = application_name or get_application_name()
+    # in its own process group, stopped with the processes it starts
+    process = subprocess.Popen(
+        ["dbt"] + arguments_list, start_new_session=True, env={**os.environ, APPLICATION_NAME_VARIABLE: application_name}
+    )
+    RUNNING_PROCESSES[application_name] = process
+    try:
+        return process.wait() == 0
+    finally:
+        RUNNING_PROCESSES.pop(application_name, None)
+
+
+def _signal_process_group(process: subprocess.Popen, signal_number: int):
+    try:
+        os.killpg(process.pid, signal_number)
+    except ProcessLookupError:
+        pass
+
+
+def terminate_dbt_subprocesses(application_name: Optional[str] = None, grace_period: float = TERMINATE_GRACE_PERIOD):
+    """
+    Stop the process group of the dbt subprocess of the application, or of all of them: SIGTERM,
+    then SIGKILL for the processes still running after the grace period.
+    """
+    processes = [
+        process for name, process in list(RUNNING_PROCESSES.items()) if application_name in (None, name)
+    ]
+    for process in processes:
+        _signal_process_group(process, signal.SIGTERM)
+    deadline = time.monotonic() + grace_period
+    for process in processes:
+        try:
+            process.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            pass
+        # the children of dbt may outlive it
+        _signal_process_group(process, signal.SIGKILL)
+
+
+def execute_dbt(arguments_list: List[str], application_name: Optional[str] = None, in_subprocess: bool = False) -> bool:
+    """
+    Run the dbt command, its database sessions named application_name (by default the
+    DBT_APPLICATION_NAME of the process) to cancel their queries when it is stopped.
+    With in_subprocess, the command runs in a dbt subprocess whatever the engine, to be
+    stopped with terminate_dbt_subprocesses rather than waited for.
+    """
+    start = time.perf_counter()
+    success = False
+    try:
+        if use_warm_engine() and not in_subprocess:
+            success = get_dbt_engine().invoke(arguments_list, application_name)
+        else:
+            success = run_dbt_subprocess(arguments_list, application_name)
+        return success
+    finally:
+        observe_dbt_command(arguments_list, success, time.perf_counter() - start)
+
+
+def list_selector_models(selector_name: str) -> Optional[List[str]]:
+    """Names of the models of the selector, None if the project has no such selector"""
+    if use_warm_engine():
+        return get_dbt_engine().list_models(selector_name)
+
+    res = subprocess.run(
+        ["dbt", "--quiet", *get_list_models_arguments(selector_name)], check=False, capture_output=True, text=True
+    )
+    if res.returncode != 0:
+        return None
+    return res.stdout.split()
+
+
+def read_models_inputs(manifest_path: str) -> Dict[str, ModelInputs]:
+    """Inputs of the models of a manifest file, read again only when it changes"""
+    global MANIFEST_MODELS
+    try:
+        mtime = os.stat(manifest_path).st_mtime
+    except FileNotFoundError:
+        return {}
+    if mtime != MANIFEST_MODELS[0]:
+        with open(manifest_path) as f:
+            manifest = json.load(f, object_hook=lambda fields: SimpleNamespace(**fields))
+        MANIFEST_MODELS = (mtime, get_models_inputs(vars(manifest.nodes), vars(manifest.sources)))
+    return MANIFEST_MODELS[1]
+
+
+def get_model_inputs(model_name: str) -> Optional[ModelInputs]:
+    """Inputs of the model, None if the model is unknown or the project was never parsed"""
+    if use_warm_engine():
+        models_inputs = get_dbt_engine().get_models_inputs()
+        return models_inputs.get(model_name) if models_inputs is not None else None
+    project_dir = os.environ.get("DBT_PROJECT_DIR", os.getcwd())
+    return read_models_inputs(os.path.join(project_dir, MANIFEST_FILE)).get(model_name)
+
+
+def get_model_schema(model_name: str) -> Optional[str]:
+    """Schema the model is built in"""
+    model_inputs = get_model_inputs(model_name)
+    return model_inputs.schema if model_inputs is not None else None
+
+
+def read_run_results(target_path: str) -> List[Dict[str, Any]]:
+    """Results of the nodes of the dbt command written in target_path, none if it did not finish"""
+    try:
+        with open(os.path.join(target_path, RUN_RESULTS_FILE)) as f:
+            return json.load(f)["results"]
+    except FileNotFoundError:
+        return []
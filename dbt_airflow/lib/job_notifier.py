@@ -0,0 +1,82 @@
+"""Dispatch of the jobs status changes published by Postgres (LISTEN/NOTIFY).
+
+Every worker process keeps one connection listening on JOB_STATUS_CHANNEL and
+forwards each notification to the requests waiting on that job, so waiting
+clients do not query the jobs table again and again. The notified statuses also
+replace the ones of the job status cache.
+"""
+import asyncio
+import json
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+import asyncpg
+
+from lib.db import create_connection
+from lib.job_status_cache import get_job_status_cache
+from lib.jobs import JOB_STATUS_CHANNEL
+from lib.logger import get_logger
+
+logger = get_logger()
+
+NOTIFIER = None
+
+
+class JobStatusNotifier:
+
+    def __init__(self):
+        self._connection: Optional[asyncpg.Connection] = None
+        self._waiters: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    async def start(self):
+        self._connection = await create_connection()
+        self._connection.add_termination_listener(self._on_termination)
+        await self._connection.add_listener(JOB_STATUS_CHANNEL, self._on_notification)
+
+    async def stop(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            await connection.close()
+
+    def _on_termination(self, connection):
+        if self._connection is not connection:
+            # stopped on purpose
+            return
+        logger.error("Job status listener connection lost, reconnecting")
+        asyncio.get_event_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while True:
+            try:
+                await self.start()
+                return
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error(f"Could not reconnect the job status listener: {e}")
+                await asyncio.sleep(1)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        notification = json.loads(payload)
+        get_job_status_cache().put(notification["job_id"], notification["status"])
+        for queue in self._waiters.get(notification["job_id"], ()):
+            queue.put_nowait(notification["status"])
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        """Queue receiving the new statuses of the job until unsubscribe is called"""
+        queue = asyncio.Queue()
+        self._waiters[job_id].add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        waiters = self._waiters.get(job_id)
+        if waiters is None:
+            return
+        waiters.discard(queue)
+        if not waiters:
+            del self._waiters[job_id]
+
+
+def get_job_notifier() -> JobStatusNotifier:
+    global NOTIFIER
+    if NOTIFIER is None:
+        NOTIFIER = JobStatusNotifier()
+    return NOTIFIER
@@ -0,0 +1,401 @@
+"""Workers running the dbt jobs queued in the dbt_jobs table.
+
+Each pool (dbt_run, dbt_test, as the Airflow pools) has a fixed number of worker
+processes. A worker claims the oldest queued job of its pool with FOR UPDATE SKIP LOCKED,
+runs it on its warm dbt engine and marks it as success or failed. While a job runs, its
+worker sends heartbeats; the jobs of a worker that stopped sending them (crash, restart)
+are put back in the queue.
+
+A job running longer than the timeout of its action or models, or cancelled, is stopped:
+the queries of its database sessions (named after the job) are cancelled and the dbt
+processes are terminated with their process group. A worker whose dbt command does not
+return after that exits, to be replaced by the supervisor.
+
+The supervisor starting and watching the workers runs in its own process, started by the
+gunicorn master with `python -m lib.job_queue`.
+"""
+import asyncio
+import contextvars
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from lib.db import create_connection
+from lib.dbt_engine import (
+    APPLICATION_NAME_VARIABLE,
+    execute_dbt,
+    get_dbt_engine,
+    read_run_results,
+    terminate_dbt_subprocesses,
+    use_warm_engine,
+)
+from lib.jobs import (
+    BUILD_ACTION,
+    CANCELLED_STATUS,
+    FAILED_STATUS,
+    JOB_QUEUED_CHANNEL,
+    JOB_STATUS_CHANNEL,
+    JOBS_RETENTION_DAYS,
+    STOPPED_STATUSES,
+    SUCCESS_STATUS,
+    TIMEOUT_STATUS,
+    cancel_backend_queries,
+    claim_job,
+    get_job_application_name,
+    maintain_jobs_partitions,
+    mark_job_as_failed,
+    mark_job_as_success,
+    mark_job_as_timed_out,
+    record_nodes_results,
+    requeue_stale_jobs,
+    send_job_heartbeat,
+)
+from lib.logger import get_logger, log_context, shutdown_logger
+from lib.metrics import JOBS_FINISHED, JOBS_RUNNING, mark_process_dead
+from lib.model_timings import delete_old_model_timings, record_model_timings
+
+logger = get_logger()
+
+RUN_POOL = "dbt_run"
+
+TEST_POOL = "dbt_test"
+
+# actions of the jobs run by each pool
+POOLS_ACTIONS = {
+    RUN_POOL: ["run", BUILD_ACTION],
+    TEST_POOL: ["test"],
+}
+
+# seconds between two heartbeats of a running job
+HEARTBEAT_INTERVAL = 30
+
+# a started job without heartbeat for this long is considered abandoned
+STALE_JOB_DELAY = timedelta(seconds=int(os.environ.get("DBT_STALE_JOB_DELAY", "120")))
+
+# a job is failed after being abandoned this number of times
+MAX_JOB_ATTEMPTS = int(os.environ.get("DBT_JOB_MAX_ATTEMPTS", "3"))
+
+# seconds an idle worker waits for a queued job notification before checking the queue again
+POLL_INTERVAL = 5
+
+# days ahead for which the dbt_jobs partitions are created
+PARTITIONS_DAYS_AHEAD = 7
+
+# seconds between two maintenances of the dbt_jobs partitions and of the timings
+PARTITIONS_MAINTENANCE_INTERVAL = 3600
+
+# seconds between two checks of the workers processes by the supervisor
+WATCH_INTERVAL = 5
+
+# seconds a job of each action can run before being stopped, DBT_<ACTION>_TIMEOUT
+DEFAULT_JOBS_TIMEOUTS = {
+    "run": 1200,
+    "test": 1200,
+    BUILD_ACTION: 3600,
+}
+
+# seconds given to a stopped dbt command to return once its queries are cancelled
+STOP_GRACE_PERIOD = 30
+
+SUPERVISOR = None
+
+
+def get_pools_concurrency() -> Dict[str, int]:
+    return {
+        RUN_POOL: int(os.environ.get("DBT_RUN_CONCURRENCY", "2")),
+        TEST_POOL: int(os.environ.get("DBT_TEST_CONCURRENCY", "2")),
+    }
+
+
+def get_models_timeouts() -> Dict[str, float]:
+    """Timeouts of the models overriding the timeout of their action, DBT_MODELS_TIMEOUTS=model_a=7200,model_b=600"""
+    models_timeouts = {}
+    for model_timeout in os.environ.get("DBT_MODELS_TIMEOUTS", "").split(","):
+        if model_timeout.strip():
+            model_name, timeout = model_timeout.split("=")
+            models_timeouts[model_name.strip()] = float(timeout)
+    return models_timeouts
+
+
+def get_job_timeout(action: str, models_names: List[str]) -> float:
+    """The longest timeout of the models of the job"""
+    action_timeout = float(os.environ.get(f"DBT_{action.upper()}_TIMEOUT", DEFAULT_JOBS_TIMEOUTS.get(action, 1200)))
+    models_timeouts = get_models_timeouts()
+    return max((models_timeouts.get(model_name, action_timeout) for model_name in models_names), default=action_timeout)
+
+
+class JobWorker:
+
+    def __init__(self, pool_name: str, worker_id: str, execute: Callable[[List[str]], bool] = execute_dbt):
+        self.pool_name = pool_name
+        self.actions = POOLS_ACTIONS[pool_name]
+        self.worker_id = worker_id
+        self.execute = execute
+        self._next_maintenance = 0.0
+        # True when a stopped dbt command did not return, the worker process has to be replaced
+        self.stuck = False
+        self._job_id: Optional[str] = None
+        # events of the event loop of the worker, created in it
+        self._job_queued: Optional[asyncio.Event] = None
+        self._stop_requested: Optional[asyncio.Event] = None
+
+    async def maintain_partitions(self, connection):
+        if time.monotonic() < self._next_maintenance:
+            return
+        self._next_maintenance = time.monotonic() + PARTITIONS_MAINTENANCE_INTERVAL
+        dropped_partitions = await maintain_jobs_partitions(
+            connection, retention_days=JOBS_RETENTION_DAYS, days_ahead=PARTITIONS_DAYS_AHEAD
+        )
+        if dropped_partitions:
+            logger.info(f"Dropped dbt jobs partitions older than {JOBS_RETENTION_DAYS} days: {dropped_partitions}")
+        deleted_timings = await delete_old_model_timings(connection, retention_days=JOBS_RETENTION_DAYS)
+        if deleted_timings:
+            logger.info(f"Deleted {deleted_timings} dbt model timings older than {JOBS_RETENTION_DAYS} days")
+
+    async def _send_heartbeats(self, connection, job_id: str):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            # in case the notification of a cancellation was missed
+            if await send_job_heartbeat(connection, job_id) in STOPPED_STATUSES:
+                self._stop_requested.set()
+
+    def _on_job_status(self, connection, pid, channel, payload):
+        job_status = json.loads(payload)
+        if job_status["job_id"] == self._job_id and job_status["status"] == CANCELLED_STATUS:
+            self._stop_requested.set()
+
+    async def listen(self, connection):
+        """Subscribe to the queued jobs and to the cancellations of the running job"""
+        self._job_queued = asyncio.Event()
+        await connection.add_listener(JOB_QUEUED_CHANNEL, lambda *args: self._job_queued.set())
+        await connection.add_listener(JOB_STATUS_CHANNEL, self._on_job_status)
+
+    async def record_timings(self, connection, job_id: str, nodes_results):
+        # the timings are only statistics, the job is marked whether they are recorded or not
+        try:
+            await record_model_timings(connection, job_id, nodes_results)
+        except Exception as e:
+            logger.error(f"Timings of job {job_id} could not be recorded: {str(e)}")
+
+    async def run_job(self, connection, job):
+        # the records logged while the job runs, dbt's included, carry its job_id and model_name
+        with log_context(job_id=job["job_id"], model_name=job["model_name"]):
+            await self._run_job(connection, job)
+
+    async def _execute(self, connection, job_id: str, command: List[str], timeout: float) -> str:
+        """
+        Run the command of the job, and stop it after the timeout or on a cancellation.
+        Returns the status of the job.
+        """
+        # the executor thread does not inherit the context of the job
+        context = contextvars.copy_context()
+        execution = asyncio.get_event_loop().run_in_executor(None, context.run, self.execute, command)
+        stop_requested = asyncio.ensure_future(self._stop_requested.wait())
+        heartbeats = asyncio.ensure_future(self._send_heartbeats(connection, job_id))
+        try:
+            await asyncio.wait({execution, stop_requested}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (stop_requested, heartbeats):
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+        if execution.done():
+            try:
+                return SUCCESS_STATUS if execution.result() else FAILED_STATUS
+            except Exception as e:
+                logger.error(f"Encountered error for job {job_id}: {str(e)}")
+                return FAILED_STATUS
+
+        job_status = CANCELLED_STATUS if self._stop_requested.is_set() else TIMEOUT_STATUS
+        logger.warning(f"Stopping job {job_id}, {job_status}")
+        # dbt fails once its query is cancelled, a dbt process is terminated with its children
+        await cancel_backend_queries(connection, get_job_application_name(job_id))
+        await asyncio.get_event_loop().run_in_executor(None, terminate_dbt_subprocesses)
+        try:
+            await asyncio.wait_for(asyncio.shield(execution), timeout=STOP_GRACE_PERIOD)
+        except asyncio.TimeoutError:
+            logger.error(f"dbt command of job {job_id} did not stop, the worker is replaced")
+            self.stuck = True
+        except Exception:
+            pass
+        return job_status
+
+    async def _run_job(self, connection, job):
+        job_id = job["job_id"]
+        action = job["test_or_run"]
+        # the models of a build are separated by spaces
+        models_names = job["model_name"].split()
+        # the results of the nodes are read from the run_results.json of the job, in its own target path
+        target_path = tempfile.mkdtemp(prefix="dbt-job-")
+        command = [action, "--select", *models_names, "--target-path", target_path]
+        timeout = get_job_timeout(action, models_names)
+        logger.info(f"Worker {self.worker_id} running job: {job_id}, command {command}, timeout {timeout}s")
+
+        # the queries of the job are found by the application name of its sessions
+        os.environ[APPLICATION_NAME_VARIABLE] = get_job_application_name(job_id)
+        self._job_id = job_id
+        self._stop_requested = asyncio.Event()
+        try:
+            with JOBS_RUNNING.labels(action=action).track_inprogress():
+                job_status = await self._execute(connection, job_id, command, timeout)
+        finally:
+            self._job_id = None
+            os.environ.pop(APPLICATION_NAME_VARIABLE, None)
+
+        try:
+            nodes_results = read_run_results(target_path)
+            if action == BUILD_ACTION:
+                await record_nodes_results(connection, job_id, nodes_results)
+            await self.record_timings(connection, job_id, nodes_results)
+        finally:
+            shutil.rmtree(target_path, ignore_errors=True)
+
+        if job_status == SUCCESS_STATUS:
+            logger.info(f"Job {job_id} is successfull")
+            await mark_job_as_success(connection, job_id=job_id)
+        elif job_status == FAILED_STATUS:
+            logger.error(f"Job {job_id} has failed")
+            await mark_job_as_failed(connection, job_id=job_id)
+        elif job_status == TIMEOUT_STATUS:
+            logger.error(f"Job {job_id} timed out after {timeout}s")
+            await mark_job_as_timed_out(connection, job_id=job_id)
+        else:
+            logger.warning(f"Job {job_id} is cancelled")
+        JOBS_FINISHED.labels(action=action, status=job_status).inc()
+
+    async def process_next_job(self, connection) -> bool:
+        """Run the next job of the pool, if any. Returns whether a job was run"""
+        requeued_jobs = await requeue_stale_jobs(connection, stale_after=STALE_JOB_DELAY, max_attempts=MAX_JOB_ATTEMPTS)
+        if requeued_jobs:
+            logger.warning(f"Abandoned jobs put back in the queue: {requeued_jobs}")
+
+        job = await claim_job(connection, actions=self.actions, worker_id=self.worker_id)
+        if job is None:
+            return False
+
+        await self.run_job(connection, job)
+        return True
+
+    async def run(self):
+        connection = await create_connection()
+        await self.listen(connection)
+
+        if use_warm_engine():
+            await asyncio.get_event_loop().run_in_executor(None, get_dbt_engine().warm_up)
+        logger.info(f"Worker {self.worker_id} of pool {self.pool_name} is ready")
+
+        while True:
+            self._job_queued.clear()
+            await self.maintain_partitions(connection)
+            if await self.process_next_job(connection):
+                if self.stuck:
+                    # the thread of a stopped dbt command cannot be interrupted, the supervisor starts a new worker
+                    shutdown_logger()
+                    os._exit(1)
+                continue
+            try:
+                await asyncio.wait_for(self._job_queued.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+def run_worker(pool_name: str, worker_index: int):
+    """Entrypoint of a worker process"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{pool_name}-{worker_index}"
+    # stopped by the supervisor with SIGTERM, exit normally to write the queued log records
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        asyncio.run(JobWorker(pool_name=pool_name, worker_id=worker_id).run())
+    finally:
+        # the dbt processes run in their own process group, they are not stopped with the worker
+        terminate_dbt_subprocesses()
+        shutdown_logger()
+
+
+class JobQueueSupervisor:
+    """Starts the workers processes of each pool and restarts the ones that die"""
+
+    def __init__(self, pools_concurrency: Optional[Dict[str, int]] = None):
+        self.pools_concurrency = pools_concurrency or get_pools_concurrency()
+        # workers start from a fresh interpreter rather than a fork of the gunicorn master
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: Dict[Tuple[str, int], multiprocessing.Process] = {}
+        self._stopping = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+
+    def _start_worker(self, pool_name: str, worker_index: int):
+        process = self._context.Process(
+            target=run_worker,
+            args=(pool_name, worker_index),
+            name=f"{pool_name}-{worker_index}",
+            daemon=True
+        )
+        process.start()
+        self._workers[(pool_name, worker_index)] = process
+
+    def _watch_workers(self):
+        while not self._stopping.wait(WATCH_INTERVAL):
+            for (pool_name, worker_index), process in list(self._workers.items()):
+                if not process.is_alive():
+                    logger.error(f"Worker {process.name} exited with code {process.exitcode}, restarting it")
+                    mark_process_dead(process.pid)
+                    self._start_worker(pool_name, worker_index)
+
+    def start(self):
+        for pool_name, concurrency in self.pools_concurrency.items():
+            for worker_index in range(concurrency):
+                self._start_worker(pool_name, worker_index)
+
+        self._watcher = threading.Thread(target=self._watch_workers, name="job-queue-supervisor", daemon=True)
+        self._watcher.start()
+
+    def stop(self, timeout: float = 10):
+        # running jobs are not waited for, they are put back in the queue once their heartbeat is stale
+        self._stopping.set()
+        for process in self._workers.values():
+            process.terminate()
+        for process in self._workers.values():
+            process.join(timeout)
+            mark_process_dead(process.pid)
+        self._workers.clear()
+
+
+def get_job_queue_supervisor() -> JobQueueSupervisor:
+    global SUPERVISOR
+    if SUPERVISOR is None:
+        SUPERVISOR = JobQueueSupervisor()
+    return SUPERVISOR
+
+
+def run_supervisor():
+    """Entrypoint of the supervisor process, stopped with SIGTERM or with its parent"""
+    parent_pid = os.getppid()
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    signal.signal(signal.SIGINT, lambda *args: stopping.set())
+    supervisor = get_job_queue_supervisor()
+    supervisor.start()
+    try:
+        while not stopping.wait(WATCH_INTERVAL):
+            if os.getppid() != parent_pid:
+                logger.error("The gunicorn master exited, stopping the job workers")
+                break
+    finally:
+        supervisor.stop()
+        shutdown_logger()
+
+
+if __name__ == "__main__":
+    run_supervisor()
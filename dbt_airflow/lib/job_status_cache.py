@@ -0,0 +1,81 @@
+"""Per-process cache of the job statuses read by /job and /jobs.
+
+A finished job keeps its status, so the terminal statuses are kept for JOB_STATUS_CACHE_TTL
+seconds and the pollers of a finished job are answered without a query. The unknown job ids
+are kept for JOB_STATUS_CACHE_NEGATIVE_TTL seconds only, in case the job is being admitted
+by another process. The least recently used entries are dropped beyond JOB_STATUS_CACHE_SIZE.
+
+The statuses written by the process and the notifications of the job status listener
+replace the cached entries.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from lib.metrics import JOB_STATUS_CACHE_HITS, JOB_STATUS_CACHE_MISSES
+
+CACHE = None
+
+
+class JobStatusCache:
+    """LRU of the terminal statuses and of the unknown job ids (cached as None), with a TTL"""
+
+    def __init__(self, terminal_statuses: Iterable[str], max_size: int, ttl: float, negative_ttl: float):
+        self.terminal_statuses = set(terminal_statuses)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # job_id: (status, expiry), the most recently used last
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, job_id: str) -> Tuple[bool, Optional[str]]:
+        """Whether the job is cached, and its status, None for an unknown job"""
+        entry = self._entries.get(job_id)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._entries[job_id]
+            self.misses += 1
+            JOB_STATUS_CACHE_MISSES.inc()
+            return False, None
+        self._entries.move_to_end(job_id)
+        self.hits += 1
+        JOB_STATUS_CACHE_HITS.inc()
+        return True, entry[0]
+
+    def put(self, job_id: str, job_status: Optional[str]):
+        """Cache a terminal status or an unknown job, a running job is not cached"""
+        if job_status is not None and job_status not in self.terminal_statuses:
+            self.invalidate(job_id)
+            return
+        ttl = self.ttl if job_status is not None else self.negative_ttl
+        self._entries[job_id] = (job_status, time.monotonic() + ttl)
+        self._entries.move_to_end(job_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def put_many(self, jobs_statuses: Dict[str, Optional[str]]):
+        for job_id, job_status in jobs_statuses.items():
+            self.put(job_id, job_status)
+
+    def invalidate(self, job_id: str):
+        self._entries.pop(job_id, None)
+
+
+def get_job_status_cache() -> JobStatusCache:
+    global CACHE
+    if CACHE is None:
+        from lib.jobs import TERMINAL_STATUSES
+
+        CACHE = JobStatusCache(
+            terminal_statuses=TERMINAL_STATUSES,
+            max_size=int(os.environ.get("JOB_STATUS_CACHE_SIZE", "10000")),
+            ttl=float(os.environ.get("JOB_STATUS_CACHE_TTL", "3600")),
+            negative_ttl=float(os.environ.get("JOB_STATUS_CACHE_NEGATIVE_TTL", "5")),
+        )
+    return CACHE
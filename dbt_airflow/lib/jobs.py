@@ -0,0 +1,450 @@
+"""Persistence of the dbt jobs, shared by the API and the job workers.
+
+The dbt_jobs table is also the jobs queue: a job is admitted as queued, claimed by
+a worker (started), then marked as success or failed. A job is stopped as cancelled on a
+cancel call, or as timeout after running longer than its timeout; the sessions of its dbt
+command are named after the job to cancel their queries.
+"""
+from datetime import datetime, timedelta
+import os
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from lib.job_status_cache import get_job_status_cache
+
+DBT_JOBS_TABLE = "dbt_jobs"
+
+QUEUED_STATUS = "queued"
+
+START_STATUS = "started"
+
+SUCCESS_STATUS = "success"
+
+FAILED_STATUS = "failed"
+
+# node of a dbt build not run, after the failure of a parent
+SKIPPED_STATUS = "skipped"
+
+# submission over the admission limits, no job is written
+REJECTED_STATUS = "rejected"
+
+# job stopped on a /job/{job_id}/cancel call
+CANCELLED_STATUS = "cancelled"
+
+# job stopped after running longer than its timeout
+TIMEOUT_STATUS = "timeout"
+
+TERMINAL_STATUSES = {SUCCESS_STATUS, FAILED_STATUS, SKIPPED_STATUS, CANCELLED_STATUS, TIMEOUT_STATUS}
+
+# statuses of the stopped jobs, kept when their dbt command returns
+STOPPED_STATUSES = {CANCELLED_STATUS, TIMEOUT_STATUS}
+
+# action running and testing several models with dbt build
+BUILD_ACTION = "build"
+
+# statuses of the run_results.json nodes, the others are failures
+NODES_STATUSES = {"success": SUCCESS_STATUS, "pass": SUCCESS_STATUS, "warn": SUCCESS_STATUS, "skipped": SKIPPED_STATUS}
+
+# action of the nodes of a dbt build, by resource type
+NODES_ACTIONS = {"model": "run", "test": "test", "seed": "seed", "snapshot": "snapshot"}
+
+# channel notified with each job status change
+JOB_STATUS_CHANNEL = "dbt_job_status"
+
+# channel notified when a job is queued, to wake up idle workers
+JOB_QUEUED_CHANNEL = "dbt_job_queued"
+
+# a submission reuses the job of the same model and action admitted during this period
+DEDUPE_WINDOW = timedelta(hours=1)
+
+# prefix of the job ids, the day of their c_date and so their partition
+JOB_ID_DAY_FORMAT = "%Y%m%d"
+
+# days of jobs history kept in the dbt_jobs and dbt_model_timings tables
+JOBS_RETENTION_DAYS = int(os.environ.get("DBT_JOBS_RETENTION_DAYS", "30"))
+
+
+class DBTJob(BaseModel):
+    job_id: str
+    c_date: datetime
+    status: str
+
+
+class AdmittedJob(BaseModel):
+    # None when the job is rejected
+    job_id: Optional[str]
+    status: str
+    # False when an existing job is reused
+    created: bool
+    # limit the job was rejected by: action, schema or wait_queue
+    rejected_by: Optional[str] = None
+
+
+def new_job_id(c_date: datetime) -> str:
+    return f"{c_date.strftime(JOB_ID_DAY_FORMAT)}-{uuid.uuid4()}"
+
+
+def get_jobs_days(jobs_ids: List[str]) -> Tuple[datetime, datetime]:
+    """
+    Range of the c_date of the jobs, from the days of their ids, so that the lookups only read
+    their partitions. Unbounded when a job id has no day, as the ids written before.
+    """
+    days = []
+    for job_id in jobs_ids:
+        try:
+            days.append(datetime.strptime(job_id.split("-")[0], JOB_ID_DAY_FORMAT))
+        except ValueError:
+            return datetime.min, datetime.max
+    if not days:
+        return datetime.min, datetime.max
+    return min(days), max(days) + timedelta(days=1)
+
+
+async def _start_job(connection, model_name: str, run_or_test: str):
+    now = datetime.utcnow()
+    job_id = new_job_id(now)
+    query = f"""
+    WITH queued_job AS (
+        INSERT INTO {DBT_JOBS_TABLE}
+        (job_id, model_name, test_or_run, status, c_date)
+        VALUES
+        ($1, $2, $3, $4, $5)
+        RETURNING test_or_run
+    )
+    SELECT pg_notify('{JOB_QUEUED_CHANNEL}', test_or_run) FROM queued_job
+    """
+    await connection.execute(query, job_id, model_name, run_or_test, QUEUED_STATUS, now)
+    return job_id
+
+
+def get_job_application_name(job_id: str) -> str:
+    """application_name of the database sessions of the job, to find its queries in pg_stat_activity"""
+    return f"dbt-job-{job_id}"
+
+
+async def _update_job_status(connection, job_id, job_status):
+    # the notification is sent on commit, to the processes waiting on the job
+    query = f"""
+    WITH updated_job AS (
+        UPDATE {DBT_JOBS_TABLE}
+        SET status = $1, ended_at = $3
+        WHERE job_id = $2 AND c_date >= $4 AND c_date < $5 AND status NOT IN ('{CANCELLED_STATUS}', '{TIMEOUT_STATUS}')
+        RETURNING job_id, status
+    )
+    SELECT pg_notify('{JOB_STATUS_CHANNEL}', json_build_object('job_id', job_id, 'status', status)::text)
+    FROM updated_job
+    """
+    await connection.execute(query, job_status, job_id, datetime.utcnow(), *get_jobs_days([job_id]))
+    get_job_status_cache().invalidate(job_id)
+
+
+async def mark_job_as_success(connection, job_id):
+    await _update_job_status(connection, job_id=job_id, job_status=SUCCESS_STATUS)
+
+
+async def mark_job_as_failed(connection, job_id):
+    await _update_job_status(connection, job_id=job_id, job_status=FAILED_STATUS)
+
+
+async def mark_job_as_timed_out(connection, job_id):
+    await _update_job_status(connection, job_id=job_id, job_status=TIMEOUT_STATUS)
+
+
+async def cancel_job(connection, job_id: str) -> Tuple[bool, Optional[str]]:
+    """
+    Cancel the job if it is queued or started. Returns whether the job was cancelled by the
+    call, and the status of the job, None if there is no such job.
+    """
+    query = f"""
+    WITH cancelled_job AS (
+        UPDATE {DBT_JOBS_TABLE}
+        SET status = '{CANCELLED_STATUS}', ended_at = $2
+        WHERE job_id = $1 AND c_date >= $3 AND c_date < $4 AND status IN ('{QUEUED_STATUS}', '{START_STATUS}')
+        RETURNING job_id, status
+    )
+    SELECT
+        status,
+        pg_notify('{JOB_STATUS_CHANNEL}', json_build_object('job_id', job_id, 'status', status)::text)
+    FROM cancelled_job
+    """
+    res = await connection.fetchrow(query, job_id, datetime.utcnow(), *get_jobs_days([job_id]))
+    get_job_status_cache().invalidate(job_id)
+    if res is not None:
+        return True, res["status"]
+    return False, await read_job_status(connection, job_id)
+
+
+async def read_job_status(connection, job_id: str) -> Optional[str]:
+    """Status of the job, None if there is no such job"""
+    query = f"""SELECT status FROM {DBT_JOBS_TABLE} WHERE job_id = $1 AND c_date >= $2 AND c_date < $3"""
+    return await connection.fetchval(query, job_id, *get_jobs_days([job_id]))
+
+
+async def cancel_backend_queries(connection, application_name: str) -> int:
+    """Cancel the running queries of the sessions of the application. Returns the number of cancelled queries"""
+    query = """
+    SELECT COUNT(*) FILTER (WHERE pg_cancel_backend(pid))
+    FROM pg_stat_activity
+    WHERE application_name = $1 AND pid <> pg_backend_pid()
+    """
+    return await connection.fetchval(query, application_name)
+
+
+async def get_latest_job(connection, model_name: str, run_or_test: str) -> Optional[DBTJob]:
+
+    query = f"""
+    SELECT
+        job_id,
+        c_date,
+        status
+    FROM {DBT_JOBS_TABLE}
+    WHERE model_name = $1 and test_or_run = $2 AND c_date >= $3
+    ORDER BY c_date DESC
+    LIMIT 1
+    """
+    res = await connection.fetchrow(query, model_name, run_or_test, datetime.utcnow() - DEDUPE_WINDOW)
+    if res:
+        return DBTJob(**dict(res))
+
+    return None
+
+
+async def admit_job(
+        connection,
+        model_name: str,
+        run_or_test: str,
+        target_schema: Optional[str] = None,
+        low_priority: bool = False,
+        action_limit: Optional[int] = None,
+        schema_limit: Optional[int] = None,
+        wait_queue_size: int = 0
+) -> AdmittedJob:
+    """
+    Queue a job for the model, unless a job of the model is queued, running or succeeded
+    during the dedupe window. A new job is rejected when the active jobs of its action or of
+    its target schema reach their limit, a low priority job only once the wait queue is full.
+    Done atomically, in one round-trip.
+    """
+    query = """
+    SELECT admitted_job_id, job_status, created, rejected_by
+    FROM admit_dbt_job($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+    """
+    now = datetime.utcnow()
+    res = await connection.fetchrow(
+        query, model_name, run_or_test, new_job_id(now), now - DEDUPE_WINDOW, now,
+        target_schema, low_priority, action_limit, schema_limit, wait_queue_size
+    )
+    return AdmittedJob(
+        job_id=res["admitted_job_id"], status=res["job_status"], created=res["created"], rejected_by=res["rejected_by"]
+    )
+
+
+class JobSubmission(BaseModel):
+    model_name: str
+    run_or_test: str
+    target_schema: Optional[str] = None
+    low_priority: bool = False
+    action_limit: Optional[int] = None
+    schema_limit: Optional[int] = None
+
+
+async def admit_jobs(connection, submissions: List[JobSubmission], wait_queue_size: int = 0) -> List[AdmittedJob]:
+    """
+    Admit the jobs of the submissions as admit_job does, in one transaction and one round-trip.
+    The results are in the order of the submissions.
+    """
+    query = """
+    SELECT admitted_job_id, job_status, created, rejected_by
+    FROM admit_dbt_jobs($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+    """
+    now = datetime.utcnow()
+    res = await connection.fetch(
+        query,
+        [submission.model_name for submission in submissions],
+        [submission.run_or_test for submission in submissions],
+        [new_job_id(now) for _ in submissions],
+        [submission.target_schema for submission in submissions],
+        [submission.low_priority for submission in submissions],
+        [submission.action_limit for submission in submissions],
+        [submission.schema_limit for submission in submissions],
+        now - DEDUPE_WINDOW,
+        now,
+        wait_queue_size,
+    )
+    return [
+        AdmittedJob(job_id=row["admitted_job_id"], status=row["job_status"], created=row["created"], rejected_by=row["rejected_by"])
+        for row in res
+    ]
+
+
+async def get_jobs_statuses(connection, jobs_ids: List[str]) -> Dict[str, str]:
+    """Status of each of the jobs found"""
+    query = f"""SELECT job_id, status FROM {DBT_JOBS_TABLE} WHERE job_id = ANY($1) AND c_date >= $2 AND c_date < $3"""
+    res = await connection.fetch(query, jobs_ids, *get_jobs_days(jobs_ids))
+    return {row["job_id"]: row["status"] for row in res}
+
+
+def get_retention_start() -> datetime:
+    """Oldest c_date of the jobs kept, the older partitions being dropped"""
+    return datetime.utcnow() - timedelta(days=JOBS_RETENTION_DAYS)
+
+
+async def get_last_success(connection, model_name: str, run_or_test: str) -> Optional[Dict[str, Any]]:
+    """Latest successful job of the model and action, within the retention days, with the fingerprint of its inputs"""
+    query = f"""
+    SELECT job_id, input_fingerprint
+    FROM {DBT_JOBS_TABLE}
+    WHERE model_name = $1 AND test_or_run = $2 AND status = '{SUCCESS_STATUS}' AND c_date >= $3
+    ORDER BY c_date DESC
+    LIMIT 1
+    """
+    res = await connection.fetchrow(query, model_name, run_or_test, get_retention_start())
+    return dict(res) if res is not None else None
+
+
+async def get_last_successful_runs(connection, models_names: List[str]) -> Dict[str, str]:
+    """Latest successful run job of each model within the retention days, builds included"""
+    query = f"""
+    SELECT DISTINCT ON (model_name) model_name, job_id
+    FROM {DBT_JOBS_TABLE}
+    WHERE model_name = ANY($1) AND test_or_run = 'run' AND status = '{SUCCESS_STATUS}' AND c_date >= $2
+    ORDER BY model_name, c_date DESC
+    """
+    res = await connection.fetch(query, models_names, get_retention_start())
+    return {row["model_name"]: row["job_id"] for row in res}
+
+
+async def set_input_fingerprint(connection, job_id: str, input_fingerprint: str):
+    query = f"""UPDATE {DBT_JOBS_TABLE} SET input_fingerprint = $2 WHERE job_id = $1 AND c_date >= $3 AND c_date < $4"""
+    await connection.execute(query, job_id, input_fingerprint, *get_jobs_days([job_id]))
+
+
+async def record_nodes_results(connection, parent_job_id: str, nodes_results: List[Dict[str, Any]]):
+    """
+    Write the result of each node of a dbt build job as a finished job of the node, so that
+    a later submission of a model built successfully reuses it.
+    """
+    now = datetime.utcnow()
+    jobs = []
+    for node_result in nodes_results:
+        # <resource type>.<package>.<name>[.<hash>]
+        resource_type, _, node_name = node_result["unique_id"].split(".")[:3]
+        action = NODES_ACTIONS.get(resource_type, resource_type)
+        jobs.append((new_job_id(now), node_name, action, NODES_STATUSES.get(node_result["status"], FAILED_STATUS), now, parent_job_id))
+
+    query = f"""
+    INSERT INTO {DBT_JOBS_TABLE}
+    (job_id, model_name, test_or_run, status, c_date, ended_at, parent_job_id)
+    VALUES
+    ($1, $2, $3, $4, $5, $5, $6)
+    """
+    await connection.executemany(query, jobs)
+
+
+async def get_nodes_results(connection, parent_job_id: str) -> List[Dict[str, str]]:
+    query = f"""
+    SELECT model_name, test_or_run, status
+    FROM {DBT_JOBS_TABLE}
+    WHERE parent_job_id = $1 AND c_date >= $2
+    ORDER BY id
+    """
+    # the nodes are written when the build finishes, from the day of the build job
+    res = await connection.fetch(query, parent_job_id, get_jobs_days([parent_job_id])[0])
+    return [dict(row) for row in res]
+
+
+async def get_active_jobs_groups(connection) -> List[Dict[str, Any]]:
+    """Number of queued and started jobs by action, target schema, status and priority"""
+    query = f"""
+    SELECT test_or_run, target_schema, status, low_priority, COUNT(*) AS jobs
+    FROM {DBT_JOBS_TABLE}
+    WHERE status IN ('{QUEUED_STATUS}', '{START_STATUS}')
+    GROUP BY test_or_run, target_schema, status, low_priority
+    """
+    res = await connection.fetch(query)
+    return [dict(row) for row in res]
+
+
+async def get_active_jobs_counts(connection) -> Dict[Tuple[str, str], int]:
+    """Number of queued and started jobs by action and status"""
+    query = f"""
+    SELECT test_or_run, status, COUNT(*) AS jobs
+    FROM {DBT_JOBS_TABLE}
+    WHERE status IN ('{QUEUED_STATUS}', '{START_STATUS}')
+    GROUP BY test_or_run, status
+    """
+    res = await connection.fetch(query)
+    return {(row["test_or_run"], row["status"]): row["jobs"] for row in res}
+
+
+async def claim_job(connection, actions: List[str], worker_id: str):
+    """Take the oldest queued job of the actions, skipping the ones other workers are claiming"""
+    query = f"""
+    WITH claimed_job AS (
+        UPDATE {DBT_JOBS_TABLE}
+        SET status = $1, worker_id = $2, started_at = $3, heartbeat_at = $3, attempts = attempts + 1
+        WHERE (job_id, c_date) = (
+            SELECT job_id, c_date
+            FROM {DBT_JOBS_TABLE}
+            WHERE status = $4 AND test_or_run = ANY($5)
+            ORDER BY low_priority, c_date
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING job_id, model_name, test_or_run, status
+    )
+    SELECT
+        job_id,
+        model_name,
+        test_or_run,
+        pg_notify('{JOB_STATUS_CHANNEL}', json_build_object('job_id', job_id, 'status', status)::text)
+    FROM claimed_job
+    """
+    return await connection.fetchrow(query, START_STATUS, worker_id, datetime.utcnow(), QUEUED_STATUS, actions)
+
+
+async def send_job_heartbeat(connection, job_id: str) -> Optional[str]:
+    """Returns the status of the job, to find the jobs stopped while they run"""
+    query = f"""UPDATE {DBT_JOBS_TABLE} SET heartbeat_at = $1 WHERE job_id = $2 AND c_date >= $3 AND c_date < $4 RETURNING status"""
+    return await connection.fetchval(query, datetime.utcnow(), job_id, *get_jobs_days([job_id]))
+
+
+async def requeue_stale_jobs(connection, stale_after: timedelta, max_attempts: int) -> List[str]:
+    """
+    Put back in the queue the started jobs whose worker stopped sending heartbeats (crash, restart).
+    Jobs that already used all their attempts are marked as failed.
+    """
+    query = f"""
+    WITH stale_job AS (
+        UPDATE {DBT_JOBS_TABLE}
+        SET
+            status = CASE WHEN attempts >= $1 THEN '{FAILED_STATUS}' ELSE '{QUEUED_STATUS}' END,
+            ended_at = CASE WHEN attempts >= $1 THEN $2::timestamp END,
+            worker_id = NULL
+        WHERE status = '{START_STATUS}' AND COALESCE(heartbeat_at, c_date) < $3
+        RETURNING job_id, test_or_run, status
+    )
+    SELECT
+        job_id,
+        pg_notify('{JOB_STATUS_CHANNEL}', json_build_object('job_id', job_id, 'status', status)::text),
+        pg_notify('{JOB_QUEUED_CHANNEL}', test_or_run)
+    FROM stale_job
+    """
+    now = datetime.utcnow()
+    res = await connection.fetch(query, max_attempts, now, now - stale_after)
+    return [row["job_id"] for row in res]
+
+
+async def maintain_jobs_partitions(connection, retention_days: int, days_ahead: int) -> List[str]:
+    """
+    Create the daily partitions of the next days and drop the partitions older than the retention.
+    Returns the dropped partitions.
+    """
+    await connection.execute(
+        "SELECT dbt_jobs_create_partitions(timezone('utc', now())::DATE, timezone('utc', now())::DATE + $1::INTEGER)",
+        days_ahead
+    )
+    res = await connection.fetch("SELECT dbt_jobs_drop_partitions($1) AS partition_name", retention_days)
+    return [row["partition_name"] for row in res]
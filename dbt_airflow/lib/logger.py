@@ -1,18 +1,237 @@
-import logging
-from os import environ
+"""Logging of the service.
+
+With USE_CLOUD_LOGGER=True, the records go to Cloud Logging without blocking the request
+and job threads: a log call only puts its record in a bounded queue, and a background
+thread writes the queued records by batches to the Cloud Logging handler. When the queue
+is full, the records below ERROR are dropped and an ERROR record takes the place of the
+oldest queued one; the number of dropped records is logged with the next batch.
+
+The background thread and the Cloud Logging client are created by each process on its first
+record: a forked process inherits neither the thread nor a usable client.
 
-import google.cloud.logging
+The fields set with log_context (job_id, model_name) are added to every record, and sent as
+structured fields to Cloud Logging.
+"""
+import contextvars
+import logging
+import queue
+import sys
+import threading
+from contextlib import contextmanager
+from os import environ, getpid
+from typing import Any, Callable, Dict, List, Optional
 
 LOGGER = None
 
+BATCHING_HANDLER = None
 
-def _config_logger():
+# fields of the current job, added to the records
+LOG_FIELDS: contextvars.ContextVar = contextvars.ContextVar("log_fields", default={})
+
+CONTEXT_FIELDS = ("job_id", "model_name")
+
+# loggers of the Cloud Logging client, written to stderr so that sending records does not log records
+CLOUD_LOGGING_LOGGERS = ("google.cloud", "google.auth", "google_auth_httplib2")
+
+
+def get_logging_settings() -> Dict[str, Any]:
+    return {
+        # records kept in memory while the background thread is writing
+        "queue_size": int(environ.get("LOG_QUEUE_SIZE", "10000")),
+        "batch_size": int(environ.get("LOG_BATCH_SIZE", "500")),
+        # seconds waited for more records before writing a batch
+        "flush_interval": float(environ.get("LOG_FLUSH_INTERVAL", "1")),
+    }
+
+
+@contextmanager
+def log_context(**fields: Optional[str]):
+    """Add the fields to the records logged in the block, and in the threads run with a copy of its context"""
+    token = LOG_FIELDS.set({**LOG_FIELDS.get(), **fields})
+    try:
+        yield
+    finally:
+        LOG_FIELDS.reset(token)
+
+
+class ContextFieldsFilter(logging.Filter):
+    """Sets the context fields on the record, as attributes and as the json_fields of Cloud Logging"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        fields = LOG_FIELDS.get()
+        for field in CONTEXT_FIELDS:
+            setattr(record, field, fields.get(field))
+        if fields:
+            record.json_fields = {**fields, **getattr(record, "json_fields", {})}
+        return True
+
+
+class BatchingHandler(logging.Handler):
+    """Queues the records, written to the target handler by batches from a background thread"""
+
+    def __init__(self, target: logging.Handler, queue_size: int, batch_size: int, flush_interval: float):
+        super().__init__()
+        self.target = target
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self._stopped = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        # process of the background thread, started with its first record
+        self._pid: Optional[int] = None
+
+    def _start_flusher(self):
+        # the records queued before a fork are written by the parent, the child starts with an empty queue
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.dropped = 0
+        self._flusher = threading.Thread(target=self._flush_records, name="log-flusher", daemon=True)
+        self._flusher.start()
+        self._pid = getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the record is written later, its message and traceback are rendered now
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord):
+        # called under the handler lock, dropped is only updated by one thread at a time
+        if self._stopped.is_set():
+            self.target.handle(record)
+            return
+        try:
+            if self._pid != getpid():
+                self._start_flusher()
+            record = self.prepare(record)
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                if record.levelno < logging.ERROR:
+                    return
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                except queue.Empty:
+                    pass
+                self.queue.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+    def _next_batch(self) -> List[Optional[logging.LogRecord]]:
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
 
-    if environ.get("USE_CLOUD_LOGGER") == "True":
-        client = google.cloud.logging.Client()
-        client.setup_logging()
+    def _write_batch(self, batch: List[logging.LogRecord]):
+        with self.lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            self.target.handle(logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                f"{dropped} log records were dropped, the logging queue was full", None, None
+            ))
+        for record in batch:
+            try:
+                self.target.handle(record)
+            except Exception:
+                self.handleError(record)
+        try:
+            self.target.flush()
+        except Exception:
+            pass
+
+    def _flush_records(self):
+        while True:
+            batch = self._next_batch()
+            # None is queued by close, after the last records
+            stopping = None in batch
+            self._write_batch([record for record in batch if record is not None])
+            for _ in batch:
+                self.queue.task_done()
+            if stopping:
+                return
+
+    def flush(self):
+        """Wait for the queued records to be written"""
+        if not self._stopped.is_set() and self._pid == getpid() and self._flusher.is_alive():
+            self.queue.join()
+
+    def close(self, timeout: float = 5):
+        """Write the queued records and stop the background thread"""
+        if not self._stopped.is_set():
+            self._stopped.set()
+            if self._pid == getpid():
+                try:
+                    self.queue.put(None, timeout=timeout)
+                except queue.Full:
+                    pass
+                self._flusher.join(timeout)
+            self.target.flush()
+        super().close()
+
+
+class ProcessLocalHandler(logging.Handler):
+    """Delegates to a handler created by each process on its first record, for the clients that cannot be forked"""
+
+    def __init__(self, create_handler: Callable[[], logging.Handler]):
+        super().__init__()
+        self.create_handler = create_handler
+        self._handler: Optional[logging.Handler] = None
+        self._pid: Optional[int] = None
+
+    def emit(self, record: logging.LogRecord):
+        if self._pid != getpid():
+            self._handler = self.create_handler()
+            self._pid = getpid()
+        self._handler.handle(record)
+
+    def flush(self):
+        if self._handler is not None and self._pid == getpid():
+            self._handler.flush()
+
+
+def _create_cloud_logging_handler() -> logging.Handler:
+    import google.cloud.logging
+
+    return google.cloud.logging.Client().get_default_handler()
+
+
+def install_batching_handler(logger: logging.Logger, target: logging.Handler) -> BatchingHandler:
+    """Send the records of the logger to the target handler, through a BatchingHandler"""
+    handler = BatchingHandler(target, **get_logging_settings())
+    handler.addFilter(ContextFieldsFilter())
+    logger.addHandler(handler)
+    return handler
+
+
+def use_cloud_logger() -> bool:
+    return environ.get("USE_CLOUD_LOGGER") == "True"
+
+
+def _config_logger():
+    global BATCHING_HANDLER
 
     logger = logging.getLogger()
+    if use_cloud_logger():
+        BATCHING_HANDLER = install_batching_handler(logger, ProcessLocalHandler(_create_cloud_logging_handler))
+        logger.setLevel(logging.INFO)
+        for logger_name in CLOUD_LOGGING_LOGGERS:
+            cloud_logger = logging.getLogger(logger_name)
+            cloud_logger.propagate = False
+            cloud_logger.addHandler(logging.StreamHandler(sys.stderr))
+
     return logger
 
 
@@ -21,3 +240,9 @@ def get_logger():
     if LOGGER is None:
         LOGGER = _config_logger()
     return LOGGER
+
+
+def shutdown_logger():
+    """Write the queued records, at the exit of a worker"""
+    if BATCHING_HANDLER is not None:
+        BATCHING_HANDLER.close()
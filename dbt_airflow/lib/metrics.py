@@ -0,0 +1,197 @@
+"""Prometheus metrics of the service, served by /metrics.
+
+Under gunicorn, the web workers and the job workers are separate processes: the gunicorn
+configuration sets PROMETHEUS_MULTIPROC_DIR, where each process writes its metrics, and
+/metrics aggregates the files of all the processes. Without it (tests, a single uvicorn
+process), /metrics returns the metrics of the current process.
+
+The jobs counts are read from the dbt_jobs table on each scrape.
+"""
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+MULTIPROC_DIR_VARIABLE = "PROMETHEUS_MULTIPROC_DIR"
+
+# labels of the dbt commands, the other commands of /command are counted as "other"
+DBT_COMMANDS = {"build", "compile", "deps", "ls", "parse", "run", "seed", "snapshot", "source", "test"}
+
+REQUEST_DURATION = Histogram(
+    "dbt_http_request_duration_seconds",
+    "Duration of the HTTP requests, by route",
+    ["method", "route", "status_code"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+DBT_COMMAND_DURATION = Histogram(
+    "dbt_command_duration_seconds",
+    "Duration of the dbt commands, run by the API or by the job workers",
+    ["command", "success"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600),
+)
+
+JOBS_RUNNING = Gauge(
+    "dbt_jobs_running",
+    "dbt jobs being run by the job workers, by action",
+    ["action"],
+    multiprocess_mode="livesum",
+)
+
+JOBS_FINISHED = Counter(
+    "dbt_jobs_finished",
+    "dbt jobs run by the job workers, by action and status",
+    ["action", "status"],
+)
+
+JOBS_REJECTED = Counter(
+    "dbt_jobs_rejected",
+    "dbt jobs submissions rejected over the admission limits, by action and limit",
+    ["action", "limit"],
+)
+
+JOBS_SKIPPED_UNCHANGED = Counter(
+    "dbt_jobs_skipped_unchanged",
+    "dbt jobs submissions skipped as the inputs of the model did not change since its last success",
+    ["action"],
+)
+
+JOB_STATUS_CACHE_HITS = Counter(
+    "dbt_job_status_cache_hits",
+    "Job statuses answered from the cache of the web workers",
+)
+
+JOB_STATUS_CACHE_MISSES = Counter(
+    "dbt_job_status_cache_misses",
+    "Job statuses read from the dbt_jobs table, not found in the cache of the web workers",
+)
+
+DB_POOL_ACQUIRE_DURATION = Histogram(
+    "dbt_db_pool_acquire_duration_seconds",
+    "Time waited for a connection of the database pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10),
+)
+
+DB_POOL_ACQUIRE_TIMEOUTS = Counter(
+    "dbt_db_pool_acquire_timeouts",
+    "Requests answered 503 as no connection of the database pool was free",
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    "dbt_db_pool_connections",
+    "Connections of the database pools of the web workers, by state",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+
+DB_POOL_MAX_SIZE = Gauge(
+    "dbt_db_pool_max_size",
+    "Maximum number of connections of the database pools of the web workers",
+    multiprocess_mode="livesum",
+)
+
+# set on each acquire and release, the children are looked up once
+DB_POOL_IN_USE = DB_POOL_CONNECTIONS.labels(state="in_use")
+
+DB_POOL_IDLE = DB_POOL_CONNECTIONS.labels(state="idle")
+
+
+def get_dbt_command_label(arguments_list: Iterable[str]) -> str:
+    command = next(iter(arguments_list), "")
+    return command if command in DBT_COMMANDS else "other"
+
+
+def observe_dbt_command(arguments_list: Iterable[str], success: bool, duration: float):
+    DBT_COMMAND_DURATION.labels(command=get_dbt_command_label(arguments_list), success=str(success).lower()).observe(duration)
+
+
+def set_db_pool_connections(pool_stats: Dict[str, int]):
+    DB_POOL_IN_USE.set(pool_stats["in_use"])
+    DB_POOL_IDLE.set(pool_stats["idle"])
+
+
+class JobsCollector:
+    """Number of jobs of the dbt_jobs table by action and status, read at scrape time"""
+
+    def __init__(self, jobs_counts: Dict[Tuple[str, str], int]):
+        self.jobs_counts = jobs_counts
+
+    def collect(self):
+        jobs = GaugeMetricFamily("dbt_jobs", "Queued and started dbt jobs, by action and status", labels=["action", "status"])
+        for (action, status), count in sorted(self.jobs_counts.items()):
+            jobs.add_metric([action, status], count)
+        yield jobs
+
+
+def is_multiprocess() -> bool:
+    return MULTIPROC_DIR_VARIABLE in os.environ
+
+
+def generate_metrics(jobs_counts: Optional[Dict[Tuple[str, str], int]]) -> bytes:
+    """Metrics of the processes, and the jobs counts unless they could not be read"""
+    if is_multiprocess():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    if jobs_counts is None:
+        return generate_latest(registry)
+    jobs_registry = CollectorRegistry(auto_describe=False)
+    jobs_registry.register(JobsCollector(jobs_counts))
+    return generate_latest(registry) + generate_latest(jobs_registry)
+
+
+def mark_process_dead(pid: int):
+    """Drop the live gauges of an exited process, its counters and histograms are kept"""
+    if is_multiprocess():
+        multiprocess.mark_process_dead(pid)
+
+
+class MetricsMiddleware:
+    """
+    Duration of the requests, labelled by route path rather than URL to bound the number
+    of series. A plain ASGI middleware, cheaper than the BaseHTTPMiddleware of starlette.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes_paths = None
+        # histogram children by method, route and status code, cheaper than a labels() call
+        self._observers = {}
+
+    def _get_route_path(self, scope) -> str:
+        # recent starlette versions put the matched route in the scope, older ones only its endpoint
+        route_path = getattr(scope.get("route"), "path", None)
+        if route_path is not None:
+            return route_path
+        if self._routes_paths is None:
+            self._routes_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._routes_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            labels = (scope["method"], self._get_route_path(scope), status_code)
+            observer = self._observers.get(labels)
+            if observer is None:
+                observer = self._observers[labels] = REQUEST_DURATION.labels(labels[0], labels[1], str(status_code))
+            observer.observe(duration)
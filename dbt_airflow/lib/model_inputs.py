@@ -0,0 +1,75 @@
+"""Fingerprints of the inputs of the models, to skip the runs that would rebuild the same data.
+
+The fingerprint of a model hashes its checksum, the latest loaded_at_field value of each
+upstream source, the latest successful run job of each upstream model and the checksum of
+each upstream seed. It is computed when a run is submitted and stored with its job: a later
+submission with the same fingerprint as the last successful run of the model is skipped.
+
+A model has no fingerprint, and is always run, when an upstream source has no
+loaded_at_field, or when it depends on snapshots or ephemeral models.
+
+The latest loaded_at_field value of a source is read once for SOURCE_FRESHNESS_CACHE_TTL
+seconds by each process, rather than by each submission: the run tasks of a DAG run are
+submitted within a few seconds, and most of them share their sources.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from lib.dbt_engine import ModelInputs, get_model_inputs
+from lib.jobs import get_last_successful_runs
+from lib.logger import get_logger
+
+logger = get_logger()
+
+# seconds a latest loaded_at_field value is reused, a source loaded meanwhile is seen unchanged
+SOURCE_FRESHNESS_CACHE_TTL = float(os.environ.get("SOURCE_FRESHNESS_CACHE_TTL", "30"))
+
+# (relation_name, loaded_at_field): (latest loaded_at_field value, expiry)
+SOURCES_LOADED_AT: Dict[Tuple[str, str], Tuple[Any, float]] = {}
+
+
+async def get_source_loaded_at(connection, relation_name: str, loaded_at_field: str) -> Any:
+    entry = SOURCES_LOADED_AT.get((relation_name, loaded_at_field))
+    if entry is not None and entry[1] >= time.monotonic():
+        return entry[0]
+    loaded_at = await connection.fetchval(f"SELECT MAX({loaded_at_field}) FROM {relation_name}")
+    SOURCES_LOADED_AT[(relation_name, loaded_at_field)] = (loaded_at, time.monotonic() + SOURCE_FRESHNESS_CACHE_TTL)
+    return loaded_at
+
+
+async def get_sources_loaded_at(connection, model_inputs: ModelInputs) -> Optional[List[Any]]:
+    """Latest loaded_at_field value of each source, None when one can not be read"""
+    loaded_at = []
+    for relation_name, loaded_at_field in sorted(model_inputs.sources):
+        try:
+            loaded_at.append(await get_source_loaded_at(connection, relation_name, loaded_at_field))
+        except Exception as e:
+            logger.warning(f"Freshness of source {relation_name} could not be read: {str(e)}")
+            return None
+    return loaded_at
+
+
+async def get_input_fingerprint(connection, model_name: str) -> Optional[str]:
+    # the manifest file may be loaded
+    model_inputs = await asyncio.get_event_loop().run_in_executor(None, get_model_inputs, model_name)
+    if model_inputs is None or model_inputs.opaque:
+        return None
+    if any(loaded_at_field is None for _, loaded_at_field in model_inputs.sources):
+        return None
+
+    sources_loaded_at = await get_sources_loaded_at(connection, model_inputs)
+    if sources_loaded_at is None:
+        return None
+    models_runs = await get_last_successful_runs(connection, model_inputs.models) if model_inputs.models else {}
+
+    fingerprint = hashlib.sha256(f"model:{model_inputs.checksum}\n".encode())
+    for (relation_name, _), loaded_at in zip(sorted(model_inputs.sources), sources_loaded_at):
+        fingerprint.update(f"source:{relation_name}:{loaded_at}\n".encode())
+    for upstream_model in sorted(model_inputs.models):
+        fingerprint.update(f"run:{upstream_model}:{models_runs.get(upstream_model)}\n".encode())
+    for seed_name, checksum in sorted(model_inputs.seeds):
+        fingerprint.update(f"seed:{seed_name}:{checksum}\n".encode())
+    return fingerprint.hexdigest()
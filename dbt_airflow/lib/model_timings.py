@@ -0,0 +1,111 @@
+"""Timings of the nodes run by the dbt jobs.
+
+After each job, the entries of the run_results.json written by dbt are stored in the
+dbt_model_timings table: duration of the compile and execute phases, adapter response and
+rows affected. The durations of the successful models over a window give the regressions
+and the weights used to schedule the DAGs.
+"""
+from datetime import datetime, timedelta, timezone
+import json
+from typing import Any, Dict, List, Optional
+
+MODEL_TIMINGS_TABLE = "dbt_model_timings"
+
+# phases of the timing entries of a node
+TIMING_PHASES = ("compile", "execute")
+
+
+def _parse_timestamp(timestamp: Optional[str]) -> Optional[datetime]:
+    # dbt writes UTC timestamps with a Z suffix, the table holds naive UTC timestamps
+    if not timestamp:
+        return None
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def get_node_timing(job_id: str, node_result: Dict[str, Any], c_date: datetime) -> tuple:
+    """Row of the table for an entry of the run_results.json"""
+    # <resource type>.<package>.<name>[.<hash>]
+    resource_type, _, node_name = node_result["unique_id"].split(".")[:3]
+    phases = {timing["name"]: timing for timing in node_result.get("timing", [])}
+    phases_dates = []
+    for phase in TIMING_PHASES:
+        timing = phases.get(phase, {})
+        phases_dates += [_parse_timestamp(timing.get("started_at")), _parse_timestamp(timing.get("completed_at"))]
+    adapter_response = node_result.get("adapter_response") or {}
+    return (
+        job_id,
+        node_result["unique_id"],
+        node_name,
+        resource_type,
+        node_result["status"],
+        node_result.get("execution_time") or 0.0,
+        *phases_dates,
+        adapter_response.get("rows_affected"),
+        json.dumps(adapter_response),
+        c_date,
+    )
+
+
+async def record_model_timings(connection, job_id: str, nodes_results: List[Dict[str, Any]]):
+    now = datetime.utcnow()
+    timings = [get_node_timing(job_id, node_result, now) for node_result in nodes_results]
+    query = f"""
+    INSERT INTO {MODEL_TIMINGS_TABLE}
+    (
+        job_id, unique_id, model_name, resource_type, status, execution_time,
+        compile_started_at, compile_completed_at, execute_started_at, execute_completed_at,
+        rows_affected, adapter_response, c_date
+    )
+    VALUES
+    ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12::jsonb, $13)
+    """
+    await connection.executemany(query, timings)
+
+
+async def get_models_stats(
+        connection,
+        window: timedelta,
+        models_names: Optional[List[str]] = None,
+        limit: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Durations in seconds of the successful runs of the models over the window, the slowest
+    (by p95) first
+    """
+    query = f"""
+    SELECT
+        model_name,
+        COUNT(*) AS runs,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY execution_time) AS p50,
+        percentile_cont(0.95) WITHIN GROUP (ORDER BY execution_time) AS p95,
+        MAX(execution_time) AS max,
+        percentile_cont(0.5) WITHIN GROUP (
+            ORDER BY EXTRACT(EPOCH FROM compile_completed_at - compile_started_at)
+        ) AS compile_p50,
+        percentile_cont(0.5) WITHIN GROUP (
+            ORDER BY EXTRACT(EPOCH FROM execute_completed_at - execute_started_at)
+        ) AS execute_p50,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY rows_affected) AS rows_affected_p50
+    FROM {MODEL_TIMINGS_TABLE}
+    WHERE
+        resource_type = 'model' AND status = 'success' AND c_date >= $1
+        AND ($2::VARCHAR[] IS NULL OR model_name = ANY($2))
+    GROUP BY model_name
+    ORDER BY p95 DESC, model_name
+    LIMIT $3
+    """
+    res = await connection.fetch(query, datetime.utcnow() - window, models_names, limit)
+    return [dict(row) for row in res]
+
+
+async def delete_old_model_timings(connection, retention_days: int) -> int:
+    """Delete the timings older than the retention. Returns the number of deleted timings"""
+    query = f"""
+    WITH deleted_timing AS (
+        DELETE FROM {MODEL_TIMINGS_TABLE}
+        WHERE c_date < timezone('utc', now()) - make_interval(days => $1)
+        RETURNING id
+    )
+    SELECT COUNT(*) FROM deleted_timing
+    """
+    return await connection.fetchval(query, retention_days)
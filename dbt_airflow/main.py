@@ -1,7 +1,33 @@
 from api.dbt_routes import router as dbt_router
+from lib.db import create_pool, close_pool
+from lib.dbt_engine import get_dbt_engine, use_warm_engine
+from lib.job_notifier import get_job_notifier
+from lib.metrics import DB_POOL_MAX_SIZE, MetricsMiddleware
 
 from fastapi import FastAPI
 
 app = FastAPI()
 
 app.include_router(dbt_router)
+
+app.add_middleware(MetricsMiddleware)
+
+
+@app.on_event("startup")
+async def open_db_pool():
+    pool = await create_pool()
+    DB_POOL_MAX_SIZE.set(pool.get_max_size())
+    await get_job_notifier().start()
+
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    await get_job_notifier().stop()
+    await close_pool()
+
+
+@app.on_event("startup")
+def warm_up_dbt_engine():
+    # parse the project once per worker, before the first job comes in
+    if use_warm_engine():
+        get_dbt_engine().warm_up()
@@ -0,0 +1,24 @@
+"""dbt jobs input fingerprint
+
+Revision ID: 3f9b2d61c8ae
+Revises: a7d3f1c9e052
+Create Date: 2026-10-18 22:31:50.204618
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9b2d61c8ae'
+down_revision = 'a7d3f1c9e052'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # hash of the upstream data and builds a run job was submitted with
+    op.execute("ALTER TABLE public.dbt_jobs ADD COLUMN input_fingerprint VARCHAR")
+
+
+def downgrade():
+    op.execute("ALTER TABLE public.dbt_jobs DROP COLUMN input_fingerprint")
@@ -0,0 +1,201 @@
+"""partitioned dbt jobs
+
+Revision ID: 5bc54accc584
+Revises: 64cea97144bd
+Create Date: 2026-10-18 14:40:07.502913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5bc54accc584'
+down_revision = '64cea97144bd'
+branch_labels = None
+depends_on = None
+
+# days of jobs kept in their own partition when migrating, older jobs go to the default partition
+MIGRATED_DAYS = 30
+
+JOBS_COLUMNS = "id, job_id, model_name, test_or_run, status, c_date, worker_id, started_at, heartbeat_at, ended_at, attempts"
+
+
+def upgrade():
+    op.execute("DROP TABLE IF EXISTS public.dbt_jos")
+
+    op.execute("CREATE TABLE public.dbt_jobs_backup AS SELECT * FROM public.dbt_jobs")
+    op.execute("DROP TABLE public.dbt_jobs")
+
+    op.execute("""
+    CREATE TABLE public.dbt_jobs (
+        id BIGSERIAL,
+        job_id VARCHAR NOT NULL,
+        model_name VARCHAR NOT NULL,
+        test_or_run VARCHAR NOT NULL,
+        status VARCHAR NOT NULL,
+        c_date TIMESTAMP NOT NULL,
+        worker_id VARCHAR,
+        started_at TIMESTAMP,
+        heartbeat_at TIMESTAMP,
+        ended_at TIMESTAMP,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (job_id, c_date)
+    ) PARTITION BY RANGE (c_date)
+    """)
+    # jobs written when their day has no partition yet
+    op.execute("CREATE TABLE public.dbt_jobs_default PARTITION OF public.dbt_jobs DEFAULT")
+
+    # latest job of a model and action, used to deduplicate submissions
+    op.execute("CREATE INDEX ix_dbt_jobs_latest ON public.dbt_jobs (model_name, test_or_run, c_date DESC)")
+    op.create_index(
+        "ix_dbt_jobs_queued",
+        "dbt_jobs",
+        ["test_or_run", "c_date"],
+        postgresql_where=sa.text("status = 'queued'"),
+        schema="public"
+    )
+    op.create_index(
+        "ix_dbt_jobs_started",
+        "dbt_jobs",
+        ["heartbeat_at"],
+        postgresql_where=sa.text("status = 'started'"),
+        schema="public"
+    )
+
+    # one partition per day, named dbt_jobs_pYYYYMMDD
+    op.execute("""
+    CREATE OR REPLACE FUNCTION public.dbt_jobs_create_partitions(from_day DATE, to_day DATE) RETURNS INTEGER AS $$
+    DECLARE
+        partition_day DATE;
+        partition_name TEXT;
+        created_partitions INTEGER := 0;
+    BEGIN
+        -- one maintenance at a time
+        IF NOT pg_try_advisory_xact_lock(hashtext('dbt_jobs_partitions')) THEN
+            RETURN 0;
+        END IF;
+
+        FOR partition_day IN SELECT generate_series(from_day, to_day, INTERVAL '1 day')::DATE LOOP
+            partition_name := 'dbt_jobs_p' || to_char(partition_day, 'YYYYMMDD');
+            CONTINUE WHEN to_regclass('public.' || partition_name) IS NOT NULL;
+
+            -- the jobs of that day written to the default partition are moved to the new partition
+            CREATE TEMP TABLE dbt_jobs_moved (LIKE public.dbt_jobs) ON COMMIT DROP;
+            WITH moved_jobs AS (
+                DELETE FROM public.dbt_jobs_default
+                WHERE c_date >= partition_day AND c_date < partition_day + 1
+                RETURNING *
+            )
+            INSERT INTO dbt_jobs_moved SELECT * FROM moved_jobs;
+
+            EXECUTE format(
+                'CREATE TABLE public.%I PARTITION OF public.dbt_jobs FOR VALUES FROM (%L) TO (%L)',
+                partition_name, partition_day, partition_day + 1
+            );
+            INSERT INTO public.dbt_jobs SELECT * FROM dbt_jobs_moved;
+            DROP TABLE dbt_jobs_moved;
+            created_partitions := created_partitions + 1;
+        END LOOP;
+
+        RETURN created_partitions;
+    END;
+    $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION public.dbt_jobs_drop_partitions(retention_days INTEGER) RETURNS SETOF TEXT AS $$
+    DECLARE
+        cutoff_day DATE := timezone('utc', now())::DATE - retention_days;
+        partition_name TEXT;
+    BEGIN
+        IF NOT pg_try_advisory_xact_lock(hashtext('dbt_jobs_partitions')) THEN
+            RETURN;
+        END IF;
+
+        FOR partition_name IN
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'public.dbt_jobs'::REGCLASS
+                AND child.relname ~ '^dbt_jobs_p[0-9]{8}$'
+                AND to_date(substr(child.relname, 11), 'YYYYMMDD') < cutoff_day
+            ORDER BY child.relname
+        LOOP
+            EXECUTE format('DROP TABLE public.%I', partition_name);
+            RETURN NEXT partition_name;
+        END LOOP;
+
+        DELETE FROM public.dbt_jobs_default WHERE c_date < cutoff_day;
+    END;
+    $$ LANGUAGE plpgsql
+    """)
+
+    op.execute(f"""
+    SELECT public.dbt_jobs_create_partitions(
+        timezone('utc', now())::DATE - {MIGRATED_DAYS},
+        timezone('utc', now())::DATE + 7
+    )
+    """)
+    op.execute(f"""
+    INSERT INTO public.dbt_jobs ({JOBS_COLUMNS})
+    SELECT
+        id, job_id, model_name, test_or_run, status, COALESCE(c_date, 'epoch'::TIMESTAMP),
+        worker_id, started_at, heartbeat_at, ended_at, attempts
+    FROM public.dbt_jobs_backup
+    """)
+    op.execute("SELECT setval('public.dbt_jobs_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM public.dbt_jobs")
+    op.execute("DROP TABLE public.dbt_jobs_backup")
+
+
+def downgrade():
+    op.execute("CREATE TABLE public.dbt_jobs_backup AS SELECT * FROM public.dbt_jobs")
+    op.execute("DROP TABLE public.dbt_jobs")
+    op.execute("DROP FUNCTION public.dbt_jobs_create_partitions(DATE, DATE)")
+    op.execute("DROP FUNCTION public.dbt_jobs_drop_partitions(INTEGER)")
+
+    op.execute("""
+    CREATE TABLE public.dbt_jobs (
+        id SERIAL PRIMARY KEY,
+        job_id VARCHAR NOT NULL UNIQUE,
+        model_name VARCHAR NOT NULL,
+        test_or_run VARCHAR NOT NULL,
+        status VARCHAR NOT NULL,
+        c_date TIMESTAMP,
+        worker_id VARCHAR,
+        started_at TIMESTAMP,
+        heartbeat_at TIMESTAMP,
+        ended_at TIMESTAMP,
+        attempts INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    op.create_index(
+        "ix_dbt_jobs_queued",
+        "dbt_jobs",
+        ["test_or_run", "c_date"],
+        postgresql_where=sa.text("status = 'queued'"),
+        schema="public"
+    )
+    op.create_index(
+        "ix_dbt_jobs_started",
+        "dbt_jobs",
+        ["heartbeat_at"],
+        postgresql_where=sa.text("status = 'started'"),
+        schema="public"
+    )
+    op.execute(f"""
+    INSERT INTO public.dbt_jobs ({JOBS_COLUMNS})
+    SELECT {JOBS_COLUMNS} FROM public.dbt_jobs_backup
+    """)
+    op.execute("SELECT setval('public.dbt_jobs_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM public.dbt_jobs")
+    op.execute("DROP TABLE public.dbt_jobs_backup")
+
+    op.create_table(
+        "dbt_jos",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("job_id", sa.VARCHAR, unique=True, nullable=False),
+        sa.Column("model_name", sa.VARCHAR, unique=False, nullable=False),
+        sa.Column("test_or_run", sa.VARCHAR, unique=False, nullable=False),
+        sa.Column("status", sa.VARCHAR, nullable=False),
+        sa.Column("c_date", sa.DateTime, nullable=True),
+        schema='public'
+    )
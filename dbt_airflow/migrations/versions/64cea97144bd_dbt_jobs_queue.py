@@ -0,0 +1,61 @@
+"""dbt jobs queue
+
+Revision ID: 64cea97144bd
+Revises: df2b112faa6c
+Create Date: 2026-10-18 10:12:31.184022
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '64cea97144bd'
+down_revision = 'df2b112faa6c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # dbt_jobs may have been created outside of the migrations
+    op.execute("""
+    CREATE TABLE IF NOT EXISTS public.dbt_jobs (
+        id SERIAL PRIMARY KEY,
+        job_id VARCHAR NOT NULL UNIQUE,
+        model_name VARCHAR NOT NULL,
+        test_or_run VARCHAR NOT NULL,
+        status VARCHAR NOT NULL,
+        c_date TIMESTAMP
+    )
+    """)
+    op.execute("""
+    ALTER TABLE public.dbt_jobs
+        ADD COLUMN IF NOT EXISTS worker_id VARCHAR,
+        ADD COLUMN IF NOT EXISTS started_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS ended_at TIMESTAMP,
+        ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0
+    """)
+    # jobs waiting for a worker, claimed by age
+    op.create_index(
+        "ix_dbt_jobs_queued",
+        "dbt_jobs",
+        ["test_or_run", "c_date"],
+        postgresql_where=sa.text("status = 'queued'"),
+        schema="public"
+    )
+    # running jobs, scanned for stale heartbeats
+    op.create_index(
+        "ix_dbt_jobs_started",
+        "dbt_jobs",
+        ["heartbeat_at"],
+        postgresql_where=sa.text("status = 'started'"),
+        schema="public"
+    )
+
+
+def downgrade():
+    op.drop_index("ix_dbt_jobs_started", table_name="dbt_jobs", schema="public")
+    op.drop_index("ix_dbt_jobs_queued", table_name="dbt_jobs", schema="public")
+    for column in ["attempts", "ended_at", "heartbeat_at", "started_at", "worker_id"]:
+        op.drop_column("dbt_jobs", column, schema="public")
@@ -0,0 +1,141 @@
+"""dbt jobs batch admission
+
+Revision ID: 6e0c4b8a2f17
+Revises: 3f9b2d61c8ae
+Create Date: 2026-10-19 09:12:37.845201
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '6e0c4b8a2f17'
+down_revision = '3f9b2d61c8ae'
+branch_labels = None
+depends_on = None
+
+# admit_dbt_job of the previous revision, with the shared lock of the batches when it is set
+ADMIT_DBT_JOB = """
+    CREATE OR REPLACE FUNCTION public.admit_dbt_job(
+        p_model_name VARCHAR,
+        p_test_or_run VARCHAR,
+        p_job_id VARCHAR,
+        p_since TIMESTAMP,
+        p_now TIMESTAMP,
+        p_target_schema VARCHAR,
+        p_low_priority BOOLEAN,
+        p_action_limit INTEGER,
+        p_schema_limit INTEGER,
+        p_wait_queue_size INTEGER
+    ) RETURNS TABLE (admitted_job_id VARCHAR, job_status VARCHAR, created BOOLEAN, rejected_by VARCHAR) AS $$
+    DECLARE
+        latest_job RECORD;
+        active_jobs INTEGER;
+        over_limit VARCHAR;
+    BEGIN{batch_lock}
+        PERFORM pg_advisory_xact_lock(hashtextextended(p_model_name || ':' || p_test_or_run, 0));
+
+        SELECT jobs.job_id, jobs.status INTO latest_job
+        FROM public.dbt_jobs AS jobs
+        WHERE jobs.model_name = p_model_name AND jobs.test_or_run = p_test_or_run AND jobs.c_date >= p_since
+        ORDER BY jobs.c_date DESC
+        LIMIT 1;
+
+        -- a running or successful job is reused, whatever the limits
+        IF FOUND AND latest_job.status IN ('queued', 'started', 'success') THEN
+            RETURN QUERY SELECT latest_job.job_id, latest_job.status, FALSE, NULL::VARCHAR;
+            RETURN;
+        END IF;
+
+        IF p_action_limit IS NOT NULL THEN
+            PERFORM pg_advisory_xact_lock(hashtextextended('dbt_jobs_action:' || p_test_or_run, 0));
+            SELECT COUNT(*) INTO active_jobs
+            FROM public.dbt_jobs AS jobs
+            WHERE jobs.test_or_run = p_test_or_run AND jobs.status IN ('queued', 'started');
+            IF active_jobs >= p_action_limit THEN
+                over_limit := 'action';
+            END IF;
+        END IF;
+
+        IF over_limit IS NULL AND p_schema_limit IS NOT NULL AND p_target_schema IS NOT NULL THEN
+            PERFORM pg_advisory_xact_lock(hashtextextended('dbt_jobs_schema:' || p_target_schema, 0));
+            SELECT COUNT(*) INTO active_jobs
+            FROM public.dbt_jobs AS jobs
+            WHERE jobs.target_schema = p_target_schema AND jobs.status IN ('queued', 'started');
+            IF active_jobs >= p_schema_limit THEN
+                over_limit := 'schema';
+            END IF;
+        END IF;
+
+        IF over_limit IS NOT NULL AND p_low_priority THEN
+            PERFORM pg_advisory_xact_lock(hashtextextended('dbt_jobs_wait_queue', 0));
+            SELECT COUNT(*) INTO active_jobs
+            FROM public.dbt_jobs AS jobs
+            WHERE jobs.status = 'queued' AND jobs.low_priority;
+            over_limit := CASE WHEN active_jobs >= p_wait_queue_size THEN 'wait_queue' END;
+        END IF;
+
+        IF over_limit IS NOT NULL THEN
+            RETURN QUERY SELECT NULL::VARCHAR, 'rejected'::VARCHAR, FALSE, over_limit;
+            RETURN;
+        END IF;
+
+        INSERT INTO public.dbt_jobs (job_id, model_name, test_or_run, status, c_date, target_schema, low_priority)
+        VALUES (p_job_id, p_model_name, p_test_or_run, 'queued', p_now, p_target_schema, p_low_priority);
+        PERFORM pg_notify('dbt_job_queued', p_test_or_run);
+
+        RETURN QUERY SELECT p_job_id, 'queued'::VARCHAR, TRUE, NULL::VARCHAR;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+# A batch takes the admission lock exclusively, a single admission shares it: a batch holds the
+# locks of several models and actions at once, which the single admissions could take in
+# another order.
+BATCH_LOCK = """
+        PERFORM pg_advisory_xact_lock_shared(hashtextextended('dbt_jobs_admission', 0));"""
+
+
+def upgrade():
+    op.execute(ADMIT_DBT_JOB.replace("{batch_lock}", BATCH_LOCK))
+    # the jobs of the submissions, in one statement and one transaction
+    op.execute("""
+    CREATE OR REPLACE FUNCTION public.admit_dbt_jobs(
+        p_models_names VARCHAR[],
+        p_tests_or_runs VARCHAR[],
+        p_jobs_ids VARCHAR[],
+        p_target_schemas VARCHAR[],
+        p_low_priorities BOOLEAN[],
+        p_actions_limits INTEGER[],
+        p_schemas_limits INTEGER[],
+        p_since TIMESTAMP,
+        p_now TIMESTAMP,
+        p_wait_queue_size INTEGER
+    ) RETURNS TABLE (admitted_job_id VARCHAR, job_status VARCHAR, created BOOLEAN, rejected_by VARCHAR) AS $$
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtextextended('dbt_jobs_admission', 0));
+
+        RETURN QUERY
+        SELECT admitted.admitted_job_id, admitted.job_status, admitted.created, admitted.rejected_by
+        FROM unnest(
+            p_models_names, p_tests_or_runs, p_jobs_ids, p_target_schemas, p_low_priorities, p_actions_limits, p_schemas_limits
+        ) WITH ORDINALITY AS submission(
+            model_name, test_or_run, job_id, target_schema, low_priority, action_limit, schema_limit, position
+        )
+        CROSS JOIN LATERAL public.admit_dbt_job(
+            submission.model_name, submission.test_or_run, submission.job_id, p_since, p_now, submission.target_schema,
+            submission.low_priority, submission.action_limit, submission.schema_limit, p_wait_queue_size
+        ) AS admitted
+        ORDER BY submission.position;
+    END;
+    $$ LANGUAGE plpgsql
+    """)
+
+
+def downgrade():
+    op.execute("""
+    DROP FUNCTION public.admit_dbt_jobs(
+        VARCHAR[], VARCHAR[], VARCHAR[], VARCHAR[], BOOLEAN[], INTEGER[], INTEGER[], TIMESTAMP, TIMESTAMP, INTEGER
+    )
+    """)
+    op.execute(ADMIT_DBT_JOB.replace("{batch_lock}", ""))
@@ -0,0 +1,33 @@
+"""dbt jobs parent job
+
+Revision ID: 8b406b8d14dd
+Revises: d62f0a323676
+Create Date: 2026-10-18 17:20:11.402519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b406b8d14dd'
+down_revision = 'd62f0a323676'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # results of the nodes of a dbt build job, written as jobs of the nodes
+    op.execute("ALTER TABLE public.dbt_jobs ADD COLUMN parent_job_id VARCHAR")
+    op.create_index(
+        "ix_dbt_jobs_parent_job_id",
+        "dbt_jobs",
+        ["parent_job_id"],
+        postgresql_where=sa.text("parent_job_id IS NOT NULL"),
+        schema="public"
+    )
+
+
+def downgrade():
+    op.drop_index("ix_dbt_jobs_parent_job_id", table_name="dbt_jobs", schema="public")
+    op.execute("ALTER TABLE public.dbt_jobs DROP COLUMN parent_job_id")
@@ -0,0 +1,99 @@
+"""dbt jobs unique job id
+
+Revision ID: 9d2e7b4c1a58
+Revises: 6e0c4b8a2f17
+Create Date: 2026-10-19 15:02:41.318904
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2e7b4c1a58'
+down_revision = '6e0c4b8a2f17'
+branch_labels = None
+depends_on = None
+
+# dbt_jobs_create_partitions of 5bc54accc584, with the unique job_id index of each partition when it is set
+CREATE_PARTITIONS = """
+    CREATE OR REPLACE FUNCTION public.dbt_jobs_create_partitions(from_day DATE, to_day DATE) RETURNS INTEGER AS $$
+    DECLARE
+        partition_day DATE;
+        partition_name TEXT;
+        created_partitions INTEGER := 0;
+    BEGIN
+        -- one maintenance at a time
+        IF NOT pg_try_advisory_xact_lock(hashtext('dbt_jobs_partitions')) THEN
+            RETURN 0;
+        END IF;
+
+        FOR partition_day IN SELECT generate_series(from_day, to_day, INTERVAL '1 day')::DATE LOOP
+            partition_name := 'dbt_jobs_p' || to_char(partition_day, 'YYYYMMDD');
+            CONTINUE WHEN to_regclass('public.' || partition_name) IS NOT NULL;
+
+            -- the jobs of that day written to the default partition are moved to the new partition
+            CREATE TEMP TABLE dbt_jobs_moved (LIKE public.dbt_jobs) ON COMMIT DROP;
+            WITH moved_jobs AS (
+                DELETE FROM public.dbt_jobs_default
+                WHERE c_date >= partition_day AND c_date < partition_day + 1
+                RETURNING *
+            )
+            INSERT INTO dbt_jobs_moved SELECT * FROM moved_jobs;
+
+            EXECUTE format(
+                'CREATE TABLE public.%I PARTITION OF public.dbt_jobs FOR VALUES FROM (%L) TO (%L)',
+                partition_name, partition_day, partition_day + 1
+            );{job_id_index}
+            INSERT INTO public.dbt_jobs SELECT * FROM dbt_jobs_moved;
+            DROP TABLE dbt_jobs_moved;
+            created_partitions := created_partitions + 1;
+        END LOOP;
+
+        RETURN created_partitions;
+    END;
+    $$ LANGUAGE plpgsql
+"""
+
+JOB_ID_INDEX = """
+            EXECUTE format('CREATE UNIQUE INDEX %I ON public.%I (job_id)', partition_name || '_job_id', partition_name);"""
+
+# partitions of dbt_jobs, the default one included
+PARTITIONS = """
+    SELECT child.relname
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = 'public.dbt_jobs'::REGCLASS
+"""
+
+
+def upgrade():
+    # The primary key of a partitioned table includes its partition key, (job_id, c_date), so the
+    # job ids are unique by partition. As a job id starts with the day of its c_date, they are
+    # unique in the table.
+    op.execute(CREATE_PARTITIONS.format(job_id_index=JOB_ID_INDEX))
+    op.execute(f"""
+    DO $$
+    DECLARE
+        partition_name TEXT;
+    BEGIN
+        FOR partition_name IN {PARTITIONS} LOOP
+            EXECUTE format('CREATE UNIQUE INDEX %I ON public.%I (job_id)', partition_name || '_job_id', partition_name);
+        END LOOP;
+    END;
+    $$
+    """)
+
+
+def downgrade():
+    op.execute(f"""
+    DO $$
+    DECLARE
+        partition_name TEXT;
+    BEGIN
+        FOR partition_name IN {PARTITIONS} LOOP
+            EXECUTE format('DROP INDEX IF EXISTS public.%I', partition_name || '_job_id');
+        END LOOP;
+    END;
+    $$
+    """)
+    op.execute(CREATE_PARTITIONS.format(job_id_index=""))
@@ -0,0 +1,153 @@
+"""dbt jobs admission limits
+
+Revision ID: a7d3f1c9e052
+Revises: c4e7a91f2b30
+Create Date: 2026-10-18 21:14:08.530117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3f1c9e052'
+down_revision = 'c4e7a91f2b30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # schema of the models of the job, and low priority jobs claimed after the others
+    op.execute("ALTER TABLE public.dbt_jobs ADD COLUMN target_schema VARCHAR")
+    op.execute("ALTER TABLE public.dbt_jobs ADD COLUMN low_priority BOOLEAN NOT NULL DEFAULT FALSE")
+    # active jobs counted on each admission
+    op.create_index(
+        "ix_dbt_jobs_active",
+        "dbt_jobs",
+        ["test_or_run", "target_schema"],
+        postgresql_where=sa.text("status IN ('queued', 'started')"),
+        schema="public"
+    )
+
+    op.execute("DROP FUNCTION public.admit_dbt_job(VARCHAR, VARCHAR, VARCHAR, TIMESTAMP, TIMESTAMP)")
+    # The admissions of an action, then of a schema, are serialized by advisory locks, always
+    # taken in the same order, so that the active jobs counted include the concurrent admissions.
+    # Over a limit, a low priority job is still admitted while the queued low priority jobs are
+    # fewer than the wait queue size.
+    op.execute("""
+    CREATE OR REPLACE FUNCTION public.admit_dbt_job(
+        p_model_name VARCHAR,
+        p_test_or_run VARCHAR,
+        p_job_id VARCHAR,
+        p_since TIMESTAMP,
+        p_now TIMESTAMP,
+        p_target_schema VARCHAR,
+        p_low_priority BOOLEAN,
+        p_action_limit INTEGER,
+        p_schema_limit INTEGER,
+        p_wait_queue_size INTEGER
+    ) RETURNS TABLE (admitted_job_id VARCHAR, job_status VARCHAR, created BOOLEAN, rejected_by VARCHAR) AS $$
+    DECLARE
+        latest_job RECORD;
+        active_jobs INTEGER;
+        over_limit VARCHAR;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtextextended(p_model_name || ':' || p_test_or_run, 0));
+
+        SELECT jobs.job_id, jobs.status INTO latest_job
+        FROM public.dbt_jobs AS jobs
+        WHERE jobs.model_name = p_model_name AND jobs.test_or_run = p_test_or_run AND jobs.c_date >= p_since
+        ORDER BY jobs.c_date DESC
+        LIMIT 1;
+
+        -- a running or successful job is reused, whatever the limits
+        IF FOUND AND latest_job.status IN ('queued', 'started', 'success') THEN
+            RETURN QUERY SELECT latest_job.job_id, latest_job.status, FALSE, NULL::VARCHAR;
+            RETURN;
+        END IF;
+
+        IF p_action_limit IS NOT NULL THEN
+            PERFORM pg_advisory_xact_lock(hashtextextended('dbt_jobs_action:' || p_test_or_run, 0));
+            SELECT COUNT(*) INTO active_jobs
+            FROM public.dbt_jobs AS jobs
+            WHERE jobs.test_or_run = p_test_or_run AND jobs.status IN ('queued', 'started');
+            IF active_jobs >= p_action_limit THEN
+                over_limit := 'action';
+            END IF;
+        END IF;
+
+        IF over_limit IS NULL AND p_schema_limit IS NOT NULL AND p_target_schema IS NOT NULL THEN
+            PERFORM pg_advisory_xact_lock(hashtextextended('dbt_jobs_schema:' || p_target_schema, 0));
+            SELECT COUNT(*) INTO active_jobs
+            FROM public.dbt_jobs AS jobs
+            WHERE jobs.target_schema = p_target_schema AND jobs.status IN ('queued', 'started');
+            IF active_jobs >= p_schema_limit THEN
+                over_limit := 'schema';
+            END IF;
+        END IF;
+
+        IF over_limit IS NOT NULL AND p_low_priority THEN
+            PERFORM pg_advisory_xact_lock(hashtextextended('dbt_jobs_wait_queue', 0));
+            SELECT COUNT(*) INTO active_jobs
+            FROM public.dbt_jobs AS jobs
+            WHERE jobs.status = 'queued' AND jobs.low_priority;
+            over_limit := CASE WHEN active_jobs >= p_wait_queue_size THEN 'wait_queue' END;
+        END IF;
+
+        IF over_limit IS NOT NULL THEN
+            RETURN QUERY SELECT NULL::VARCHAR, 'rejected'::VARCHAR, FALSE, over_limit;
+            RETURN;
+        END IF;
+
+        INSERT INTO public.dbt_jobs (job_id, model_name, test_or_run, status, c_date, target_schema, low_priority)
+        VALUES (p_job_id, p_model_name, p_test_or_run, 'queued', p_now, p_target_schema, p_low_priority);
+        PERFORM pg_notify('dbt_job_queued', p_test_or_run);
+
+        RETURN QUERY SELECT p_job_id, 'queued'::VARCHAR, TRUE, NULL::VARCHAR;
+    END;
+    $$ LANGUAGE plpgsql
+    """)
+
+
+def downgrade():
+    op.execute("""
+    DROP FUNCTION public.admit_dbt_job(
+        VARCHAR, VARCHAR, VARCHAR, TIMESTAMP, TIMESTAMP, VARCHAR, BOOLEAN, INTEGER, INTEGER, INTEGER
+    )
+    """)
+    op.execute("""
+    CREATE OR REPLACE FUNCTION public.admit_dbt_job(
+        p_model_name VARCHAR,
+        p_test_or_run VARCHAR,
+        p_job_id VARCHAR,
+        p_since TIMESTAMP,
+        p_now TIMESTAMP
+    ) RETURNS TABLE (admitted_job_id VARCHAR, job_status VARCHAR, created BOOLEAN) AS $$
+    DECLARE
+        latest_job RECORD;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtextextended(p_model_name || ':' || p_test_or_run, 0));
+
+        SELECT jobs.job_id, jobs.status INTO latest_job
+        FROM public.dbt_jobs AS jobs
+        WHERE jobs.model_name = p_model_name AND jobs.test_or_run = p_test_or_run AND jobs.c_date >= p_since
+        ORDER BY jobs.c_date DESC
+        LIMIT 1;
+
+        -- a running or successful job is reused, a new one is queued otherwise
+        IF FOUND AND latest_job.status IN ('queued', 'started', 'success') THEN
+            RETURN QUERY SELECT latest_job.job_id, latest_job.status, FALSE;
+            RETURN;
+        END IF;
+
+        INSERT INTO public.dbt_jobs (job_id, model_name, test_or_run, status, c_date)
+        VALUES (p_job_id, p_model_name, p_test_or_run, 'queued', p_now);
+        PERFORM pg_notify('dbt_job_queued', p_test_or_run);
+
+        RETURN QUERY SELECT p_job_id, 'queued'::VARCHAR, TRUE;
+    END;
+    $$ LANGUAGE plpgsql
+    """)
+    op.drop_index("ix_dbt_jobs_active", table_name="dbt_jobs", schema="public")
+    op.execute("ALTER TABLE public.dbt_jobs DROP COLUMN low_priority")
+    op.execute("ALTER TABLE public.dbt_jobs DROP COLUMN target_schema")
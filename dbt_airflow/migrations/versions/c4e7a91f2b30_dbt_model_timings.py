@@ -0,0 +1,46 @@
+"""dbt model timings
+
+Revision ID: c4e7a91f2b30
+Revises: 8b406b8d14dd
+Create Date: 2026-10-18 19:05:42.118230
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a91f2b30'
+down_revision = '8b406b8d14dd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # timing of each node of the jobs, from the run_results.json of dbt
+    op.execute("""
+    CREATE TABLE public.dbt_model_timings (
+        id BIGSERIAL PRIMARY KEY,
+        job_id VARCHAR NOT NULL,
+        unique_id VARCHAR NOT NULL,
+        model_name VARCHAR NOT NULL,
+        resource_type VARCHAR NOT NULL,
+        status VARCHAR NOT NULL,
+        execution_time DOUBLE PRECISION NOT NULL,
+        compile_started_at TIMESTAMP,
+        compile_completed_at TIMESTAMP,
+        execute_started_at TIMESTAMP,
+        execute_completed_at TIMESTAMP,
+        rows_affected BIGINT,
+        adapter_response JSONB,
+        c_date TIMESTAMP NOT NULL
+    )
+    """)
+    # durations of a model over a window
+    op.execute("CREATE INDEX ix_dbt_model_timings_model ON public.dbt_model_timings (model_name, c_date DESC)")
+    # durations of all the models over a window, and retention
+    op.execute("CREATE INDEX ix_dbt_model_timings_c_date ON public.dbt_model_timings (c_date)")
+    op.execute("CREATE INDEX ix_dbt_model_timings_job_id ON public.dbt_model_timings (job_id)")
+
+
+def downgrade():
+    op.execute("DROP TABLE public.dbt_model_timings")
@@ -0,0 +1,58 @@
+"""admit dbt job
+
+Revision ID: d62f0a323676
+Revises: 5bc54accc584
+Create Date: 2026-10-18 16:02:44.917310
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd62f0a323676'
+down_revision = '5bc54accc584'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Submissions of a model and action are serialized by an advisory lock. Each statement of
+    # the function takes a new snapshot, so the latest job read after the lock includes the
+    # jobs admitted by the concurrent submissions.
+    op.execute("""
+    CREATE OR REPLACE FUNCTION public.admit_dbt_job(
+        p_model_name VARCHAR,
+        p_test_or_run VARCHAR,
+        p_job_id VARCHAR,
+        p_since TIMESTAMP,
+        p_now TIMESTAMP
+    ) RETURNS TABLE (admitted_job_id VARCHAR, job_status VARCHAR, created BOOLEAN) AS $$
+    DECLARE
+        latest_job RECORD;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtextextended(p_model_name || ':' || p_test_or_run, 0));
+
+        SELECT jobs.job_id, jobs.status INTO latest_job
+        FROM public.dbt_jobs AS jobs
+        WHERE jobs.model_name = p_model_name AND jobs.test_or_run = p_test_or_run AND jobs.c_date >= p_since
+        ORDER BY jobs.c_date DESC
+        LIMIT 1;
+
+        -- a running or successful job is reused, a new one is queued otherwise
+        IF FOUND AND latest_job.status IN ('queued', 'started', 'success') THEN
+            RETURN QUERY SELECT latest_job.job_id, latest_job.status, FALSE;
+            RETURN;
+        END IF;
+
+        INSERT INTO public.dbt_jobs (job_id, model_name, test_or_run, status, c_date)
+        VALUES (p_job_id, p_model_name, p_test_or_run, 'queued', p_now);
+        PERFORM pg_notify('dbt_job_queued', p_test_or_run);
+
+        RETURN QUERY SELECT p_job_id, 'queued'::VARCHAR, TRUE;
+    END;
+    $$ LANGUAGE plpgsql
+    """)
+
+
+def downgrade():
+    op.execute("DROP FUNCTION public.admit_dbt_job(VARCHAR, VARCHAR, VARCHAR, TIMESTAMP, TIMESTAMP)")
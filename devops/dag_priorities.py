@@ -0,0 +1,138 @@
+"""Priorities of the generated tasks, from the critical path of their DAG.
+
+The priority of a task is the duration of the longest path from its model to the end of the
+DAG, so that the longest lineages start first when the pools are saturated. The durations of
+the run and test tasks come from dbt run_results.json files or from the finished jobs of the
+dbt_jobs table; without any duration, each model weighs 1 and the priority is its depth.
+"""
+import json
+import math
+from statistics import median
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dbt_graph import ModelsGraph
+
+# days of finished jobs read from dbt_jobs
+DEFAULT_JOBS_HISTORY_DAYS = 14
+
+
+class TaskDurations:
+    """Durations in seconds of the run and test tasks, by model name"""
+
+    def __init__(self, run: Optional[Dict[str, float]] = None, test: Optional[Dict[str, float]] = None):
+        self.run = run or {}
+        self.test = test or {}
+        # models without history are given the median duration, or the depth when there is none
+        self.default_run = median(self.run.values()) if self.run else 1
+        self.default_test = median(self.test.values()) if self.test else 0
+
+    def __bool__(self):
+        return bool(self.run or self.test)
+
+    def get_run_duration(self, model_name: str) -> float:
+        return self.run.get(model_name, self.default_run)
+
+    def get_test_duration(self, model_name: str) -> float:
+        return self.test.get(model_name, self.default_test)
+
+
+def _get_model_name(unique_id: str) -> str:
+    return unique_id.split(".")[-1]
+
+
+def load_run_results_durations(run_results_paths: Iterable[str], tests_index: Dict[str, Set[str]]) -> TaskDurations:
+    """
+    Mean durations of the nodes of dbt run_results.json files. The duration of the test task
+    of a model is the sum of its tests.
+    """
+    tested_nodes: Dict[str, List[str]] = {}
+    for tested_node, tests_ids in tests_index.items():
+        for test_id in tests_ids:
+            tested_nodes.setdefault(test_id, []).append(tested_node)
+
+    nodes_durations: Dict[str, List[float]] = {}
+    for run_results_path in run_results_paths:
+        with open(run_results_path) as f:
+            for result in json.load(f)["results"]:
+                nodes_durations.setdefault(result["unique_id"], []).append(result["execution_time"])
+
+    run_durations: Dict[str, float] = {}
+    test_durations: Dict[str, float] = {}
+    for unique_id, node_durations in nodes_durations.items():
+        duration = sum(node_durations) / len(node_durations)
+        if unique_id.startswith("model."):
+            run_durations[_get_model_name(unique_id)] = duration
+        elif unique_id.startswith("test."):
+            for tested_node in tested_nodes.get(unique_id, []):
+                model_name = _get_model_name(tested_node)
+                test_durations[model_name] = test_durations.get(model_name, 0) + duration
+    return TaskDurations(run=run_durations, test=test_durations)
+
+
+def load_jobs_durations(database_url: str, history_days: int = DEFAULT_JOBS_HISTORY_DAYS) -> TaskDurations:
+    """Median durations of the successful run and test jobs of the last days"""
+    import psycopg2
+
+    query = """
+    SELECT
+        model_name,
+        test_or_run,
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY EXTRACT(EPOCH FROM ended_at - started_at)) AS duration
+    FROM dbt_jobs
+    WHERE
+        status = 'success' AND test_or_run IN ('run', 'test') AND started_at IS NOT NULL
+        AND c_date >= timezone('utc', now()) - make_interval(days => %s)
+    GROUP BY model_name, test_or_run
+    """
+    connection = psycopg2.connect(database_url)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(query, (history_days,))
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+
+    durations: Dict[str, Dict[str, float]] = {"run": {}, "test": {}}
+    for model_name, action, duration in rows:
+        durations[action][model_name] = float(duration)
+    return TaskDurations(run=durations["run"], test=durations["test"])
+
+
+def get_priorities(models_graph: ModelsGraph, weights: List[float]) -> List[int]:
+    """Priority of each node: the weight of the longest path from the node to the end"""
+    return [math.ceil(length) for length in models_graph.longest_paths(weights)]
+
+
+def suggest_pools_slots(
+        models_graph: ModelsGraph,
+        run_weights: List[float],
+        test_weights: List[float]
+) -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """
+    Schedule each run task as soon as its parents are tested, with unlimited slots.
+    :return: duration of the critical path, and for the dbt_run and dbt_test pools the
+    suggested slots (their mean parallelism over the critical path) and the peak parallelism
+    """
+    intervals: Dict[str, List[Tuple[float, float]]] = {"dbt_run": [], "dbt_test": []}
+    ends = [0.0] * len(models_graph)
+    for node_id in models_graph.topological_order():
+        start = max((ends[parent_id] for parent_id in models_graph.parents[node_id]), default=0.0)
+        tests_start = start + run_weights[node_id]
+        ends[node_id] = tests_start + test_weights[node_id]
+        intervals["dbt_run"].append((start, tests_start))
+        intervals["dbt_test"].append((tests_start, ends[node_id]))
+    critical_path = max(ends, default=0.0)
+
+    pools_slots = {}
+    for pool, pool_intervals in intervals.items():
+        busy_intervals = [(start, end) for start, end in pool_intervals if end > start]
+        # sweep of the starts and ends, the ends first at the same time
+        events = sorted([(start, 1) for start, _ in busy_intervals] + [(end, -1) for _, end in busy_intervals])
+        peak = running = 0
+        for _, change in events:
+            running += change
+            peak = max(peak, running)
+        total = sum(end - start for start, end in busy_intervals)
+        mean_parallelism = math.ceil(total / critical_path) if critical_path else 0
+        pools_slots[pool] = (max(1, min(peak, mean_parallelism)), peak)
+    return critical_path, pools_slots
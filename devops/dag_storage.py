@@ -0,0 +1,72 @@
+"""Storages of the DAG files: the Composer bucket, or a local directory standing for it"""
+import base64
+import hashlib
+import shutil
+from os import makedirs, path, remove, walk
+from typing import Any, Dict
+
+
+def get_file_md5(file_path: str) -> str:
+    """Base64 encoded MD5 of the file, as the md5_hash of Cloud Storage objects"""
+    md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode()
+
+
+class Storage:
+
+    def list_md5(self, prefix: str) -> Dict[str, str]:
+        """MD5 of the stored files whose name starts with the prefix"""
+        raise NotImplementedError
+
+    def upload(self, file_path: str, name: str):
+        raise NotImplementedError
+
+    def delete(self, name: str):
+        raise NotImplementedError
+
+
+class GCSStorage(Storage):
+
+    def __init__(self, bucket_name: str, service_account_info: Dict[str, Any]):
+        from google.cloud import storage
+        from google.oauth2 import service_account
+
+        credentials = service_account.Credentials.from_service_account_info(service_account_info)
+        self.client = storage.Client(credentials=credentials, project=service_account_info["project_id"])
+        self.bucket = self.client.get_bucket(bucket_name)
+
+    def list_md5(self, prefix: str) -> Dict[str, str]:
+        return {blob.name: blob.md5_hash for blob in self.client.list_blobs(self.bucket, prefix=prefix)}
+
+    def upload(self, file_path: str, name: str):
+        self.bucket.blob(name).upload_from_filename(file_path)
+
+    def delete(self, name: str):
+        self.bucket.blob(name).delete()
+
+
+class LocalStorage(Storage):
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+
+    def list_md5(self, prefix: str) -> Dict[str, str]:
+        files_md5 = {}
+        for dir_path, _, files_names in walk(self.root_dir):
+            for file_name in files_names:
+                file_path = path.join(dir_path, file_name)
+                name = path.relpath(file_path, self.root_dir).replace(path.sep, "/")
+                if name.startswith(prefix):
+                    files_md5[name] = get_file_md5(file_path)
+        return files_md5
+
+    def upload(self, file_path: str, name: str):
+        stored_path = path.join(self.root_dir, *name.split("/"))
+        makedirs(path.dirname(stored_path), exist_ok=True)
+        shutil.copyfile(file_path, stored_path)
+
+    def delete(self, name: str):
+        remove(path.join(self.root_dir, *name.split("/")))
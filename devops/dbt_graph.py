@@ -0,0 +1,178 @@
+"""Models graph of the manifest.
+
+The nodes are interned as integer ids, in the order of their names, with the sets of
+their parents and children ids.
+"""
+from collections import deque
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple
+
+
+class GraphCycleError(Exception):
+    pass
+
+
+class ModelsGraph:
+
+    def __init__(self, names: Iterable[str]):
+        self.names: List[str] = sorted(set(names))
+        self.ids: Dict[str, int] = {name: node_id for node_id, name in enumerate(self.names)}
+        self.parents: List[Set[int]] = [set() for _ in self.names]
+        self.children: List[Set[int]] = [set() for _ in self.names]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add_edge(self, parent_id: int, child_id: int):
+        self.parents[child_id].add(parent_id)
+        self.children[parent_id].add(child_id)
+
+    @classmethod
+    def from_manifest(cls, manifest_graph: Dict[str, Any]) -> "ModelsGraph":
+        """The models of the manifest and their dependencies on other models"""
+        graph = cls(unique_id for unique_id in manifest_graph["nodes"] if unique_id.startswith("model."))
+        for child_id, name in enumerate(graph.names):
+            for parent_name in manifest_graph["nodes"][name]["depends_on"]["nodes"]:
+                parent_id = graph.ids.get(parent_name)
+                if parent_id is not None:
+                    graph.add_edge(parent_id, child_id)
+        return graph
+
+    def subgraph(self, names: Iterable[str]) -> "ModelsGraph":
+        """The graph of the given nodes and the dependencies between them"""
+        graph = ModelsGraph(name for name in names if name in self.ids)
+        for child_id, name in enumerate(graph.names):
+            for parent_id in self.parents[self.ids[name]]:
+                subgraph_parent_id = graph.ids.get(self.names[parent_id])
+                if subgraph_parent_id is not None:
+                    graph.add_edge(subgraph_parent_id, child_id)
+        return graph
+
+    def edges(self) -> Iterator[Tuple[int, int]]:
+        for child_id, parents_ids in enumerate(self.parents):
+            for parent_id in parents_ids:
+                yield parent_id, child_id
+
+    def edges_count(self) -> int:
+        return sum(len(parents_ids) for parents_ids in self.parents)
+
+    def roots(self) -> List[int]:
+        """Nodes without parents"""
+        return [node_id for node_id, parents_ids in enumerate(self.parents) if not parents_ids]
+
+    def topological_order(self) -> List[int]:
+        """Parents before their children (Kahn's algorithm). Raises GraphCycleError on a cycle"""
+        in_degrees = [len(parents_ids) for parents_ids in self.parents]
+        queue = deque(self.roots())
+        order = []
+        while queue:
+            node_id = queue.popleft()
+            order.append(node_id)
+            for child_id in self.children[node_id]:
+                in_degrees[child_id] -= 1
+                if in_degrees[child_id] == 0:
+                    queue.append(child_id)
+
+        if len(order) < len(self.names):
+            cycle_nodes = sorted(self.names[node_id] for node_id, degree in enumerate(in_degrees) if degree > 0)
+            raise GraphCycleError(f"Dependency cycle between nodes: {cycle_nodes}")
+        return order
+
+    def longest_paths(self, weights: List[float]) -> List[float]:
+        """Weight of the heaviest path from each node to a node without children, the node included"""
+        lengths = [0.0] * len(self.names)
+        for node_id in reversed(self.topological_order()):
+            lengths[node_id] = weights[node_id] + max((lengths[child_id] for child_id in self.children[node_id]), default=0.0)
+        return lengths
+
+    def contract(self, groups: List[List[int]], names: List[str]) -> "ModelsGraph":
+        """The graph of the groups of nodes, names[i] being the name of groups[i]"""
+        graph = ModelsGraph(names)
+        groups_ids = [0] * len(self.names)
+        for group, name in zip(groups, names):
+            for node_id in group:
+                groups_ids[node_id] = graph.ids[name]
+        for parent_id, child_id in self.edges():
+            if groups_ids[parent_id] != groups_ids[child_id]:
+                graph.add_edge(groups_ids[parent_id], groups_ids[child_id])
+        return graph
+
+    def group_nodes(self, max_group_size: int) -> List[List[int]]:
+        """
+        Groups of at most max_group_size nodes which can run as one task, each in topological
+        order: the linear chains (a node whose parent has no other child, and which has no
+        other parent), then the groups with the same parents and children. The graph of these
+        groups has no cycle. Best on a transitively reduced graph, with longer chains.
+        """
+        order = self.topological_order()
+        groups: List[List[int]] = []
+        groups_ids = [0] * len(self.names)
+        for node_id in order:
+            parents_ids = self.parents[node_id]
+            if len(parents_ids) == 1:
+                parent_id = next(iter(parents_ids))
+                group = groups[groups_ids[parent_id]]
+                if len(self.children[parent_id]) == 1 and group[-1] == parent_id and len(group) < max_group_size:
+                    group.append(node_id)
+                    groups_ids[node_id] = groups_ids[parent_id]
+                    continue
+            groups_ids[node_id] = len(groups)
+            groups.append([node_id])
+
+        # only the first node of a chain has parents outside of it, and only its last node children
+        siblings: Dict[Tuple[FrozenSet[int], FrozenSet[int]], List[List[int]]] = {}
+        for group in groups:
+            parents_groups = frozenset(groups_ids[parent_id] for parent_id in self.parents[group[0]])
+            children_groups = frozenset(groups_ids[child_id] for child_id in self.children[group[-1]])
+            siblings.setdefault((parents_groups, children_groups), []).append(group)
+
+        merged_groups = []
+        for siblings_groups in siblings.values():
+            merged_group: List[int] = []
+            for group in siblings_groups:
+                if merged_group and len(merged_group) + len(group) > max_group_size:
+                    merged_groups.append(merged_group)
+                    merged_group = []
+                merged_group.extend(group)
+            merged_groups.append(merged_group)
+
+        positions = [0] * len(order)
+        for position, node_id in enumerate(order):
+            positions[node_id] = position
+        for merged_group in merged_groups:
+            merged_group.sort(key=positions.__getitem__)
+        merged_groups.sort(key=lambda merged_group: positions[merged_group[0]])
+        return merged_groups
+
+    def transitive_reduction(self) -> int:
+        """
+        Remove the edges implied by a longer path (A -> C when A -> B -> C), keeping the same
+        reachability. The descendants of each node are a bitset of the topological positions,
+        built from the last node to the first, and dropped once all the parents of the node
+        are done: only the bitsets of the nodes between processed and pending parents are kept.
+        Returns the number of removed edges.
+        """
+        order = self.topological_order()
+        positions = [0] * len(order)
+        for position, node_id in enumerate(order):
+            positions[node_id] = position
+
+        descendants = [0] * len(order)
+        pending_parents = [len(parents_ids) for parents_ids in self.parents]
+        removed_edges = 0
+        for node_id in reversed(order):
+            reached = 0
+            # a child reaching another child comes before it in the topological order
+            for child_id in sorted(self.children[node_id], key=positions.__getitem__):
+                child_bit = 1 << positions[child_id]
+                if reached & child_bit:
+                    self.children[node_id].discard(child_id)
+                    self.parents[child_id].discard(node_id)
+                    removed_edges += 1
+                else:
+                    reached |= child_bit | descendants[child_id]
+                pending_parents[child_id] -= 1
+                if pending_parents[child_id] == 0:
+                    descendants[child_id] = 0
+            if pending_parents[node_id] > 0:
+                descendants[node_id] = reached
+        return removed_edges
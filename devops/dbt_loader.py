@@ -0,0 +1,98 @@
+"""Airflow DAGs of the dbt selectors, built from the JSON graphs written by
+generate_dbt_dag.py --output-format json.
+
+The DAG file of a selector only calls load_dag: the task groups and their dependencies
+are created in loops from the JSON file of the same name, so the scheduler parses a few
+lines whatever the size of the graph.
+"""
+import json
+from os import path
+from typing import Any, Dict, Optional
+
+import pendulum
+
+from airflow import DAG
+from airflow.utils.dates import datetime
+from airflow.utils.task_group import TaskGroup
+
+from operators.callbacks import DagCallback
+
+from operators.constants import DBT_EMAIL_VARIABLE_NAME
+
+from dbt_operators import ExecuteDBTJob
+
+# version of the JSON graphs, written by generate_dbt_dag.py
+DAG_SPEC_VERSION = 4
+
+SOURCE_TESTS_GROUP_NAME = "sources_tests"
+
+default_args = {
+    "owner": 'airflow',
+    "start_date": datetime(2022, 1, 1, tzinfo=pendulum.timezone("Europe/Paris")),
+    "depends_on_past": False,
+    "retries": 0,
+    "priority_weight": 1
+}
+
+
+def _dbt_task(
+        task_id: str, test_or_run: str, model_name: str, priority_weight: int, skip_unchanged: bool = False
+) -> ExecuteDBTJob:
+    # the priorities are the critical paths computed by the generator
+    return ExecuteDBTJob(
+        task_id=task_id,
+        test_or_run=test_or_run,
+        model_name=model_name,
+        trigger_rule="none_failed",
+        pool="dbt_test" if test_or_run == "test" else "dbt_run",
+        priority_weight=priority_weight,
+        weight_rule="absolute",
+        # a run is skipped by the service when the inputs of the model did not change
+        skip_unchanged=skip_unchanged and test_or_run == "run"
+    )
+
+
+def build_dag(spec: Dict[str, Any]) -> DAG:
+    if spec["version"] != DAG_SPEC_VERSION:
+        raise ValueError(f"Unsupported DAG spec version {spec['version']} for {spec['dag_id']}")
+
+    with DAG(
+            dag_id=spec["dag_id"],
+            schedule_interval=spec["schedule"],
+            default_args=default_args,
+            max_active_runs=1,
+            on_failure_callback=DagCallback(email_variable_name=DBT_EMAIL_VARIABLE_NAME).handle_failure,
+            on_success_callback=DagCallback(email_variable_name=DBT_EMAIL_VARIABLE_NAME).handle_success,
+            catchup=False
+    ) as dag:
+        sources_tests: Optional[TaskGroup] = None
+        if spec["sources_tests"]:
+            with TaskGroup(group_id=SOURCE_TESTS_GROUP_NAME) as sources_tests:
+                for task_id, model_name in spec["sources_tests"]:
+                    _dbt_task(task_id, "test", model_name, spec["sources_tests_priority"])
+
+        groups = []
+        for group_id, run_task_id, test_task_id, model_name, action, priority in spec["models"]:
+            if action == "build":
+                # models run together, model_name holds their names
+                groups.append(_dbt_task(run_task_id, action, model_name, priority))
+                continue
+            with TaskGroup(group_id=group_id) as group:
+                run_task = _dbt_task(run_task_id, "run", model_name, priority, spec["skip_unchanged"])
+                if test_task_id is not None:
+                    run_task >> _dbt_task(test_task_id, "test", model_name, priority)
+            groups.append(group)
+
+        # models dependencies, as positions in the models list
+        for parent, child in spec["dependencies"]:
+            groups[parent] >> groups[child]
+        if sources_tests is not None:
+            for root in spec["roots"]:
+                sources_tests >> groups[root]
+    return dag
+
+
+def load_dag(dag_file_path: str) -> DAG:
+    """DAG of the JSON graph next to the DAG file"""
+    with open(path.splitext(dag_file_path)[0] + ".json") as f:
+        return build_dag(json.load(f))
@@ -0,0 +1,220 @@
+"""Airflow operator running one dbt job on the dbt cloud run service.
+
+This module is deployed in the dags folder of composer, next to the generated dags,
+so that both the workers and the triggerer can import it.
+"""
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+import requests
+
+from airflow.exceptions import AirflowException, AirflowSkipException
+from airflow.models import BaseOperator, Variable
+from airflow.stats import Stats
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+from airflow.utils.decorators import apply_defaults
+
+import google.auth.transport.requests
+import google.oauth2.id_token
+
+# seconds a /job call waits for a status change before answering
+JOB_STATUS_WAIT = 60
+
+# seconds given to a dbt job to finish
+DEFAULT_JOB_TIMEOUT = 20 * 60
+
+# seconds before calling the service again after a network error
+RETRY_DELAY = 5
+
+# consecutive rejections of a new ID token before the trigger fails
+MAX_AUTH_ATTEMPTS = 3
+
+TERMINAL_STATUSES = {"success", "failed", "cancelled", "timeout"}
+
+
+def fetch_id_token(cloud_run_url: str) -> str:
+    # sent to the statsd of Airflow, the operators run outside of the service and its /metrics
+    with Stats.timer("dbt_operator.fetch_id_token"):
+        auth_req = google.auth.transport.requests.Request()
+        return google.oauth2.id_token.fetch_id_token(auth_req, cloud_run_url)
+
+
+class DBTJobTrigger(BaseTrigger):
+    """Waits in the triggerer for a dbt job to succeed or fail.
+
+    The ID token is fetched once per trigger and only fetched again when the service rejects it,
+    up to MAX_AUTH_ATTEMPTS times in a row.
+    """
+
+    def __init__(self, cloud_run_url: str, job_id: str, poll_wait: int = JOB_STATUS_WAIT, deadline: Optional[float] = None):
+        super().__init__()
+        self.cloud_run_url = cloud_run_url
+        self.job_id = job_id
+        self.poll_wait = poll_wait
+        # epoch seconds after which the job is given up and cancelled by the task, none for the triggers deferred before it
+        self.deadline = deadline
+
+    def serialize(self) -> Tuple[str, Dict[str, Any]]:
+        return (
+            f"{self.__class__.__module__}.{self.__class__.__name__}",
+            {"cloud_run_url": self.cloud_run_url, "job_id": self.job_id, "poll_wait": self.poll_wait, "deadline": self.deadline}
+        )
+
+    async def _fetch_id_token(self) -> str:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, fetch_id_token, self.cloud_run_url)
+
+    async def run(self) -> AsyncIterator[TriggerEvent]:
+        job_route = self.cloud_run_url + "/job"
+        token = await self._fetch_id_token()
+        auth_failures = 0
+
+        async with httpx.AsyncClient(timeout=self.poll_wait + 30) as client:
+            while self.deadline is None or time.time() < self.deadline:
+                wait = self.poll_wait if self.deadline is None else max(1, min(self.poll_wait, int(self.deadline - time.time())))
+                try:
+                    response = await client.get(
+                        job_route, params={"job_id": self.job_id, "wait": wait}, headers={"Authorization": f"Bearer {token}"}
+                    )
+                except httpx.TransportError as e:
+                    self.log.warning(f"Could not get the status of job {self.job_id}: {e}")
+                    await asyncio.sleep(RETRY_DELAY)
+                    continue
+
+                if response.status_code in (401, 403):
+                    # the token has expired, or the trigger is not allowed to call the service
+                    auth_failures += 1
+                    if auth_failures >= MAX_AUTH_ATTEMPTS:
+                        response.raise_for_status()
+                    await asyncio.sleep(RETRY_DELAY)
+                    token = await self._fetch_id_token()
+                    continue
+                auth_failures = 0
+                response.raise_for_status()
+
+                job_status = response.json()["job_status"]
+                self.log.info(f"Job {self.job_id} status: {job_status}")
+                if job_status in TERMINAL_STATUSES:
+                    yield TriggerEvent({"job_id": self.job_id, "job_status": job_status})
+                    return
+        yield TriggerEvent({"job_id": self.job_id, "job_status": None, "timed_out": True})
+
+
+class ExecuteDBTJob(BaseOperator):
+    """Submits a dbt run or test of a model to the dbt service and waits for the job.
+
+    When deferrable, the wait happens in the triggerer and the worker slot is released
+    until the job succeeds or fails.
+    """
+
+    @apply_defaults
+    def __init__(
+            self,
+            test_or_run: str,
+            model_name: str,
+            deferrable: bool = True,
+            job_timeout: int = DEFAULT_JOB_TIMEOUT,
+            job_priority: str = "normal",
+            skip_unchanged: bool = False,
+            *args,
+            **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.test_or_run = test_or_run
+        self.model_name = model_name
+        self.deferrable = deferrable
+        self.job_timeout = job_timeout
+        # "low" to wait in the queue of the service rather than being rejected when it is busy
+        self.job_priority = job_priority
+        # a run is skipped when the inputs of the model did not change since its last success
+        self.skip_unchanged = skip_unchanged
+        # job being waited for by the worker, cancelled if the task is killed
+        self._running_job = None
+
+    def _submit_job(self, cloud_run_url: str, headers: Dict[str, str]) -> str:
+        dbt_route = cloud_run_url + f"/{self.test_or_run}_model"
+        params = {"model_name": self.model_name, "priority": self.job_priority}
+        if self.skip_unchanged:
+            params["skip_unchanged"] = "true"
+
+        # the service rejects the jobs over its limits, the submission is retried when it says so
+        deadline = time.monotonic() + self.job_timeout
+        while True:
+            self.log.info(f"Calling {dbt_route} with params {params}")
+            response = requests.post(dbt_route, params=params, timeout=1500, headers=headers)
+            if response.status_code != 429:
+                break
+            retry_after = int(response.headers.get("Retry-After", RETRY_DELAY))
+            if time.monotonic() + retry_after > deadline:
+                raise AirflowException(f"The dbt service is at capacity: {response.json()['message']}")
+            self.log.warning(f"{response.json()['message']}, retrying in {retry_after}s")
+            time.sleep(retry_after)
+        response.raise_for_status()
+
+        resp = response.json()
+        if resp.get("skip_job") is True:
+            raise AirflowSkipException()
+        return resp["job_id"]
+
+    def _wait_for_job(self, cloud_run_url: str, headers: Dict[str, str], job_id: str):
+        # the service answers as soon as the job status changes
+        deadline = time.monotonic() + self.job_timeout
+        job_route = cloud_run_url + "/job"
+        while time.monotonic() < deadline:
+            self.log.info(f"Waiting for job {job_id} ...")
+            wait = max(1, min(JOB_STATUS_WAIT, int(deadline - time.monotonic())))
+            job_status_req = requests.get(
+                job_route, params={"job_id": job_id, "wait": wait}, headers=headers, timeout=wait + 30
+            )
+            job_status_req.raise_for_status()
+            job_status = job_status_req.json()["job_status"]
+            self.log.info(f"Job status fetched: {job_status}")
+            if job_status == "success":
+                return
+            if job_status in TERMINAL_STATUSES:
+                raise AirflowException(f"Job {job_id} {job_status}")
+        # the service would keep running the job after the task failure
+        self._cancel_job(cloud_run_url, headers, job_id)
+        raise AirflowException("No response in time")
+
+    def _cancel_job(self, cloud_run_url: str, headers: Dict[str, str], job_id: str):
+        self.log.info(f"Cancelling job {job_id}")
+        response = requests.post(cloud_run_url + f"/job/{job_id}/cancel", headers=headers, timeout=30)
+        # 409 when the job has finished meanwhile
+        if response.status_code != 409:
+            response.raise_for_status()
+
+    def execute(self, context: Dict[str, Any]):
+
+        cloud_run_url = Variable.get("CLOUD_RUN_URL")
+        headers = {"Authorization": f"Bearer {fetch_id_token(cloud_run_url)}"}
+
+        job_id = self._submit_job(cloud_run_url, headers)
+
+        if self.deferrable:
+            # the trigger gives up at the deadline, the deferral timeout only covers a lost trigger
+            self.defer(
+                trigger=DBTJobTrigger(cloud_run_url=cloud_run_url, job_id=job_id, deadline=time.time() + self.job_timeout),
+                method_name="execute_complete",
+                timeout=timedelta(seconds=self.job_timeout + JOB_STATUS_WAIT + 60)
+            )
+        self._running_job = (cloud_run_url, headers, job_id)
+        self._wait_for_job(cloud_run_url, headers, job_id)
+        self._running_job = None
+
+    def on_kill(self):
+        if self._running_job is not None:
+            self._cancel_job(*self._running_job)
+
+    def execute_complete(self, context: Dict[str, Any], event: Dict[str, Any]):
+        if event.get("timed_out"):
+            # the service would keep running the job after the task failure
+            cloud_run_url = Variable.get("CLOUD_RUN_URL")
+            self._cancel_job(cloud_run_url, {"Authorization": f"Bearer {fetch_id_token(cloud_run_url)}"}, event["job_id"])
+            raise AirflowException("No response in time")
+        if event["job_status"] != "success":
+            raise AirflowException(f"Job {event['job_id']} {event['job_status']}")
+        self.log.info(f"Job {event['job_id']} is successfull")
@@ -0,0 +1,242 @@
+"""Evaluation of the selectors of selectors.yml against the manifest.json graph.
+
+The selection follows the dbt ls semantics (dbt 1.5): the nodes matched by the method,
+their parents and children, then the tests selected indirectly, combined by the unions,
+intersections and exclusions. Only the tag method is supported.
+"""
+import re
+from fnmatch import fnmatch
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# graph members of the manifest
+MANIFEST_GRAPH_SECTIONS = ("nodes", "sources", "exposures", "metrics")
+
+# resource types listed by dbt ls by default
+LISTED_RESOURCE_TYPES = {"model", "snapshot", "seed", "test", "source", "exposure", "metric"}
+
+INDIRECT_SELECTION_MODES = {"eager", "cautious", "buildable", "empty"}
+
+# selector string as "@tag:value", "2+tag:value+1"
+SELECTOR_PATTERN = re.compile(
+    r"\A"
+    r"(?P<childrens_parents>(\@))?"
+    r"(?P<parents>((?P<parents_depth>(\d*))\+))?"
+    r"((?P<method>([\w.]+)):)?(?P<value>(.*?))"
+    r"(?P<children>(\+(?P<children_depth>(\d*))))?"
+    r"\Z"
+)
+
+# nodes selected directly, tests waiting for their other parents to be selected
+Selection = Tuple[Set[str], Set[str]]
+
+
+class SelectorError(Exception):
+    pass
+
+
+def _to_depth(value) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+class ManifestSelector:
+
+    def __init__(self, manifest: Dict[str, Any], selectors: List[Dict[str, Any]]):
+        self.nodes = {
+            unique_id: node
+            for section in MANIFEST_GRAPH_SECTIONS
+            for unique_id, node in manifest.get(section, {}).items()
+            if node.get("config", {}).get("enabled", True)
+        }
+        self.parents: Dict[str, Set[str]] = {unique_id: set() for unique_id in self.nodes}
+        self.children: Dict[str, Set[str]] = {unique_id: set() for unique_id in self.nodes}
+        for unique_id, node in self.nodes.items():
+            for parent_id in node.get("depends_on", {}).get("nodes", []):
+                if parent_id in self.nodes:
+                    self.parents[unique_id].add(parent_id)
+                    self.children[parent_id].add(unique_id)
+
+        self.selectors = {selector["name"]: selector["definition"] for selector in selectors}
+
+    @staticmethod
+    def _walk(edges: Dict[str, Set[str]], selected: Set[str], max_depth: Optional[int]) -> Set[str]:
+        """
+        Nodes reachable from the selected nodes within max_depth edges. A single breadth-first
+        walk from all the selected nodes, which are part of the result only if reached from
+        another selected node: the callers add them anyway.
+        """
+        reached = set()
+        visited = set(selected)
+        frontier = list(selected)
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            next_frontier = []
+            for node in frontier:
+                for next_node in edges[node]:
+                    if next_node in selected:
+                        reached.add(next_node)
+                    if next_node not in visited:
+                        visited.add(next_node)
+                        reached.add(next_node)
+                        next_frontier.append(next_node)
+            frontier = next_frontier
+            depth += 1
+        return reached
+
+    def select_parents(self, selected: Set[str], max_depth: Optional[int] = None) -> Set[str]:
+        return self._walk(self.parents, selected, max_depth)
+
+    def select_children(self, selected: Set[str], max_depth: Optional[int] = None) -> Set[str]:
+        return self._walk(self.children, selected, max_depth)
+
+    def _is_test(self, unique_id: str) -> bool:
+        return self.nodes[unique_id]["resource_type"] == "test"
+
+    def _search(self, method: str, value: str) -> Set[str]:
+        if method != "tag":
+            raise SelectorError(f"Unsupported selector method: {method}")
+        if not any(wildcard in value for wildcard in "*?["):
+            return {unique_id for unique_id, node in self.nodes.items() if value in node.get("tags", [])}
+        return {
+            unique_id for unique_id, node in self.nodes.items()
+            if any(fnmatch(tag, value) for tag in node.get("tags", []))
+        }
+
+    def _expand_tests(self, selected: Set[str], indirect_selection: str) -> Selection:
+        """Add the tests of the selected nodes, depending on the indirect selection mode"""
+        direct_nodes = set(selected)
+        indirect_nodes = set()
+        selected_and_parents = set()
+        if indirect_selection == "buildable":
+            sources = {unique_id for unique_id in self.nodes if unique_id.startswith("source.")}
+            selected_and_parents = selected | self.select_parents(selected) | sources
+
+        for unique_id in {child for node in selected for child in self.children[node]}:
+            if not self._is_test(unique_id):
+                continue
+            if indirect_selection == "eager" or self.parents[unique_id] <= selected:
+                direct_nodes.add(unique_id)
+            elif indirect_selection == "buildable" and self.parents[unique_id] <= selected_and_parents:
+                direct_nodes.add(unique_id)
+            elif indirect_selection != "empty":
+                indirect_nodes.add(unique_id)
+        return direct_nodes, indirect_nodes
+
+    def _incorporate_tests(self, direct_nodes: Set[str], indirect_nodes: Set[str], indirect_selection: str) -> Set[str]:
+        """Add the tests selected indirectly whose parents are now all selected"""
+        selected = set(direct_nodes)
+        if indirect_selection == "cautious":
+            selected.update(test for test in indirect_nodes if self.parents[test] <= direct_nodes)
+        elif indirect_selection == "buildable":
+            selected_and_parents = direct_nodes | self.select_parents(direct_nodes)
+            selected.update(test for test in indirect_nodes if self.parents[test] <= selected_and_parents)
+        return selected
+
+    def _select_criteria(self, criteria: Dict[str, Any]) -> Selection:
+        indirect_selection = criteria.get("indirect_selection") or "eager"
+        if indirect_selection not in INDIRECT_SELECTION_MODES:
+            raise SelectorError(f"Invalid indirect selection: {indirect_selection}")
+        if criteria.get("children") and criteria.get("childrens_parents"):
+            raise SelectorError(f"Invalid selector {criteria}: children and childrens_parents are incompatible")
+
+        method = criteria.get("method") or "fqn"
+        if "." in method:
+            raise SelectorError(f"Unsupported selector method: {method}")
+        selected = self._search(method, criteria["value"])
+        if indirect_selection == "empty":
+            return selected, set()
+
+        neighbors = set()
+        if criteria.get("childrens_parents"):
+            ancestors_for = self.select_children(selected) | selected
+            neighbors.update(self.select_parents(ancestors_for) | ancestors_for)
+        if criteria.get("parents"):
+            neighbors.update(self.select_parents(selected, _to_depth(criteria.get("parents_depth"))))
+        if criteria.get("children"):
+            neighbors.update(self.select_children(selected, _to_depth(criteria.get("children_depth"))))
+        return self._expand_tests(selected | neighbors, indirect_selection)
+
+    @staticmethod
+    def _combine(operator: str, selections: List[Set[str]]) -> Set[str]:
+        if not selections:
+            return set()
+        if operator == "union":
+            return set.union(*selections)
+        if operator == "intersection":
+            return set.intersection(*selections)
+        return set.difference(*selections)
+
+    def _select_group(self, operator: str, selections: List[Selection]) -> Selection:
+        direct_nodes = self._combine(operator, [direct for direct, _ in selections])
+        indirect_nodes = self._combine(operator, [direct | indirect for direct, indirect in selections])
+        # the groups use the eager indirect selection, which adds no test here
+        return direct_nodes, indirect_nodes
+
+    def _select_exclusions(self, definitions: List[Any]) -> Optional[Selection]:
+        exclusions = [self._select_definition(definition) for definition in definitions]
+        if len(exclusions) > 1:
+            return self._select_group("union", exclusions)
+        return exclusions[0] if exclusions else None
+
+    def _select_set(self, operator: str, definitions: List[Any]) -> Selection:
+        included = []
+        excluded = None
+        for definition in definitions:
+            if isinstance(definition, dict) and "exclude" in definition:
+                if excluded is not None:
+                    raise SelectorError(f"Several exclusions in the same {operator}")
+                excluded = self._select_exclusions(definition["exclude"])
+            else:
+                included.append(self._select_definition(definition))
+
+        selection = self._select_group(operator, included)
+        if excluded is None:
+            return selection
+        return self._select_group("difference", [selection, excluded])
+
+    def _select_definition(self, definition: Any) -> Selection:
+        if isinstance(definition, str):
+            match = SELECTOR_PATTERN.match(definition)
+            if match is None:
+                raise SelectorError(f"Invalid selector: {definition}")
+            return self._select_criteria(match.groupdict())
+        if "union" in definition:
+            return self._select_set("union", definition["union"])
+        if "intersection" in definition:
+            return self._select_set("intersection", definition["intersection"])
+
+        if len(definition) == 1:
+            method, value = next(iter(definition.items()))
+            return self._select_criteria({"method": method, "value": value})
+        if definition.get("method") == "selector":
+            return self._select_definition(self.selectors[definition["value"]])
+        if "method" not in definition or "value" not in definition:
+            raise SelectorError(f"Expected method and value keys in selector definition, got {list(definition)}")
+
+        selection = self._select_criteria(definition)
+        if "exclude" not in definition:
+            return selection
+        return self._select_group("difference", [selection, self._select_exclusions(definition["exclude"])])
+
+    def select(self, selector_name: str) -> Set[str]:
+        """Unique ids of the nodes selected by the selector"""
+        if selector_name not in self.selectors:
+            raise SelectorError(f"Unknown selector: {selector_name}")
+        direct_nodes, _ = self._select_definition(self.selectors[selector_name])
+        return direct_nodes
+
+    def _list_name(self, unique_id: str) -> str:
+        node = self.nodes[unique_id]
+        if node["resource_type"] == "source":
+            return f"source:{node['package_name']}.{node['source_name']}.{node['name']}"
+        if node["resource_type"] in ("exposure", "metric"):
+            return f"{node['resource_type']}:{node['package_name']}.{node['name']}"
+        return ".".join(node["fqn"])
+
+    def list(self, selector_name: str) -> List[str]:
+        """Resources of the selector, as listed by dbt ls --selector"""
+        return [
+            self._list_name(unique_id) for unique_id in sorted(self.select(selector_name))
+            if self.nodes[unique_id]["resource_type"] in LISTED_RESOURCE_TYPES
+        ]
@@ -1,28 +1,201 @@
+import argparse
 import time
-from os import environ
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from os import environ, listdir, path
 import json
+from typing import Callable, Dict, Iterable, List, Optional
 
-from google.cloud import storage
-from google.oauth2 import service_account
+from dag_storage import GCSStorage, LocalStorage, Storage, get_file_md5
 
+DAGS_PREFIX = "dags/"
 
-def upload_file(file_path: str, gcloud_file_name: str, bucket_name: str):
-    token_as_string = environ["SA_KEY_JSON"]
-    token = json.loads(token_as_string)
+# DAG files and JSON graphs written by generate_dbt_dag.py, dbt_dag.py is the former single DAG file
+DAG_FILE_PREFIX = "dbt_dag_"
 
-    credentials = service_account.Credentials.from_service_account_info(token)
-    client = storage.Client(credentials=credentials, project=token["project_id"])
-    bucket = client.get_bucket(bucket_name)
-    blob = bucket.blob(gcloud_file_name)
-    blob.upload_from_filename(file_path)
-    print("File uploaded successfully")
-    time.sleep(60)
+LEGACY_DAG_FILE = "dbt_dag.py"
 
+# the DAG of a selector is named dbt_<selector>
+DAG_ID_PREFIX = "dbt_"
 
-if __name__ == "__main__":
+DEFAULT_DAGS_DIR = "dbt_dags"
+
+# uploads and deletions run concurrently over the same storage client
+DEFAULT_DEPLOY_WORKERS = 8
+
+DEFAULT_POLL_INTERVAL = 10
+
+
+class DagsNotReadyError(Exception):
+    pass
+
+
+def is_generated_dag_file(file_name: str) -> bool:
+    return file_name == LEGACY_DAG_FILE or (
+        file_name.startswith(DAG_FILE_PREFIX) and (file_name.endswith(".py") or file_name.endswith(".json"))
+    )
+
+
+def get_dag_files(dags_dir: str) -> Dict[str, str]:
+    """
+    :return: local path of each file to deploy, by stored name
+    """
+    # the operators module is imported by the dags, as well as by the triggerer, and the
+    # loader module by the dags generated in the json format
+    devops_dir = path.dirname(path.realpath(__file__))
+    dag_files = {
+        f"{DAGS_PREFIX}{module_file}": path.join(devops_dir, module_file)
+        for module_file in ("dbt_operators.py", "dbt_loader.py")
+    }
+    for file_name in sorted(listdir(dags_dir)):
+        if is_generated_dag_file(file_name):
+            dag_files[DAGS_PREFIX + file_name] = path.join(dags_dir, file_name)
+    return dag_files
+
+
+def get_dag_id(name: str) -> Optional[str]:
+    """DAG id of a stored DAG file or JSON graph (dbt_<selector>), None for the other files"""
+    file_name, extension = path.splitext(name[len(DAGS_PREFIX):])
+    if file_name.startswith(DAG_FILE_PREFIX) and extension in (".py", ".json"):
+        return DAG_ID_PREFIX + file_name[len(DAG_FILE_PREFIX):]
+    return None
+
+
+def get_upload_stage(name: str) -> int:
+    """
+    Stage of the upload of a stored file: the shared modules, then the JSON graphs, then the DAG
+    files, so that Airflow never parses a DAG file against the files it reads before they are uploaded
+    """
+    if get_dag_id(name) is None:
+        return 0
+    return 1 if name.endswith(".json") else 2
+
+
+def deploy_dags(storage: Storage, dags_dir: str, workers: int = DEFAULT_DEPLOY_WORKERS) -> Dict[str, List[str]]:
+    """
+    Upload the DAG files whose MD5 differs from the stored copy, and delete the stored
+    generated DAG files that are no longer generated. The files of a stage are uploaded
+    concurrently, once the previous stage is uploaded, and deleted in the reverse order.
+    :return: stored names by action: uploaded, unchanged, deleted
+    """
+    dag_files = get_dag_files(dags_dir)
+    stored_md5 = storage.list_md5(DAGS_PREFIX)
+
+    actions: Dict[str, List[str]] = {"uploaded": [], "unchanged": [], "deleted": []}
+    for name, file_path in dag_files.items():
+        if stored_md5.get(name) == get_file_md5(file_path):
+            actions["unchanged"].append(name)
+        else:
+            actions["uploaded"].append(name)
+
+    for name in sorted(stored_md5):
+        file_name = name[len(DAGS_PREFIX):]
+        if "/" not in file_name and is_generated_dag_file(file_name) and name not in dag_files:
+            actions["deleted"].append(name)
+
+    def upload(name: str):
+        storage.upload(dag_files[name], name)
+        print(f"File {name} uploaded successfully")
+
+    def delete(name: str):
+        storage.delete(name)
+        print(f"File {name} deleted")
+
+    stages = sorted({get_upload_stage(name) for name in actions["uploaded"] + actions["deleted"]})
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list() re-raises the first failed upload or deletion, before the next stage
+        for stage in stages:
+            list(executor.map(upload, [name for name in actions["uploaded"] if get_upload_stage(name) == stage]))
+        for stage in reversed(stages):
+            list(executor.map(delete, [name for name in actions["deleted"] if get_upload_stage(name) == stage]))
+
+    return actions
+
+
+def wait_for_dags(is_dag_ready: Callable[[str], bool], dag_ids: Iterable[str], timeout: float,
+                  poll_interval: float = DEFAULT_POLL_INTERVAL):
+    """Poll until all the DAGs are ready, raises DagsNotReadyError after the timeout"""
+    pending = sorted(set(dag_ids))
+    deadline = time.monotonic() + timeout
+    while True:
+        pending = [dag_id for dag_id in pending if not is_dag_ready(dag_id)]
+        if not pending:
+            return
+        if time.monotonic() + poll_interval > deadline:
+            raise DagsNotReadyError(f"DAGs not ready after {timeout}s: {pending}")
+        time.sleep(poll_interval)
+
+
+class AirflowDagsApi:
+    """DAGs parsed by the Composer Airflow, through its stable REST API"""
+
+    def __init__(self, airflow_url: str, service_account_info: Dict):
+        from google.auth.transport.requests import AuthorizedSession
+        from google.oauth2 import service_account
+
+        credentials = service_account.Credentials.from_service_account_info(
+            service_account_info, scopes=["https://www.googleapis.com/auth/cloud-platform"]
+        )
+        self.airflow_url = airflow_url.rstrip("/")
+        self.session = AuthorizedSession(credentials)
+
+    def is_dag_parsed(self, dag_id: str, since: datetime) -> bool:
+        response = self.session.get(f"{self.airflow_url}/api/v1/dags/{dag_id}")
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        last_parsed_time = response.json().get("last_parsed_time")
+        if last_parsed_time is None:
+            return False
+        return datetime.fromisoformat(last_parsed_time.replace("Z", "+00:00")) >= since
+
+
+def get_storage() -> Storage:
+    # a local directory stands for the Composer bucket when DAG_STORAGE_DIR is set
+    if environ.get("DAG_STORAGE_DIR"):
+        return LocalStorage(environ["DAG_STORAGE_DIR"])
     # TODO find automatically the composer bucket
-    upload_file(
-        file_path="dbt_dag.py",
-        gcloud_file_name="dags/dbt_dag.py",
-        bucket_name=environ["COMPOSER_BUCKET"]
+    return GCSStorage(bucket_name=environ["COMPOSER_BUCKET"], service_account_info=json.loads(environ["SA_KEY_JSON"]))
+
+
+def get_dag_ready_check(storage: Storage, deployed_at: datetime) -> Callable[[str], bool]:
+    """
+    With AIRFLOW_URL set, a DAG is ready once Airflow parsed it after the deployment.
+    Otherwise, once its file is in the storage.
+    """
+    if environ.get("AIRFLOW_URL"):
+        airflow = AirflowDagsApi(environ["AIRFLOW_URL"], json.loads(environ["SA_KEY_JSON"]))
+        return lambda dag_id: airflow.is_dag_parsed(dag_id, since=deployed_at)
+
+    def is_dag_stored(dag_id: str) -> bool:
+        name = f"{DAGS_PREFIX}{DAG_FILE_PREFIX}{dag_id[len(DAG_ID_PREFIX):]}.py"
+        return name in storage.list_md5(name)
+
+    return is_dag_stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deploy the changed DAG files to the Composer bucket")
+    parser.add_argument("--dags-dir", default=DEFAULT_DAGS_DIR, help="directory of the generated DAG files")
+    parser.add_argument("--workers", type=int, default=DEFAULT_DEPLOY_WORKERS, help="concurrent uploads")
+    parser.add_argument(
+        "--wait-timeout",
+        type=float,
+        default=0,
+        help="seconds to wait for the uploaded DAGs to be ready, no wait by default"
     )
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL)
+    args = parser.parse_args()
+
+    dags_storage = get_storage()
+    deployed_at = datetime.now(timezone.utc)
+    deploy_actions = deploy_dags(dags_storage, args.dags_dir, workers=args.workers)
+    if args.wait_timeout > 0:
+        uploaded_dag_ids = sorted({dag_id for dag_id in map(get_dag_id, deploy_actions["uploaded"]) if dag_id})
+        wait_for_dags(
+            get_dag_ready_check(dags_storage, deployed_at),
+            uploaded_dag_ids,
+            timeout=args.wait_timeout,
+            poll_interval=args.poll_interval
+        )
+        print(f"DAGs ready: {', '.join(uploaded_dag_ids) if uploaded_dag_ids else '-'}")
@@ -1,35 +1,79 @@
-import os
-from os import path, environ
-
-from typing import List, Dict, Any, Tuple, Optional
+import argparse
+import hashlib
 import json
+from os import environ, listdir, makedirs, path, remove
+
+from typing import List, Dict, Any, Set, Tuple, Optional, Union
 from enum import Enum
 import yaml
 
 from jinja2 import Environment, FileSystemLoader
 
+from dag_priorities import TaskDurations, get_priorities, load_jobs_durations, load_run_results_durations, suggest_pools_slots
+from dbt_graph import ModelsGraph
+from dbt_selectors import ManifestSelector
+from manifest_loader import load_manifest
+
 DATABASE_NAME = "wine_services_dbt"
 
 SOURCE_TESTS_GROUP_NAME = "sources_tests"
 
+TEMPLATE_NAME = "dag_template.txt"
+
+DEFAULT_OUTPUT_DIR = "dbt_dags"
+
+# DAG files are named dbt_dag_<selector>.py
+DAG_FILE_PREFIX = "dbt_dag_"
+
+FINGERPRINT_PREFIX = "# fingerprint: "
+
+# python: the tasks are written in the DAG file, json: the graph is written in a JSON file
+# read by the same loader DAG file for all the selectors
+OUTPUT_FORMATS = ("python", "json")
+
+# version of the JSON graphs, read by dbt_loader.py
+DAG_SPEC_VERSION = 4
+
+# models of a dbt build task, when the models are collapsed
+DEFAULT_MAX_GROUP_SIZE = 10
+
+LOADER_DAG_SOURCE = '''"""Airflow DAG of a dbt selector, built by dbt_loader from the JSON file of the same name"""
+from dbt_loader import load_dag
+
+dag = load_dag(__file__)
+'''
+
 
 class TaskType(Enum):
     TEST = "test"
     RUN = "run"
+    BUILD = "build"
 
 
 def load_manifest_file():
-    with open("./manifest.json") as f:
-        data = json.load(f)
-
-    return data
+    # the compact manifest snapshots are kept in DBT_DAG_CACHE_DIR, when set
+    return load_manifest("./manifest.json", cache_dir=environ.get("DBT_DAG_CACHE_DIR"))
 
 
 def is_model(node_name: str) -> bool:
     return node_name.split(".")[0] == "model"
 
 
+def is_source(node_name: str) -> bool:
+    return node_name.split(".")[0] == "source"
+
+
+def is_test(node_name: str) -> bool:
+    return node_name.split(".")[0] == "test"
+
+
 class Node:
+    __slots__ = ("node_name", "is_source", "has_tests")
+
+    action = TaskType.RUN.value
+
+    models_count = 1
+
     def __init__(self, node_name, is_source: bool = False, has_tests: bool = True):
         self.node_name = node_name
         self.is_source = is_source
@@ -38,6 +82,9 @@ class Node:
     def __eq__(self, other):
         return isinstance(other, Node) and other.node_name == self.node_name and other.is_source == self.is_source
 
+    def __hash__(self):
+        return hash((self.node_name, self.is_source))
+
     @property
     def model_name(self):
         if self.is_source is True:
@@ -55,63 +102,148 @@ class Node:
         return self.node_name.replace("model", TaskType.TEST.value). \
             replace(".", "_").replace(DATABASE_NAME + "_", "").replace("source:", "")
 
-    def _build_airflow_task_expression(self, task_type: TaskType) -> str:
+    def _build_airflow_task_expression(self, task_type: TaskType, priority_weight: int, skip_unchanged: bool = False) -> str:
         task_id = self.test_task_id if task_type == TaskType.TEST else self.run_task_id
-        pool = "dbt_run" if task_type == TaskType.RUN else "dbt_test"
-        return f"""{task_id} = ExecuteDBTJob(task_id="{task_id}", test_or_run="{task_type.value}", model_name="{self.model_name}", trigger_rule="none_failed", pool="{pool}")"""
+        pool = "dbt_test" if task_type == TaskType.TEST else "dbt_run"
+        # a run is skipped by the service when the inputs of the model did not change
+        skip_unchanged = ", skip_unchanged=True" if skip_unchanged and task_type == TaskType.RUN else ""
+        return f"""{task_id} = ExecuteDBTJob(task_id="{task_id}", test_or_run="{task_type.value}", model_name="{self.model_name}", trigger_rule="none_failed", pool="{pool}", priority_weight={priority_weight}, weight_rule="absolute"{skip_unchanged})"""
 
     @property
     def task_group_id(self) -> str:
         return self.node_name.replace(".", "_").replace(DATABASE_NAME + "_", "")
 
-    def get_run_task_expression(self) -> str:
-        return self._build_airflow_task_expression(task_type=TaskType.RUN)
+    def get_run_task_expression(self, priority_weight: int = 1, skip_unchanged: bool = False) -> str:
+        return self._build_airflow_task_expression(
+            task_type=TaskType.RUN, priority_weight=priority_weight, skip_unchanged=skip_unchanged
+        )
 
-    def get_test_task_expression(self) -> str:
-        return self._build_airflow_task_expression(task_type=TaskType.TEST)
+    def get_test_task_expression(self, priority_weight: int = 1) -> str:
+        return self._build_airflow_task_expression(task_type=TaskType.TEST, priority_weight=priority_weight)
 
-    def get_tasks_group_expression(self):
+    def get_tasks_group_expression(self, priority_weight: int = 1, skip_unchanged: bool = False):
         group_expression = f"""with TaskGroup(group_id="{self.task_group_id}") as {self.task_group_id}:
-        {self.get_run_task_expression()}"""
+        {self.get_run_task_expression(priority_weight, skip_unchanged)}"""
         if self.has_tests:
             group_expression += f"""
-        {self.get_test_task_expression()}
+        {self.get_test_task_expression(priority_weight)}
         {self.run_task_id} >> {self.test_task_id}
         """
         return group_expression
 
 
+class ModelsGroup:
+    """Models run by a single dbt build task, with their tests"""
+    __slots__ = ("nodes",)
+
+    action = TaskType.BUILD.value
+
+    is_source = False
+
+    test_task_id = None
+
+    def __init__(self, nodes: List[Node]):
+        self.nodes = nodes
+
+    def __eq__(self, other):
+        return isinstance(other, ModelsGroup) and other.nodes == self.nodes
+
+    def __hash__(self):
+        return hash(tuple(self.nodes))
+
+    @property
+    def models_count(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def node_name(self) -> str:
+        return " ".join(node.node_name for node in self.nodes)
+
+    @property
+    def has_tests(self) -> bool:
+        return any(node.has_tests for node in self.nodes)
+
+    @property
+    def model_name(self) -> str:
+        # dbt build --select takes the models separated by spaces
+        return " ".join(node.model_name for node in self.nodes)
+
+    @property
+    def task_group_id(self) -> str:
+        # named after its first model: model_<package>_<name> to build_<package>_<name>_<size>
+        first_node_id = self.nodes[0].task_group_id
+        return f"{TaskType.BUILD.value}_{first_node_id[first_node_id.index('_') + 1:]}_{len(self.nodes)}"
+
+    @property
+    def run_task_id(self) -> str:
+        return self.task_group_id
+
+    def get_tasks_group_expression(self, priority_weight: int = 1, skip_unchanged: bool = False) -> str:
+        # the dbt build tasks are not skipped
+        task_id = self.task_group_id
+        return f"""{task_id} = ExecuteDBTJob(task_id="{task_id}", test_or_run="{self.action}", model_name="{self.model_name}", trigger_rule="none_failed", pool="dbt_run", priority_weight={priority_weight}, weight_rule="absolute")"""
+
+
+DagNode = Union[Node, ModelsGroup]
+
+
 class Graph:
     def __init__(
             self,
             selector_name: str,
             selector_schedule: Optional[str],
-            models_nodes: List[Node],
-            nodes_dependencies: List[Tuple[Node, Node]],
-            sources_nodes: List[Node]
+            models_graph: ModelsGraph,
+            models_nodes: List[DagNode],
+            sources_nodes: List[Node],
+            durations: Optional[TaskDurations] = None,
+            skip_unchanged: bool = False
     ):
+        """
+        models_nodes[i] is the node of id i in models_graph. The tasks priorities are the
+        critical path from their model, weighted by the durations, or the depth without them.
+        With skip_unchanged, the run tasks are skipped by the service when the inputs of their
+        model did not change since its last successful run.
+        """
         self.name = "dbt_" + selector_name
+        self.selector_schedule = selector_schedule
+        self.skip_unchanged = skip_unchanged
+        self.models_graph = models_graph
         self.models_nodes = models_nodes
         self.sources_nodes = sources_nodes
 
         self.schedule = None if selector_schedule is None else f"\"{selector_schedule}\""
-        assert len(models_nodes) > 1, f"No nodes for graph {self.name}"
-        self.nodes_dependencies = nodes_dependencies
-        self.validate_models_dependencies()
+        assert sum(node.models_count for node in models_nodes) > 1, f"No nodes for graph {self.name}"
+        assert len(models_nodes) == len(models_graph), f"Nodes of graph {self.name} do not match its models graph"
+        # raises on a dependency cycle
+        self.nodes_order = models_graph.topological_order()
+
+        self.run_weights, self.test_weights = self.get_weights(durations or TaskDurations())
+        self.priorities = get_priorities(
+            models_graph, [run_weight + test_weight for run_weight, test_weight in zip(self.run_weights, self.test_weights)]
+        )
+        # the sources tests come before all the models
+        self.sources_tests_priority = max(self.priorities) + 1
 
-    def validate_models_dependencies(self):
-        """
-        Make sure that all nodes dependencies are in nodes list
-        """
-        nodes_names = {node.node_name for node in self.models_nodes}
-        for (start_node, target_node) in self.nodes_dependencies:
-            assert start_node.node_name in nodes_names, f"Unknown node {start_node.node_name}"
-            assert target_node.node_name in nodes_names, f"Unknown node {target_node.node_name}"
+    def get_weights(self, durations: TaskDurations) -> Tuple[List[float], List[float]]:
+        """Durations of the run and test tasks of each node, the tests of a group run in its dbt build"""
+        run_weights = []
+        test_weights = []
+        for node in self.models_nodes:
+            nodes = node.nodes if isinstance(node, ModelsGroup) else [node]
+            run_weight = sum(durations.get_run_duration(member.model_name) for member in nodes)
+            test_weight = sum(durations.get_test_duration(member.model_name) for member in nodes if member.has_tests)
+            if isinstance(node, ModelsGroup):
+                run_weight, test_weight = run_weight + test_weight, 0
+            run_weights.append(run_weight)
+            test_weights.append(test_weight)
+        return run_weights, test_weights
 
     def build_dbt_test_sources_task(self):
 
         task_group_expression = f"""with TaskGroup(group_id="{SOURCE_TESTS_GROUP_NAME}") as {SOURCE_TESTS_GROUP_NAME}:"""
-        tests_tasks_expressions = "\n        ".join([source_node.get_test_task_expression() for source_node in self.sources_nodes])
+        tests_tasks_expressions = "\n        ".join([
+            source_node.get_test_task_expression(self.sources_tests_priority) for source_node in self.sources_nodes
+        ])
         return task_group_expression + "\n        " + tests_tasks_expressions
 
     def build_dbt_tasks_list_expressions(self) -> List[str]:
@@ -123,33 +255,24 @@ class Graph:
         if self.sources_nodes:
             dbt_tasks_expressions_list.append(self.build_dbt_test_sources_task())
 
-        for node in self.models_nodes:
-            dbt_tasks_expressions_list.append(node.get_tasks_group_expression())
+        for node_id in self.nodes_order:
+            dbt_tasks_expressions_list.append(
+                self.models_nodes[node_id].get_tasks_group_expression(self.priorities[node_id], self.skip_unchanged)
+            )
 
         return dbt_tasks_expressions_list
 
-    def _get_root_nodes(self) -> List[Node]:
-        """List of models without parents"""
-        nodes_with_parents = []
-        for dependency in self.nodes_dependencies:
-            child = dependency[1]
-            nodes_with_parents.append(child)
-
-        root_nodes = [node for node in self.models_nodes if node not in nodes_with_parents]
-
-        return root_nodes
-
     def build_tasks_dependencies_expressions(self):
-        dependencies_expressions = []
-        for (start_node, end_node) in self.nodes_dependencies:
-            dependencies_expressions.append(f"{start_node.task_group_id} >> {end_node.task_group_id}")
+        task_groups_ids = [node.task_group_id for node in self.models_nodes]
+        dependencies_expressions = [
+            f"{task_groups_ids[parent_id]} >> {task_groups_ids[child_id]}"
+            for (parent_id, child_id) in self.models_graph.edges()
+        ]
 
         if self.sources_nodes:
-            roots_nodes = self._get_root_nodes()
-
             # build a dependency between tests_source and each root node
-            for root_node in roots_nodes:
-                dependencies_expressions.append(f"{SOURCE_TESTS_GROUP_NAME} >> {root_node.task_group_id}")
+            for root_id in self.models_graph.roots():
+                dependencies_expressions.append(f"{SOURCE_TESTS_GROUP_NAME} >> {task_groups_ids[root_id]}")
 
         return dependencies_expressions
 
@@ -157,158 +280,364 @@ class Graph:
         self.tasks_list_expressions = self.build_dbt_tasks_list_expressions()
         self.tasks_dependencies_expressions = self.build_tasks_dependencies_expressions()
 
-
-def get_nodes_dependencies(nodes: Dict[str, Node], manifest_graph: Dict[str, Any]) -> List[Tuple[Node, Node]]:
-    """
-    :return: dependencies expressions between each consecutive nodes
-    """
-
-    nodes_dependencies = []
-    for node_name, node in nodes.items():
-        upstream_nodes_names = {
-            node_name for node_name in manifest_graph["nodes"][node_name]["depends_on"]["nodes"]
-            if is_model(node_name)
+    def to_spec(self) -> Dict[str, Any]:
+        """
+        The tasks of the DAG as read by dbt_loader. The models, or groups of models run by
+        a dbt build, are in topological order; the dependencies and roots are positions in
+        the models list.
+        """
+        positions = [0] * len(self.nodes_order)
+        for position, node_id in enumerate(self.nodes_order):
+            positions[node_id] = position
+
+        models = []
+        for node_id in self.nodes_order:
+            node = self.models_nodes[node_id]
+            test_task_id = node.test_task_id if node.has_tests else None
+            models.append([
+                node.task_group_id, node.run_task_id, test_task_id, node.model_name, node.action, self.priorities[node_id]
+            ])
+
+        return {
+            "version": DAG_SPEC_VERSION,
+            "dag_id": self.name,
+            "schedule": self.selector_schedule,
+            "skip_unchanged": self.skip_unchanged,
+            "sources_tests": [[node.test_task_id, node.model_name] for node in self.sources_nodes],
+            "sources_tests_priority": self.sources_tests_priority,
+            "models": models,
+            "dependencies": sorted([positions[parent_id], positions[child_id]] for parent_id, child_id in self.models_graph.edges()),
+            "roots": sorted(positions[root_id] for root_id in self.models_graph.roots()) if self.sources_nodes else [],
         }
 
-        for upstream_nodes_name in upstream_nodes_names:
-            upstream_node = Node(node_name=upstream_nodes_name)
-            nodes_dependencies.append((upstream_node, node))
-
-    return nodes_dependencies
+    def get_fingerprint(self, rendering: Dict[str, Any]) -> str:
+        """Hash of everything the DAG file is rendered from, the rendering being the template, code and options"""
+        dag_content = {
+            "name": self.name,
+            "schedule": self.schedule,
+            "skip_unchanged": self.skip_unchanged,
+            "nodes": [[node.node_name, node.has_tests] for node in self.models_nodes],
+            "dependencies": sorted(
+                [self.models_nodes[parent_id].node_name, self.models_nodes[child_id].node_name]
+                for (parent_id, child_id) in self.models_graph.edges()
+            ),
+            "sources": [node.node_name for node in self.sources_nodes],
+            "priorities": self.priorities,
+            "rendering": rendering,
+        }
+        return hashlib.sha256(json.dumps(dag_content, sort_keys=True).encode()).hexdigest()
 
 
 def get_jinja_template():
     current_dir = path.dirname(path.realpath(__file__))
     env = Environment(loader=FileSystemLoader(current_dir))
-    return env.get_template('dag_template.txt')
+    return env.get_template(TEMPLATE_NAME)
+
 
+def get_template_source() -> str:
+    with open(path.join(path.dirname(path.realpath(__file__)), TEMPLATE_NAME)) as f:
+        return f.read()
 
-def load_selectors_names():
+
+def get_generator_source() -> str:
+    """Source of this module, rendering the tasks expressions and the JSON graphs"""
+    with open(path.realpath(__file__)) as f:
+        return f.read()
+
+
+def get_dag_file_path(output_dir: str, selector_name: str, extension: str = ".py") -> str:
+    return path.join(output_dir, f"{DAG_FILE_PREFIX}{selector_name}{extension}")
+
+
+def read_dag_fingerprint(dag_file_path: str) -> Optional[str]:
+    """Fingerprint written on the first line of a generated DAG file, or in its JSON graph"""
+    if dag_file_path.endswith(".json"):
+        with open(dag_file_path) as f:
+            return json.load(f).get("fingerprint")
+    with open(dag_file_path) as f:
+        first_line = f.readline().strip()
+    if first_line.startswith(FINGERPRINT_PREFIX):
+        return first_line[len(FINGERPRINT_PREFIX):]
+    return None
+
+
+def load_selectors_file() -> List[Dict[str, Any]]:
     selectors_path = path.join(environ["DBT_PROFILES_DIR"], "selectors.yml")
     with open(selectors_path) as f:
-        dag_model_selectors = yaml.full_load(f)
-        for selector in dag_model_selectors["selectors"]:
+        return yaml.full_load(f)["selectors"]
 
-            yield selector["name"], selector["definition"].get("schedule")
 
+def load_selectors_names(selectors: List[Dict[str, Any]]):
+    """Name, schedule and skip_unchanged option of each selector, the options being set in its definition"""
+    for selector in selectors:
+        definition = selector["definition"] if isinstance(selector["definition"], dict) else {}
+        yield selector["name"], definition.get("schedule"), bool(definition.get("skip_unchanged", False))
 
-def parse_model_selector(selector_name):
-    """Run the dbt ls command which returns all dbt models associated with a particular
-    selection syntax"""
 
-    dbt_dir = os.environ["DBT_PROFILES_DIR"]
+def parse_model_selector(selector_name: str, manifest_selector: ManifestSelector) -> Tuple[List[str], List[str], Set[str]]:
+    """Evaluate the selector on the manifest graph, which selects the same resources as
+    the dbt ls command. Returns the unique ids of the selected models, sources and tests"""
 
-    models = os.popen(f"cd {dbt_dir} && dbt ls --selector {selector_name}").read()
+    selected_ids = manifest_selector.select(selector_name)
 
-    models = models.splitlines()
-    # rework models names to dapt it to manifest.json manner
+    models_names = sorted(unique_id for unique_id in selected_ids if is_model(unique_id))
+    sources_ids = sorted(unique_id for unique_id in selected_ids if is_source(unique_id))
+    tests_ids = {unique_id for unique_id in selected_ids if is_test(unique_id)}
 
-    models_names = []
-    sources_names = []
-    for model in models:
+    return models_names, sources_ids, tests_ids
 
-        source_prefix = f"source:{DATABASE_NAME}."
-        if model.startswith(source_prefix):
-            source_name = model.replace(source_prefix, "source:")
-            sources_names.append(source_name)
-        else:
-            table_name = model.split(".")[-1]
-            db_name = model.split(".")[0]
-            model_name = f"model.{db_name}.{table_name}"
-            models_names.append(model_name)
 
-    return models_names, sources_names
+def get_source_node_name(source_id: str) -> str:
+    """source.<package>.<source>.<table> to source:<source>.<table>, as selected by dbt test"""
+    return "source:" + ".".join(source_id.split(".")[2:])
+
+
+def build_tests_index(manifest_graph: Dict[str, Any]) -> Dict[str, Set[str]]:
+    """
+    :return: tests of each model and source: the node a generic test is defined on,
+    the nodes a singular test depends on
+    """
+    tests_index: Dict[str, Set[str]] = {}
+    for unique_id, node in manifest_graph["nodes"].items():
+        if not is_test(unique_id):
+            continue
+        attached_node = node.get("attached_node")
+        tested_nodes = [attached_node] if attached_node else node["depends_on"]["nodes"]
+        for tested_node in tested_nodes:
+            tests_index.setdefault(tested_node, set()).add(unique_id)
+
+    return tests_index
+
+
+def collapse_models(
+        models_graph: ModelsGraph,
+        models_nodes: List[Node],
+        max_group_size: int
+) -> Tuple[ModelsGraph, List[DagNode]]:
+    """
+    Replace the linear chains of models, and the models with the same parents and children,
+    by groups run with dbt build. Returns the graph of the groups and its nodes.
+    """
+    # the groups are found on the reduced graph, where the chains are not hidden by
+    # redundant dependencies; the reachability, and so the acyclicity, is the same
+    reduced_graph = models_graph.subgraph(models_graph.names)
+    reduced_graph.transitive_reduction()
+    groups = reduced_graph.group_nodes(max_group_size)
+
+    groups_nodes = [
+        models_nodes[group[0]] if len(group) == 1 else ModelsGroup([models_nodes[node_id] for node_id in group])
+        for group in groups
+    ]
+    groups_graph = models_graph.contract(groups, [node.node_name for node in groups_nodes])
+    return groups_graph, sorted(groups_nodes, key=lambda node: groups_graph.ids[node.node_name])
 
 
 def build_dag_for_selector(
         selector_name: str,
         selector_schedule: Optional[str],
-        all_nodes: List[Node],
-        all_nodes_dependencies: List[Tuple[Node, Node]]
+        models_graph: ModelsGraph,
+        manifest_selector: ManifestSelector,
+        tests_index: Dict[str, Set[str]],
+        transitive_reduction: bool = False,
+        max_group_size: Optional[int] = None,
+        durations: Optional[TaskDurations] = None,
+        skip_unchanged: bool = False
 ) -> Graph:
     print(f"Building dag for selector {selector_name} ...")
-    nodes_in_selector, sources_in_selector = parse_model_selector(selector_name=selector_name)
-
-    all_models_names = {node.node_name for node in all_nodes}
+    nodes_in_selector, sources_in_selector, tests_in_selector = parse_model_selector(
+        selector_name=selector_name, manifest_selector=manifest_selector
+    )
 
     # take only models in manifest.json
-    dag_nodes_names = set(nodes_in_selector).intersection(all_models_names)
-    dag_nodes = [Node(node_name, is_source=False, has_tests=False) for node_name in dag_nodes_names]
-    print(f"Dag nodes are got: {len(dag_nodes)} node")
-
-    sources_nodes = [Node(source_name, is_source=True, has_tests=False) for source_name in sources_in_selector]
-    # filter source nodes: take only the ones where there are tests
-
-    # all tests names
-    tests_nodes_names = set(nodes_in_selector) - all_models_names
-
-    # if node is mentioned in tests => mark it as has tests
-    for node in dag_nodes:
-        node_name = node.model_name
-        for test in tests_nodes_names:
-            if node_name in test:
-                node.has_tests = True
-                break
-
-    # take only sources that are mentioned in tests
-    sources_nodes_with_tests = []
-    for source_node in sources_nodes:
-        node_name = source_node.node_name.replace("source:", "")
-        source_test_name = node_name.split(".")[0] + "_" + node_name.split(".")[1]
-        for test_node_name in tests_nodes_names:
-            if source_test_name in test_node_name:
-                sources_nodes_with_tests.append(source_node)
-                break
-
-    print(f"Found {len(dag_nodes)} nodes and {len(sources_nodes)} sources for selector {selector_name}")
-
-    dag_nodes_dependencies = [
-        (start_node, end_node)
-        for (start_node, end_node) in all_nodes_dependencies
-        if start_node.node_name in dag_nodes_names and end_node.node_name in dag_nodes_names
+    dag_graph = models_graph.subgraph(nodes_in_selector)
+    dag_nodes = [
+        Node(node_name, is_source=False, has_tests=not tests_index.get(node_name, set()).isdisjoint(tests_in_selector))
+        for node_name in dag_graph.names
     ]
-    print(f"Found {len(dag_nodes_dependencies)} dependencies for selector {selector_name}")
+
+    # take only sources with selected tests
+    sources_nodes = [
+        Node(get_source_node_name(source_id), is_source=True, has_tests=True)
+        for source_id in sources_in_selector
+        if not tests_index.get(source_id, set()).isdisjoint(tests_in_selector)
+    ]
+
+    print(
+        f"Found {len(dag_nodes)} nodes, {dag_graph.edges_count()} dependencies "
+        f"and {len(sources_nodes)} sources for selector {selector_name}"
+    )
+    if max_group_size is not None:
+        dag_graph, dag_nodes = collapse_models(dag_graph, dag_nodes, max_group_size)
+        print(f"Collapsed the models of selector {selector_name} to {len(dag_nodes)} tasks groups")
+
+    if transitive_reduction:
+        # only the dependencies not implied by a longer path are written
+        removed_dependencies = dag_graph.transitive_reduction()
+        print(f"Removed {removed_dependencies} redundant dependencies for selector {selector_name}")
 
     graph = Graph(
         selector_name=selector_name,
         selector_schedule=selector_schedule,
+        models_graph=dag_graph,
         models_nodes=dag_nodes,
-        nodes_dependencies=dag_nodes_dependencies,
-        sources_nodes=sources_nodes_with_tests
+        sources_nodes=sources_nodes,
+        durations=durations,
+        skip_unchanged=skip_unchanged
     )
-    print(f"Building graph for selector {selector_name}")
-    graph.build()
+
+    critical_path, pools_slots = suggest_pools_slots(dag_graph, graph.run_weights, graph.test_weights)
+    unit = "s" if durations else " models"
+    print(f"Critical path of selector {selector_name}: {critical_path:.0f}{unit}, suggested pools slots: " + ", ".join(
+        f"{pool} {slots} (peak {peak})" for pool, (slots, peak) in pools_slots.items() if peak
+    ))
     return graph
 
 
-def run():
+def write_dag_files(dag: Graph, dag_file_path: str, output_format: str, fingerprint: str, template):
+    if output_format == "json":
+        with open(path.splitext(dag_file_path)[0] + ".json", "w") as f:
+            json.dump({"fingerprint": fingerprint, **dag.to_spec()}, f, separators=(",", ":"))
+        with open(dag_file_path, "w") as f:
+            f.write(LOADER_DAG_SOURCE)
+        return
+
+    dag.build()
+    with open(dag_file_path, "w") as f:
+        f.write(template.render(dags=[dag], fingerprint=fingerprint))
+
+
+def run(
+        output_dir: str = DEFAULT_OUTPUT_DIR,
+        transitive_reduction: bool = False,
+        plan: bool = False,
+        output_format: str = "python",
+        max_group_size: Optional[int] = None,
+        run_results_paths: Optional[List[str]] = None,
+        jobs_database_url: Optional[str] = None
+) -> Dict[str, List[str]]:
+    """
+    Write one DAG file per selector in output_dir, with its JSON graph in the json output
+    format. A DAG is written only when the fingerprint of its selector changed, and the
+    files of removed selectors are deleted. In plan mode, the changes are only printed.
+    With max_group_size, the chains of models are collapsed to dbt build tasks. The tasks
+    priorities are weighted by the durations of the run_results.json files and of the dbt_jobs
+    of the database, the latter first.
+    :return: selectors names by change: new, changed, unchanged, removed
+    """
     manifest_graph = load_manifest_file()
 
-    all_dbt_nodes = {
-        manifest_node_name: Node(manifest_node_name) for manifest_node_name in manifest_graph["nodes"].keys()
-        if is_model(manifest_node_name)
-    }
-    all_nodes_dependencies = get_nodes_dependencies(nodes=all_dbt_nodes, manifest_graph=manifest_graph)
+    models_graph = ModelsGraph.from_manifest(manifest_graph)
 
-    dag_model_selectors = load_selectors_names()
+    selectors = load_selectors_file()
+    manifest_selector = ManifestSelector(manifest=manifest_graph, selectors=selectors)
+    tests_index = build_tests_index(manifest_graph)
+    dag_model_selectors = list(load_selectors_names(selectors))
 
-    dags = []
-    for selector_name, selector_schedule in dag_model_selectors:
+    durations = load_run_results_durations(run_results_paths or [], tests_index)
+    if jobs_database_url:
+        jobs_durations = load_jobs_durations(jobs_database_url)
+        durations = TaskDurations(run={**durations.run, **jobs_durations.run}, test={**durations.test, **jobs_durations.test})
+
+    template = get_jinja_template()
+    # the fingerprint covers the text and the code the DAG files are rendered from, and the options of the generation
+    rendering = {
+        "template": f"{LOADER_DAG_SOURCE}{DAG_SPEC_VERSION}" if output_format == "json" else get_template_source(),
+        "generator": get_generator_source(),
+        "output_format": output_format,
+        "transitive_reduction": transitive_reduction,
+        "max_group_size": max_group_size,
+    }
+    if not plan:
+        makedirs(output_dir, exist_ok=True)
+
+    changes: Dict[str, List[str]] = {"new": [], "changed": [], "unchanged": [], "removed": []}
+    dags_files = set()
+    for selector_name, selector_schedule, skip_unchanged in dag_model_selectors:
 
         dag = build_dag_for_selector(
             selector_name=selector_name,
             selector_schedule=selector_schedule,
-            all_nodes=list(all_dbt_nodes.values()),
-            all_nodes_dependencies=all_nodes_dependencies
+            models_graph=models_graph,
+            manifest_selector=manifest_selector,
+            tests_index=tests_index,
+            transitive_reduction=transitive_reduction,
+            max_group_size=max_group_size,
+            durations=durations,
+            skip_unchanged=skip_unchanged
         )
-        dags.append(dag)
+        dag_file_path = get_dag_file_path(output_dir, selector_name)
+        # the file holding the fingerprint
+        fingerprint_file_path = get_dag_file_path(output_dir, selector_name, ".json") if output_format == "json" else dag_file_path
+        dags_files.update({path.basename(dag_file_path), path.basename(fingerprint_file_path)})
+
+        fingerprint = dag.get_fingerprint(rendering)
+        if not path.exists(dag_file_path):
+            changes["new"].append(selector_name)
+        elif not path.exists(fingerprint_file_path) or read_dag_fingerprint(fingerprint_file_path) != fingerprint:
+            changes["changed"].append(selector_name)
+        else:
+            changes["unchanged"].append(selector_name)
+            continue
 
-    template = get_jinja_template()
-    dag_expression = template.render(dags=dags)
+        if not plan:
+            write_dag_files(dag, dag_file_path, output_format, fingerprint, template)
+
+    selectors_names = {selector_name for selector_name, _, _ in dag_model_selectors}
+    existing_files = sorted(listdir(output_dir)) if path.isdir(output_dir) else []
+    for file_name in existing_files:
+        selector_name, extension = path.splitext(file_name[len(DAG_FILE_PREFIX):])
+        if not file_name.startswith(DAG_FILE_PREFIX) or extension not in (".py", ".json") or file_name in dags_files:
+            continue
+        # the JSON graph left by the other output format is deleted as well
+        if selector_name not in selectors_names and selector_name not in changes["removed"]:
+            changes["removed"].append(selector_name)
+        if not plan:
+            remove(path.join(output_dir, file_name))
 
-    with open("dbt_dag.py", "w") as f:
-        f.write(dag_expression)
+    for change, selectors_names in changes.items():
+        print(f"{change}: {', '.join(selectors_names) if selectors_names else '-'}")
+    return changes
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description="Generate the Airflow DAGs of the dbt selectors, one file per selector")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help="directory of the DAG files")
+    parser.add_argument(
+        "--transitive-reduction",
+        action="store_true",
+        help="write only the dependencies not implied by a longer path"
+    )
+    parser.add_argument("--plan", action="store_true", help="print the DAGs that would change, without writing them")
+    parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        default="python",
+        help="json: the graph of each DAG in a JSON file, read by a loader DAG file (dbt_loader.py)"
+    )
+    parser.add_argument(
+        "--collapse",
+        action="store_true",
+        help="run the linear chains of models, and the models with the same parents and children, as one dbt build task"
+    )
+    parser.add_argument("--max-group-size", type=int, default=DEFAULT_MAX_GROUP_SIZE, help="models of a dbt build task")
+    parser.add_argument(
+        "--run-results",
+        nargs="+",
+        default=[],
+        help="dbt run_results.json files whose durations weight the tasks priorities"
+    )
+    parser.add_argument(
+        "--jobs-database-url",
+        default=environ.get("DBT_JOBS_DATABASE_URL"),
+        help="database of the dbt_jobs table, whose durations weight the tasks priorities"
+    )
+    args = parser.parse_args()
+    run(
+        output_dir=args.output_dir,
+        transitive_reduction=args.transitive_reduction,
+        plan=args.plan,
+        output_format=args.output_format,
+        max_group_size=args.max_group_size if args.collapse else None,
+        run_results_paths=args.run_results,
+        jobs_database_url=args.jobs_database_url
+    )
@@ -0,0 +1,145 @@
+"""Loading of the manifest.json fields used by the DAG generation.
+
+Only the graph members (nodes, sources, exposures, metrics) are kept, with the fields
+read by the selectors and the generator. With ijson installed, the manifest is parsed
+one node at a time instead of being loaded whole.
+
+The compact manifest is saved as a pickle snapshot named after the sha256 of the
+manifest.json content, so later runs with the same manifest (as in a CI cache) load it
+without parsing the manifest.
+"""
+import gc
+import hashlib
+import json
+import pickle
+import sys
+from os import getpid, makedirs, path, replace
+from typing import Any, Dict, Optional
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+MANIFEST_SECTIONS = ("nodes", "sources", "exposures", "metrics")
+
+NODE_FIELDS = (
+    "unique_id",
+    "resource_type",
+    "package_name",
+    "name",
+    "source_name",
+    "fqn",
+    "tags",
+    "attached_node",
+)
+
+STREAMED_FIELDS = set(NODE_FIELDS) | {"config", "depends_on"}
+
+# format of the snapshots, to be changed with the compact manifest content
+SNAPSHOT_VERSION = 1
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _intern(value):
+    # the names repeated across nodes (package, resource type, parents) are shared,
+    # which halves the snapshot size
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return [_intern(item) for item in value]
+    return value
+
+
+def compact_node(node: Dict[str, Any]) -> Dict[str, Any]:
+    compacted = {field: _intern(node[field]) for field in NODE_FIELDS if field in node}
+    compacted["config"] = {"enabled": node.get("config", {}).get("enabled", True)}
+    compacted["depends_on"] = {"nodes": _intern(node.get("depends_on", {}).get("nodes", []))}
+    return compacted
+
+
+def get_manifest_hash(manifest_path: str) -> str:
+    manifest_hash = hashlib.sha256()
+    with open(manifest_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            manifest_hash.update(chunk)
+    return manifest_hash.hexdigest()
+
+
+def _stream_manifest(manifest_file) -> Dict[str, Dict[str, Any]]:
+    """
+    One pass over the parsing events of the manifest, only the fields of NODE_FIELDS,
+    config and depends_on of the graph members are built
+    """
+    compact_manifest = {section: {} for section in MANIFEST_SECTIONS}
+    node = None
+    builder = None
+    depth = 0
+    for prefix, event, value in ijson.parse(manifest_file, use_float=True):
+        if node is None:
+            # key of a graph member
+            if event == "map_key" and prefix in compact_manifest:
+                section, unique_id, node = prefix, value, {}
+            continue
+
+        if event == "start_map" or event == "start_array":
+            depth += 1
+        elif event == "end_map" or event == "end_array":
+            depth -= 1
+            if depth == 0:
+                compact_manifest[section][unique_id] = compact_node(node)
+                node = None
+                continue
+
+        if depth == 1 and event == "map_key":
+            field = value
+            builder = ijson.ObjectBuilder() if field in STREAMED_FIELDS else None
+        elif builder is not None:
+            builder.event(event, value)
+            if depth == 1:
+                node[field] = builder.value
+                builder = None
+    return compact_manifest
+
+
+def _read_manifest(manifest_path: str) -> Dict[str, Dict[str, Any]]:
+    if ijson is None:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return {
+            section: {unique_id: compact_node(node) for unique_id, node in manifest.get(section, {}).items()}
+            for section in MANIFEST_SECTIONS
+        }
+
+    with open(manifest_path, "rb") as f:
+        return _stream_manifest(f)
+
+
+def get_snapshot_path(cache_dir: str, manifest_hash: str) -> str:
+    return path.join(cache_dir, f"manifest-v{SNAPSHOT_VERSION}-{manifest_hash}.pickle")
+
+
+def load_manifest(manifest_path: str, cache_dir: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """The compact manifest, from its snapshot in cache_dir when there is one"""
+    if cache_dir is None:
+        return _read_manifest(manifest_path)
+
+    snapshot_path = get_snapshot_path(cache_dir, get_manifest_hash(manifest_path))
+    if path.exists(snapshot_path):
+        # the collector would scan the many nodes dicts while they are loaded
+        gc.disable()
+        try:
+            with open(snapshot_path, "rb") as f:
+                return pickle.load(f)
+        finally:
+            gc.enable()
+
+    compact_manifest = _read_manifest(manifest_path)
+    makedirs(cache_dir, exist_ok=True)
+    # written aside then renamed, a concurrent run never reads a partial snapshot
+    temporary_path = f"{snapshot_path}.{getpid()}.tmp"
+    with open(temporary_path, "wb") as f:
+        pickle.dump(compact_manifest, f, protocol=pickle.HIGHEST_PROTOCOL)
+    replace(temporary_path, snapshot_path)
+    return compact_manifest
@@ -0,0 +1 @@
+{{ config(tags=['marts']) }} select * from {{ ref('customers') }}
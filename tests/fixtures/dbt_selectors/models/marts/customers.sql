@@ -0,0 +1 @@
+{{ config(tags=['stats', 'marts']) }} select * from {{ ref('stg_customers') }} join {{ ref('int_order_payments') }} using (customer_id)
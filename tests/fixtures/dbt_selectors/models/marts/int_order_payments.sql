@@ -0,0 +1 @@
+{{ config(tags=['finance']) }} select * from {{ ref('stg_orders') }} join {{ ref('stg_payments') }} using (order_id)
@@ -0,0 +1 @@
+{{ config(tags=['stats'], enabled=false) }} select * from {{ ref('stg_orders') }}
@@ -0,0 +1 @@
+{{ config(tags=['stats']) }} select * from {{ ref('stg_orders') }}
@@ -0,0 +1 @@
+{{ config(tags=['statistics']) }} select * from {{ source('raw', 'refunds') }}
@@ -0,0 +1 @@
+{{ config(tags=['reporting']) }} select * from {{ ref('customers') }} join {{ ref('orders_daily') }} using (day)
@@ -0,0 +1 @@
+select c.* from {{ source('raw', 'customers') }} c join {{ ref('country_codes') }} using (country)
@@ -0,0 +1 @@
+select * from {{ source('raw', 'orders') }}
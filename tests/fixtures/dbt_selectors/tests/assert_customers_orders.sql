@@ -0,0 +1 @@
+select * from {{ ref('customers') }} join {{ ref('orders_daily') }} using (day) where false
@@ -0,0 +1,39 @@
+"""The expected resources of the fixture project were listed with dbt ls --selector"""
+import json
+from pathlib import Path
+
+import pytest
+import yaml
+
+from dbt_selectors import ManifestSelector, SelectorError
+
+FIXTURE_PROJECT = Path(__file__).resolve().parent / "fixtures" / "dbt_selectors"
+
+EXPECTED_LS = json.loads((FIXTURE_PROJECT / "expected_ls.json").read_text())
+
+
+def _load_manifest():
+    return json.loads((FIXTURE_PROJECT / "manifest.json").read_text())
+
+
+@pytest.fixture(scope="module")
+def manifest_selector() -> ManifestSelector:
+    selectors = yaml.safe_load((FIXTURE_PROJECT / "selectors.yml").read_text())["selectors"]
+    return ManifestSelector(manifest=_load_manifest(), selectors=selectors)
+
+
+@pytest.mark.parametrize("selector_name", sorted(EXPECTED_LS))
+def test_selector_lists_same_resources_as_dbt_ls(manifest_selector, selector_name):
+    assert manifest_selector.list(selector_name) == EXPECTED_LS[selector_name]
+
+
+def test_disabled_models_are_not_selected(manifest_selector):
+    assert "model.corpus.old_stats" not in manifest_selector.select("stats")
+
+
+def test_unsupported_method_raises():
+    manifest_selector = ManifestSelector(
+        manifest=_load_manifest(), selectors=[{"name": "by_path", "definition": {"method": "path", "value": "models/marts"}}]
+    )
+    with pytest.raises(SelectorError):
+        manifest_selector.select("by_path")
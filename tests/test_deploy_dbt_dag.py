@@ -0,0 +1,118 @@
+from pathlib import Path
+
+import pytest
+
+from datetime import datetime, timezone
+
+from dag_storage import LocalStorage
+from deploy_dbt_dag import DagsNotReadyError, deploy_dags, get_dag_id, get_dag_ready_check, wait_for_dags
+
+
+@pytest.fixture()
+def dags_dir(tmp_path) -> Path:
+    dags_dir = tmp_path / "dbt_dags"
+    dags_dir.mkdir()
+    (dags_dir / "dbt_dag_stats.py").write_text("stats dag")
+    (dags_dir / "dbt_dag_finance.py").write_text("finance dag")
+    return dags_dir
+
+
+@pytest.fixture()
+def storage(tmp_path) -> LocalStorage:
+    bucket_dir = tmp_path / "bucket"
+    (bucket_dir / "dags").mkdir(parents=True)
+    # the former single DAG file, and a DAG not generated from the selectors
+    (bucket_dir / "dags" / "dbt_dag.py").write_text("all dags")
+    (bucket_dir / "dags" / "other_dag.py").write_text("other dag")
+    return LocalStorage(str(bucket_dir))
+
+
+def test_only_changed_files_are_uploaded(dags_dir, storage):
+    actions = deploy_dags(storage, str(dags_dir))
+    assert actions == {
+        "uploaded": ["dags/dbt_operators.py", "dags/dbt_loader.py", "dags/dbt_dag_finance.py", "dags/dbt_dag_stats.py"],
+        "unchanged": [],
+        "deleted": ["dags/dbt_dag.py"],
+    }
+    assert Path(storage.root_dir, "dags", "dbt_dag_stats.py").read_text() == "stats dag"
+
+    (dags_dir / "dbt_dag_stats.py").write_text("new stats dag")
+    (dags_dir / "dbt_dag_finance.py").unlink()
+    actions = deploy_dags(storage, str(dags_dir))
+    assert actions == {
+        "uploaded": ["dags/dbt_dag_stats.py"],
+        "unchanged": ["dags/dbt_operators.py", "dags/dbt_loader.py"],
+        "deleted": ["dags/dbt_dag_finance.py"],
+    }
+    assert sorted(storage.list_md5("dags/")) == ["dags/dbt_dag_stats.py", "dags/dbt_loader.py", "dags/dbt_operators.py", "dags/other_dag.py"]
+    assert Path(storage.root_dir, "dags", "dbt_dag_stats.py").read_text() == "new stats dag"
+
+
+def test_concurrent_uploads(dags_dir, storage):
+    for i in range(50):
+        (dags_dir / f"dbt_dag_selector_{i}.py").write_text(f"dag {i}")
+    actions = deploy_dags(storage, str(dags_dir), workers=8)
+    assert len(actions["uploaded"]) == 54
+    for i in range(50):
+        assert Path(storage.root_dir, "dags", f"dbt_dag_selector_{i}.py").read_text() == f"dag {i}"
+
+    assert deploy_dags(storage, str(dags_dir), workers=8)["uploaded"] == []
+
+
+class _RecordingStorage(LocalStorage):
+    def __init__(self, root_dir: str):
+        super().__init__(root_dir)
+        self.calls = []
+
+    def upload(self, file_path: str, name: str):
+        super().upload(file_path, name)
+        self.calls.append(("upload", name))
+
+    def delete(self, name: str):
+        super().delete(name)
+        self.calls.append(("delete", name))
+
+
+def test_files_are_uploaded_before_the_dags_reading_them(dags_dir, storage):
+    for selector_name in ("stats", "finance"):
+        (dags_dir / f"dbt_dag_{selector_name}.json").write_text(f"{selector_name} graph")
+    storage = _RecordingStorage(storage.root_dir)
+    deploy_dags(storage, str(dags_dir), workers=8)
+
+    stages = [
+        {"dags/dbt_operators.py", "dags/dbt_loader.py"},
+        {"dags/dbt_dag_finance.json", "dags/dbt_dag_stats.json"},
+        {"dags/dbt_dag_finance.py", "dags/dbt_dag_stats.py"},
+    ]
+    uploads = [name for action, name in storage.calls if action == "upload"]
+    assert [set(uploads[:2]), set(uploads[2:4]), set(uploads[4:])] == stages
+
+    # a removed DAG file is deleted before its graph
+    (dags_dir / "dbt_dag_finance.py").unlink()
+    (dags_dir / "dbt_dag_finance.json").unlink()
+    storage.calls = []
+    deploy_dags(storage, str(dags_dir), workers=8)
+    assert storage.calls == [("delete", "dags/dbt_dag_finance.py"), ("delete", "dags/dbt_dag_finance.json")]
+
+
+def test_wait_for_uploaded_dags(monkeypatch, dags_dir, storage):
+    monkeypatch.delenv("AIRFLOW_URL", raising=False)
+    actions = deploy_dags(storage, str(dags_dir))
+    dag_ids = [dag_id for dag_id in map(get_dag_id, actions["uploaded"]) if dag_id]
+    assert dag_ids == ["dbt_finance", "dbt_stats"]
+
+    is_dag_ready = get_dag_ready_check(storage, datetime.now(timezone.utc))
+    wait_for_dags(is_dag_ready, dag_ids, timeout=1, poll_interval=0.01)
+    with pytest.raises(DagsNotReadyError, match="unknown"):
+        wait_for_dags(is_dag_ready, ["dbt_stats", "dbt_unknown"], timeout=0.05, poll_interval=0.01)
+
+
+def test_wait_polls_until_ready():
+    polls = []
+
+    def is_dag_ready(dag_id):
+        polls.append(dag_id)
+        return len(polls) > 3
+
+    wait_for_dags(is_dag_ready, ["dbt_stats"], timeout=1, poll_interval=0.01)
+    assert polls == ["dbt_stats"] * 4
@@ -0,0 +1,384 @@
+import json
+import random
+import shutil
+from pathlib import Path
+
+import pytest
+import yaml
+
+from dag_priorities import load_run_results_durations, suggest_pools_slots
+from dbt_graph import GraphCycleError, ModelsGraph
+from dbt_selectors import ManifestSelector
+import generate_dbt_dag
+from generate_dbt_dag import Node, build_dag_for_selector, build_tests_index, parse_model_selector, run
+
+FIXTURE_PROJECT = Path(__file__).resolve().parent / "fixtures" / "dbt_selectors"
+
+
+def _load_manifest():
+    return json.loads((FIXTURE_PROJECT / "manifest.json").read_text())
+
+
+@pytest.fixture(scope="module")
+def manifest_selector() -> ManifestSelector:
+    selectors = yaml.safe_load((FIXTURE_PROJECT / "selectors.yml").read_text())["selectors"]
+    return ManifestSelector(manifest=_load_manifest(), selectors=selectors)
+
+
+def test_parse_model_selector(manifest_selector):
+    models_names, sources_ids, tests_ids = parse_model_selector("finance_children_depth", manifest_selector=manifest_selector)
+    assert models_names == ["model.corpus.customers", "model.corpus.int_order_payments", "model.corpus.stg_payments"]
+    assert sources_ids == ["source.corpus.raw.payments"]
+    assert tests_ids == {"test.corpus.assert_customers_orders", "test.corpus.unique_customers_customer_id.c5af1ff4b1"}
+
+
+def test_tests_are_attached_to_their_node():
+    tests_index = build_tests_index(_load_manifest())
+
+    # the relationships test of stg_orders refers to stg_customers but is not attached to it
+    assert tests_index["model.corpus.stg_customers"] == {
+        "test.corpus.not_null_stg_customers_id.6bd2c50f02",
+        "test.corpus.unique_stg_customers_id.a6a76acf47",
+    }
+    assert tests_index["source.corpus.raw.orders"] == {"test.corpus.source_unique_raw_orders_id.56401af608"}
+    # singular tests are attached to all the nodes they depend on
+    assert "test.corpus.assert_customers_orders" in tests_index["model.corpus.orders_daily"]
+    assert "model.corpus.int_order_payments" not in tests_index
+
+
+def test_build_dag_for_selector(manifest_selector):
+    manifest = _load_manifest()
+    graph = build_dag_for_selector(
+        selector_name="stats",
+        selector_schedule=None,
+        models_graph=ModelsGraph.from_manifest(manifest),
+        manifest_selector=manifest_selector,
+        tests_index=build_tests_index(manifest)
+    )
+    graph.build()
+
+    nodes_tests = {node.model_name: node.has_tests for node in graph.models_nodes}
+    assert nodes_tests == {
+        "customers": True,
+        "int_order_payments": False,
+        "orders_daily": True,
+        "stg_customers": True,
+        "stg_orders": True,
+        "stg_payments": False,
+    }
+    assert sorted(node.node_name for node in graph.sources_nodes) == ["source:raw.customers", "source:raw.orders"]
+    stg_orders = next(node for node in graph.models_nodes if node.model_name == "stg_orders")
+    # the runs are skipped when unchanged only for the selectors opting in
+    assert "skip_unchanged" not in stg_orders.get_run_task_expression()
+    assert stg_orders.get_run_task_expression(skip_unchanged=True).endswith('weight_rule="absolute", skip_unchanged=True)')
+    assert "skip_unchanged" not in stg_orders.get_test_task_expression()
+    assert sorted(graph.tasks_dependencies_expressions) == [
+        "model_corpus_int_order_payments >> model_corpus_customers",
+        "model_corpus_stg_customers >> model_corpus_customers",
+        "model_corpus_stg_orders >> model_corpus_int_order_payments",
+        "model_corpus_stg_orders >> model_corpus_orders_daily",
+        "model_corpus_stg_payments >> model_corpus_int_order_payments",
+        "sources_tests >> model_corpus_stg_customers",
+        "sources_tests >> model_corpus_stg_orders",
+        "sources_tests >> model_corpus_stg_payments",
+    ]
+
+
+def test_dag_spec_matches_the_rendered_dependencies(manifest_selector):
+    manifest = _load_manifest()
+    graph = build_dag_for_selector(
+        selector_name="stats",
+        selector_schedule="0 1 * * *",
+        models_graph=ModelsGraph.from_manifest(manifest),
+        manifest_selector=manifest_selector,
+        tests_index=build_tests_index(manifest)
+    )
+    graph.build()
+    spec = graph.to_spec()
+
+    assert (spec["dag_id"], spec["schedule"]) == ("dbt_stats", "0 1 * * *")
+    assert ["model_corpus_int_order_payments", "run_corpus_int_order_payments", None, "int_order_payments", "run", 2] in spec["models"]
+    assert sorted(spec["sources_tests"]) == [
+        ["raw_customers", "source:raw.customers"],
+        ["raw_orders", "source:raw.orders"],
+    ]
+
+    groups = [group_id for group_id, _, _, _, _, _ in spec["models"]]
+    # parents come first in the models list
+    assert all(parent < child for parent, child in spec["dependencies"])
+    dependencies = [f"{groups[parent]} >> {groups[child]}" for parent, child in spec["dependencies"]]
+    dependencies += [f"sources_tests >> {groups[root]}" for root in spec["roots"]]
+    assert sorted(dependencies) == sorted(graph.tasks_dependencies_expressions)
+
+
+def test_collapsed_models_run_with_dbt_build(manifest_selector):
+    manifest = _load_manifest()
+    graph = build_dag_for_selector(
+        selector_name="finance_children_depth",
+        selector_schedule=None,
+        models_graph=ModelsGraph.from_manifest(manifest),
+        manifest_selector=manifest_selector,
+        tests_index=build_tests_index(manifest),
+        max_group_size=10
+    )
+    graph.build()
+
+    # stg_payments -> int_order_payments -> customers is a chain
+    assert [node.model_name for node in graph.models_nodes] == ["stg_payments int_order_payments customers"]
+    assert graph.tasks_list_expressions == [(
+        'build_corpus_stg_payments_3 = ExecuteDBTJob(task_id="build_corpus_stg_payments_3", test_or_run="build", '
+        'model_name="stg_payments int_order_payments customers", trigger_rule="none_failed", pool="dbt_run", '
+        'priority_weight=3, weight_rule="absolute")'
+    )]
+    assert graph.tasks_dependencies_expressions == []
+    assert graph.to_spec()["models"] == [[
+        "build_corpus_stg_payments_3", "build_corpus_stg_payments_3", None, "stg_payments int_order_payments customers", "build", 3
+    ]]
+
+
+def test_priorities_follow_the_critical_path(manifest_selector, tmp_path):
+    manifest = _load_manifest()
+    tests_index = build_tests_index(manifest)
+    run_results = {"results": [
+        {"unique_id": "model.corpus.stg_customers", "execution_time": 50.0},
+        {"unique_id": "model.corpus.stg_orders", "execution_time": 2.0},
+        {"unique_id": "model.corpus.int_order_payments", "execution_time": 3.0},
+        {"unique_id": "model.corpus.customers", "execution_time": 4.0},
+        {"unique_id": "test.corpus.not_null_stg_customers_id.6bd2c50f02", "execution_time": 1.5},
+        {"unique_id": "test.corpus.unique_stg_customers_id.a6a76acf47", "execution_time": 0.5},
+    ]}
+    (tmp_path / "run_results.json").write_text(json.dumps(run_results))
+    durations = load_run_results_durations([str(tmp_path / "run_results.json")], tests_index)
+    assert durations.test["stg_customers"] == 2.0
+
+    graph = build_dag_for_selector(
+        selector_name="stats",
+        selector_schedule=None,
+        models_graph=ModelsGraph.from_manifest(manifest),
+        manifest_selector=manifest_selector,
+        tests_index=tests_index,
+        durations=durations
+    )
+    priorities = {node.model_name: graph.priorities[node_id] for node_id, node in enumerate(graph.models_nodes)}
+    # the models without history take the median durations: 3.5s to run, 2s to test
+    assert priorities == {
+        "customers": 6,
+        "int_order_payments": 9,
+        "orders_daily": 6,
+        "stg_customers": 58,
+        "stg_orders": 13,
+        "stg_payments": 13,
+    }
+    assert graph.sources_tests_priority == 59
+
+    # without durations, the priority is the depth
+    graph = build_dag_for_selector(
+        selector_name="stats",
+        selector_schedule=None,
+        models_graph=ModelsGraph.from_manifest(manifest),
+        manifest_selector=manifest_selector,
+        tests_index=tests_index
+    )
+    assert sorted(graph.priorities) == [1, 1, 2, 2, 3, 3]
+
+
+def test_pools_slots_suggestion():
+    # two chains of 3 models of 10s, and 8 models of 1s
+    graph = _make_graph(14, [(0, 1), (1, 2), (3, 4), (4, 5)])
+    run_weights = [10.0] * 6 + [1.0] * 8
+    critical_path, pools_slots = suggest_pools_slots(graph, run_weights, [0.0] * 14)
+
+    assert critical_path == 30
+    # 68s of runs over 30s, with up to 10 running models
+    assert pools_slots == {"dbt_run": (3, 10), "dbt_test": (1, 0)}
+
+
+def _make_graph(nodes_number, edges):
+    graph = ModelsGraph([f"model.m{i:03d}" for i in range(nodes_number)])
+    for parent_id, child_id in edges:
+        graph.add_edge(parent_id, child_id)
+    return graph
+
+
+def test_group_nodes_collapses_chains_and_siblings():
+    # a -> b -> c -> d, d -> e -> g, d -> f -> g
+    graph = _make_graph(7, [(0, 1), (1, 2), (2, 3), (3, 4), (3, 5), (4, 6), (5, 6)])
+    assert graph.group_nodes(max_group_size=10) == [[0, 1, 2, 3], [4, 5], [6]]
+    assert graph.group_nodes(max_group_size=3) == [[0, 1, 2], [3], [4, 5], [6]]
+    assert graph.group_nodes(max_group_size=1) == [[0], [1], [2], [3], [4], [5], [6]]
+
+
+def test_groups_graph_is_acyclic():
+    generator = random.Random(1)
+    graph = _make_graph(300, [
+        (parent_id, child_id)
+        for child_id in range(1, 300)
+        for parent_id in generator.sample(range(max(0, child_id - 10), child_id), generator.randint(0, min(child_id, 2)))
+    ])
+    groups = graph.group_nodes(max_group_size=5)
+
+    assert sorted(node_id for group in groups for node_id in group) == list(range(300))
+    assert max(len(group) for group in groups) <= 5
+    assert len(groups) < 300
+    groups_graph = graph.contract(groups, [f"group.{i:03d}" for i in range(len(groups))])
+    # raises on a cycle between groups
+    groups_graph.topological_order()
+
+
+def test_models_graph_topological_order():
+    graph = ModelsGraph.from_manifest(_load_manifest())
+    order = [graph.names[node_id] for node_id in graph.topological_order()]
+
+    assert sorted(order) == graph.names
+    for parent_id, child_id in graph.edges():
+        assert order.index(graph.names[parent_id]) < order.index(graph.names[child_id])
+
+
+def test_models_subgraph_keeps_dependencies_between_its_nodes():
+    graph = ModelsGraph.from_manifest(_load_manifest())
+    subgraph = graph.subgraph(["model.corpus.customers", "model.corpus.customer_ltv", "model.corpus.stg_orders"])
+
+    assert subgraph.names == ["model.corpus.customer_ltv", "model.corpus.customers", "model.corpus.stg_orders"]
+    assert list(subgraph.edges()) == [(1, 0)]
+    assert subgraph.roots() == [1, 2]
+
+
+def test_models_graph_cycle_is_detected():
+    graph = ModelsGraph(["model.a", "model.b", "model.c", "model.d"])
+    graph.add_edge(0, 1)
+    graph.add_edge(1, 2)
+    graph.add_edge(2, 1)
+    graph.add_edge(0, 3)
+
+    with pytest.raises(GraphCycleError, match="model.b"):
+        graph.topological_order()
+
+
+def test_hashable_nodes():
+    assert {Node("model.corpus.customers"), Node("model.corpus.customers")} == {Node("model.corpus.customers")}
+
+
+def _reachability(graph: ModelsGraph):
+    reachable = {}
+    for node_id in reversed(graph.topological_order()):
+        reachable[node_id] = set(graph.children[node_id])
+        for child_id in graph.children[node_id]:
+            reachable[node_id] |= reachable[child_id]
+    return reachable
+
+
+def test_transitive_reduction_removes_implied_edges():
+    graph = ModelsGraph(["model.a", "model.b", "model.c", "model.d"])
+    for parent_id, child_id in [(0, 1), (1, 2), (0, 2), (0, 3), (3, 2), (1, 3)]:
+        graph.add_edge(parent_id, child_id)
+
+    assert graph.transitive_reduction() == 3
+    assert sorted(graph.edges()) == [(0, 1), (1, 3), (3, 2)]
+
+
+def test_transitive_reduction_keeps_reachability():
+    generator = random.Random(0)
+    graph = ModelsGraph([f"model.m{i:03d}" for i in range(200)])
+    for child_id in range(1, 200):
+        for parent_id in generator.sample(range(child_id), min(child_id, 4)):
+            graph.add_edge(parent_id, child_id)
+    reachability = _reachability(graph)
+    edges_count = graph.edges_count()
+
+    removed_edges = graph.transitive_reduction()
+
+    assert removed_edges > 0
+    assert graph.edges_count() == edges_count - removed_edges
+    assert _reachability(graph) == reachability
+    # no remaining edge is implied by another path
+    for parent_id, child_id in graph.edges():
+        assert not any(child_id in reachability[other_id] for other_id in graph.children[parent_id] if other_id != child_id)
+
+
+@pytest.fixture()
+def generation_dir(monkeypatch, tmp_path) -> Path:
+    """Manifest in the working directory, selectors in DBT_PROFILES_DIR"""
+    shutil.copy(FIXTURE_PROJECT / "manifest.json", tmp_path / "manifest.json")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DBT_PROFILES_DIR", str(tmp_path))
+    monkeypatch.delenv("DBT_DAG_CACHE_DIR", raising=False)
+    return tmp_path
+
+
+def _write_selectors(generation_dir: Path, schedules, skip_unchanged=()):
+    selectors = [
+        {"name": name, "definition": {"method": "tag", "value": tag, "parents": True, "schedule": schedule}}
+        for name, (tag, schedule) in schedules.items()
+    ]
+    for selector in selectors:
+        if selector["name"] in skip_unchanged:
+            selector["definition"]["skip_unchanged"] = True
+    (generation_dir / "selectors.yml").write_text(yaml.safe_dump({"selectors": selectors}))
+
+
+def test_only_changed_dags_are_written(generation_dir):
+    _write_selectors(generation_dir, {"stats": ("stats", "0 1 * * *"), "finance": ("finance", None)})
+    assert run() == {"new": ["stats", "finance"], "changed": [], "unchanged": [], "removed": []}
+    stats_dag = (generation_dir / "dbt_dags" / "dbt_dag_stats.py").read_text()
+    assert stats_dag.startswith("# fingerprint: ")
+    assert 'schedule_interval="0 1 * * *"' in stats_dag
+
+    assert run() == {"new": [], "changed": [], "unchanged": ["stats", "finance"], "removed": []}
+
+    _write_selectors(generation_dir, {"stats": ("stats", "0 2 * * *"), "marts": ("marts", None)})
+    changes = run(plan=True)
+    assert changes == {"new": ["marts"], "changed": ["stats"], "unchanged": [], "removed": ["finance"]}
+    # the plan writes nothing
+    assert (generation_dir / "dbt_dags" / "dbt_dag_stats.py").read_text() == stats_dag
+    assert sorted(path.name for path in (generation_dir / "dbt_dags").iterdir()) == ["dbt_dag_finance.py", "dbt_dag_stats.py"]
+
+    assert run() == changes
+    assert 'schedule_interval="0 2 * * *"' in (generation_dir / "dbt_dags" / "dbt_dag_stats.py").read_text()
+    assert sorted(path.name for path in (generation_dir / "dbt_dags").iterdir()) == ["dbt_dag_marts.py", "dbt_dag_stats.py"]
+
+
+def test_dags_are_written_again_when_the_generator_changes(generation_dir, monkeypatch):
+    _write_selectors(generation_dir, {"stats": ("stats", "0 1 * * *")})
+    run()
+    assert run()["unchanged"] == ["stats"]
+
+    # the rendering code changed, the graph did not
+    generator_source = generate_dbt_dag.get_generator_source()
+    monkeypatch.setattr(generate_dbt_dag, "get_generator_source", lambda: generator_source + "# changed\n")
+    assert run()["changed"] == ["stats"]
+    assert run()["unchanged"] == ["stats"]
+    # as the options of the generation
+    assert run(max_group_size=5)["changed"] == ["stats"]
+
+
+def test_skip_unchanged_is_set_by_selector(generation_dir):
+    _write_selectors(generation_dir, {"stats": ("stats", None), "finance": ("finance", None)}, skip_unchanged={"stats"})
+    run()
+    dags_dir = generation_dir / "dbt_dags"
+    assert "skip_unchanged=True" in (dags_dir / "dbt_dag_stats.py").read_text()
+    assert "skip_unchanged" not in (dags_dir / "dbt_dag_finance.py").read_text()
+    run(output_format="json")
+    assert json.loads((dags_dir / "dbt_dag_stats.json").read_text())["skip_unchanged"] is True
+
+    # opting out writes the DAG again
+    _write_selectors(generation_dir, {"stats": ("stats", None), "finance": ("finance", None)})
+    assert run(output_format="json")["changed"] == ["stats"]
+
+
+def test_json_output_format(generation_dir):
+    _write_selectors(generation_dir, {"stats": ("stats", "0 1 * * *"), "finance": ("finance", None)})
+    run(output_format="json")
+    dags_dir = generation_dir / "dbt_dags"
+    assert sorted(path.name for path in dags_dir.iterdir()) == [
+        "dbt_dag_finance.json", "dbt_dag_finance.py", "dbt_dag_stats.json", "dbt_dag_stats.py"
+    ]
+    # the same loader file for all the selectors
+    assert (dags_dir / "dbt_dag_stats.py").read_text() == (dags_dir / "dbt_dag_finance.py").read_text()
+    spec = json.loads((dags_dir / "dbt_dag_stats.json").read_text())
+    assert (spec["version"], spec["dag_id"], spec["schedule"], spec["skip_unchanged"]) == (4, "dbt_stats", "0 1 * * *", False)
+
+    assert run(output_format="json")["unchanged"] == ["stats", "finance"]
+
+    # back to the python format, the JSON graphs are deleted
+    assert run()["changed"] == ["stats", "finance"]
+    assert sorted(path.name for path in dags_dir.iterdir()) == ["dbt_dag_finance.py", "dbt_dag_stats.py"]
@@ -0,0 +1,437 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import asyncpg
+import psycopg2
+import pytest
+
+from lib.job_queue import JobWorker, RUN_POOL, TEST_POOL, get_job_timeout
+from lib.jobs import (
+    JobSubmission,
+    _start_job,
+    admit_job,
+    admit_jobs,
+    cancel_job,
+    claim_job,
+    get_jobs_days,
+    get_nodes_results,
+    maintain_jobs_partitions,
+    read_job_status,
+    requeue_stale_jobs,
+)
+
+
+@pytest.fixture()
+def empty_jobs_table(event_loop, async_db_connection):
+    from setup_db import run_setup_db
+    run_setup_db()
+    event_loop.run_until_complete(async_db_connection.execute("DELETE FROM dbt_jobs"))
+
+
+def _get_job(event_loop, connection, job_id):
+    return event_loop.run_until_complete(connection.fetchrow("SELECT * FROM dbt_jobs WHERE job_id = $1", job_id))
+
+
+def test_concurrent_claims_take_different_jobs(event_loop, async_db_connection, empty_jobs_table):
+
+    jobs_ids = {
+        event_loop.run_until_complete(_start_job(async_db_connection, model_name=f"model_{i}", run_or_test="run"))
+        for i in range(5)
+    }
+
+    async def claim_concurrently():
+        connections = [
+            await asyncpg.connect(database="postgres", user="postgres", password="postgres", host="localhost")
+            for _ in range(8)
+        ]
+        claimed_jobs = await asyncio.gather(*[
+            claim_job(connection, actions=["run"], worker_id=f"worker-{i}") for i, connection in enumerate(connections)
+        ])
+        for connection in connections:
+            await connection.close()
+        return claimed_jobs
+
+    claimed_jobs = [job for job in event_loop.run_until_complete(claim_concurrently()) if job is not None]
+    assert sorted(job["job_id"] for job in claimed_jobs) == sorted(jobs_ids)
+
+
+def test_claim_only_takes_jobs_of_the_pool(event_loop, async_db_connection, empty_jobs_table):
+
+    event_loop.run_until_complete(_start_job(async_db_connection, model_name="some-model", run_or_test="test"))
+    assert event_loop.run_until_complete(claim_job(async_db_connection, actions=["run"], worker_id="w")) is None
+
+    job = event_loop.run_until_complete(claim_job(async_db_connection, actions=["test"], worker_id="w"))
+    assert job["model_name"] == "some-model"
+    assert job["test_or_run"] == "test"
+
+
+def test_stale_jobs_are_requeued(event_loop, async_db_connection, empty_jobs_table):
+
+    job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="some-model", run_or_test="run"))
+    event_loop.run_until_complete(claim_job(async_db_connection, actions=["run"], worker_id="dead-worker"))
+    event_loop.run_until_complete(async_db_connection.execute(
+        "UPDATE dbt_jobs SET heartbeat_at = $1 WHERE job_id = $2", datetime.utcnow() - timedelta(minutes=10), job_id
+    ))
+
+    requeued_jobs = event_loop.run_until_complete(
+        requeue_stale_jobs(async_db_connection, stale_after=timedelta(minutes=2), max_attempts=3)
+    )
+    assert requeued_jobs == [job_id]
+    job = _get_job(event_loop, async_db_connection, job_id)
+    assert job["status"] == "queued"
+    assert job["worker_id"] is None
+
+
+def test_stale_jobs_fail_after_max_attempts(event_loop, async_db_connection, empty_jobs_table):
+
+    job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="some-model", run_or_test="run"))
+    event_loop.run_until_complete(claim_job(async_db_connection, actions=["run"], worker_id="dead-worker"))
+    event_loop.run_until_complete(async_db_connection.execute(
+        "UPDATE dbt_jobs SET heartbeat_at = $1 WHERE job_id = $2", datetime.utcnow() - timedelta(minutes=10), job_id
+    ))
+
+    event_loop.run_until_complete(requeue_stale_jobs(async_db_connection, stale_after=timedelta(minutes=2), max_attempts=1))
+    job = _get_job(event_loop, async_db_connection, job_id)
+    assert job["status"] == "failed"
+    assert job["ended_at"] is not None
+
+
+@pytest.mark.parametrize("dbt_success, expected_status", [(True, "success"), (False, "failed")])
+def test_worker_runs_queued_job(event_loop, async_db_connection, empty_jobs_table, dbt_success, expected_status):
+
+    commands = []
+
+    def execute(arguments_list):
+        commands.append(arguments_list)
+        return dbt_success
+
+    job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="some-model", run_or_test="test"))
+    run_worker = JobWorker(pool_name=RUN_POOL, worker_id="run-worker", execute=execute)
+    test_worker = JobWorker(pool_name=TEST_POOL, worker_id="test-worker", execute=execute)
+
+    assert event_loop.run_until_complete(run_worker.process_next_job(async_db_connection)) is False
+    assert event_loop.run_until_complete(test_worker.process_next_job(async_db_connection)) is True
+
+    assert [command[:3] for command in commands] == [["test", "--select", "some-model"]]
+    job = _get_job(event_loop, async_db_connection, job_id)
+    assert job["status"] == expected_status
+    assert job["worker_id"] == "test-worker"
+    assert job["attempts"] == 1
+
+
+def test_concurrent_submissions_run_dbt_once(event_loop, async_db_connection, empty_jobs_table):
+
+    commands = []
+
+    def execute(arguments_list):
+        commands.append(arguments_list)
+        return True
+
+    async def admit(pool):
+        async with pool.acquire() as connection:
+            return await admit_job(connection, model_name="shared-model", run_or_test="run")
+
+    async def submit_concurrently():
+        pool = await asyncpg.create_pool(
+            database="postgres", user="postgres", password="postgres", host="localhost", min_size=20, max_size=20
+        )
+        admitted_jobs = await asyncio.gather(*[admit(pool) for _ in range(300)])
+        await pool.close()
+        return admitted_jobs
+
+    admitted_jobs = event_loop.run_until_complete(submit_concurrently())
+    assert len({job.job_id for job in admitted_jobs}) == 1
+    assert sum(job.created for job in admitted_jobs) == 1
+    assert event_loop.run_until_complete(async_db_connection.fetchval("SELECT COUNT(*) FROM dbt_jobs")) == 1
+
+    worker = JobWorker(pool_name=RUN_POOL, worker_id="run-worker", execute=execute)
+    while event_loop.run_until_complete(worker.process_next_job(async_db_connection)):
+        pass
+    assert [command[:3] for command in commands] == [["run", "--select", "shared-model"]]
+
+    # the successful job is reused by later submissions
+    job = event_loop.run_until_complete(admit_job(async_db_connection, model_name="shared-model", run_or_test="run"))
+    assert job.job_id == admitted_jobs[0].job_id
+    assert job.status == "success"
+    assert job.created is False
+
+
+def test_build_job_records_nodes_results(event_loop, async_db_connection, empty_jobs_table):
+
+    commands = []
+
+    def execute(arguments_list):
+        commands.append(arguments_list)
+        target_path = arguments_list[arguments_list.index("--target-path") + 1]
+        results = [
+            {"unique_id": "model.corpus.stg_payments", "status": "success"},
+            {"unique_id": "test.corpus.not_null_stg_payments_id.5f6ba2e6fa", "status": "fail"},
+            {"unique_id": "model.corpus.int_order_payments", "status": "skipped"},
+        ]
+        with open(os.path.join(target_path, "run_results.json"), "w") as f:
+            json.dump({"results": results}, f)
+        return False
+
+    job = event_loop.run_until_complete(
+        admit_job(async_db_connection, model_name="stg_payments int_order_payments", run_or_test="build")
+    )
+    worker = JobWorker(pool_name=RUN_POOL, worker_id="run-worker", execute=execute)
+    assert event_loop.run_until_complete(worker.process_next_job(async_db_connection)) is True
+
+    assert commands[0][:4] == ["build", "--select", "stg_payments", "int_order_payments"]
+    assert not os.path.exists(commands[0][-1])
+    assert _get_job(event_loop, async_db_connection, job.job_id)["status"] == "failed"
+    assert event_loop.run_until_complete(get_nodes_results(async_db_connection, job.job_id)) == [
+        {"model_name": "stg_payments", "test_or_run": "run", "status": "success"},
+        {"model_name": "not_null_stg_payments_id", "test_or_run": "test", "status": "failed"},
+        {"model_name": "int_order_payments", "test_or_run": "run", "status": "skipped"},
+    ]
+
+    # the model built successfully is not run again
+    run_job = event_loop.run_until_complete(admit_job(async_db_connection, model_name="stg_payments", run_or_test="run"))
+    assert (run_job.created, run_job.status) == (False, "success")
+    run_job = event_loop.run_until_complete(admit_job(async_db_connection, model_name="int_order_payments", run_or_test="run"))
+    assert run_job.created is True
+
+
+def test_job_timings_are_recorded(event_loop, async_db_connection, empty_jobs_table):
+
+    def execute(arguments_list):
+        target_path = arguments_list[arguments_list.index("--target-path") + 1]
+        results = [{
+            "unique_id": "model.corpus.stg_payments",
+            "status": "success",
+            "execution_time": 2.5,
+            "timing": [
+                {"name": "compile", "started_at": "2026-10-18T10:00:00.000000Z", "completed_at": "2026-10-18T10:00:00.500000Z"},
+                {"name": "execute", "started_at": "2026-10-18T10:00:00.500000Z", "completed_at": "2026-10-18T10:00:02.500000Z"},
+            ],
+            "adapter_response": {"_message": "INSERT 0 42", "code": "INSERT", "rows_affected": 42},
+        }]
+        with open(os.path.join(target_path, "run_results.json"), "w") as f:
+            json.dump({"results": results}, f)
+        return True
+
+    job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="stg_payments", run_or_test="run"))
+    worker = JobWorker(pool_name=RUN_POOL, worker_id="run-worker", execute=execute)
+    assert event_loop.run_until_complete(worker.process_next_job(async_db_connection)) is True
+
+    timing = event_loop.run_until_complete(
+        async_db_connection.fetchrow("SELECT * FROM dbt_model_timings WHERE job_id = $1", job_id)
+    )
+    assert (timing["model_name"], timing["resource_type"], timing["status"]) == ("stg_payments", "model", "success")
+    assert timing["execution_time"] == 2.5
+    assert timing["rows_affected"] == 42
+    assert timing["compile_started_at"] == datetime(2026, 10, 18, 10, 0, 0)
+    assert timing["execute_completed_at"] - timing["execute_started_at"] == timedelta(seconds=2)
+    assert json.loads(timing["adapter_response"])["code"] == "INSERT"
+    # a run job does not record its nodes as jobs
+    assert event_loop.run_until_complete(get_nodes_results(async_db_connection, job_id)) == []
+
+
+def test_old_jobs_partitions_are_dropped(event_loop, async_db_connection, empty_jobs_table):
+
+    old_job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="some-model", run_or_test="run"))
+    event_loop.run_until_complete(async_db_connection.execute(
+        "UPDATE dbt_jobs SET c_date = c_date - INTERVAL '60 days' WHERE job_id = $1", old_job_id
+    ))
+    event_loop.run_until_complete(async_db_connection.execute(
+        "SELECT dbt_jobs_create_partitions(current_date - 70, current_date - 50)"
+    ))
+    recent_job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="some-model", run_or_test="run"))
+
+    dropped_partitions = event_loop.run_until_complete(
+        maintain_jobs_partitions(async_db_connection, retention_days=30, days_ahead=7)
+    )
+    assert len(dropped_partitions) >= 21
+    assert _get_job(event_loop, async_db_connection, old_job_id) is None
+    assert _get_job(event_loop, async_db_connection, recent_job_id) is not None
+
+
+def test_job_ids_carry_their_partition_day(event_loop, async_db_connection, empty_jobs_table):
+    job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="some-model", run_or_test="run"))
+    c_date = _get_job(event_loop, async_db_connection, job_id)["c_date"]
+    day = datetime(c_date.year, c_date.month, c_date.day)
+    assert get_jobs_days([job_id]) == (day, day + timedelta(days=1))
+
+    # a job id is unique, whatever its c_date in the day
+    with pytest.raises(asyncpg.UniqueViolationError):
+        event_loop.run_until_complete(async_db_connection.execute(
+            "INSERT INTO dbt_jobs (job_id, model_name, test_or_run, status, c_date) VALUES ($1, 'other-model', 'run', 'queued', $2)",
+            job_id, c_date + timedelta(microseconds=1)
+        ))
+
+    # the ids written before are looked up in all the partitions
+    event_loop.run_until_complete(async_db_connection.execute(
+        "UPDATE dbt_jobs SET job_id = 'd3b07384-d113-4ec4-9e57-3f6d2a4b1c9a' WHERE job_id = $1", job_id
+    ))
+    assert get_jobs_days(["d3b07384-d113-4ec4-9e57-3f6d2a4b1c9a"]) == (datetime.min, datetime.max)
+    assert event_loop.run_until_complete(cancel_job(async_db_connection, "d3b07384-d113-4ec4-9e57-3f6d2a4b1c9a")) == (True, "cancelled")
+    assert event_loop.run_until_complete(read_job_status(async_db_connection, "d3b07384-d113-4ec4-9e57-3f6d2a4b1c9a")) == "cancelled"
+
+
+def _execute_slow_query(arguments_list):
+    """A dbt command stuck on a query, in a session named as dbt names the sessions of the job"""
+    connection = psycopg2.connect(
+        database="postgres", user="postgres", password="postgres", host="localhost",
+        application_name=os.environ["DBT_APPLICATION_NAME"]
+    )
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_sleep(60)")
+        return True
+    except psycopg2.errors.QueryCanceled:
+        return False
+    finally:
+        connection.close()
+
+
+def test_job_times_out(event_loop, async_db_connection, empty_jobs_table, monkeypatch):
+    monkeypatch.setenv("DBT_RUN_TIMEOUT", "1")
+
+    job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="slow-model", run_or_test="run"))
+    worker = JobWorker(pool_name=RUN_POOL, worker_id="run-worker", execute=_execute_slow_query)
+    start = time.monotonic()
+    assert event_loop.run_until_complete(worker.process_next_job(async_db_connection)) is True
+
+    # the query was cancelled, the worker did not wait for it
+    assert time.monotonic() - start < 10
+    assert worker.stuck is False
+    job = _get_job(event_loop, async_db_connection, job_id)
+    assert job["status"] == "timeout"
+    assert job["ended_at"] is not None
+
+
+def test_started_job_is_cancelled(event_loop, async_db_connection, empty_jobs_table):
+
+    job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="slow-model", run_or_test="run"))
+    worker = JobWorker(pool_name=RUN_POOL, worker_id="run-worker", execute=_execute_slow_query)
+
+    async def cancel_later():
+        connection = await asyncpg.connect(database="postgres", user="postgres", password="postgres", host="localhost")
+        await asyncio.sleep(1)
+        cancelled, job_status = await cancel_job(connection, job_id)
+        await connection.close()
+        return cancelled, job_status
+
+    async def run_and_cancel():
+        worker_connection = await asyncpg.connect(
+            database="postgres", user="postgres", password="postgres", host="localhost"
+        )
+        await worker.listen(worker_connection)
+        results = await asyncio.gather(worker.process_next_job(worker_connection), cancel_later())
+        await worker_connection.close()
+        return results
+
+    start = time.monotonic()
+    assert event_loop.run_until_complete(run_and_cancel()) == [True, (True, "cancelled")]
+    assert time.monotonic() - start < 10
+    assert _get_job(event_loop, async_db_connection, job_id)["status"] == "cancelled"
+
+    # a finished job is not cancelled again
+    assert event_loop.run_until_complete(cancel_job(async_db_connection, job_id)) == (False, "cancelled")
+
+
+def test_job_timeout(monkeypatch):
+    monkeypatch.setenv("DBT_BUILD_TIMEOUT", "1800")
+    monkeypatch.setenv("DBT_MODELS_TIMEOUTS", "big_model=7200, small_model=60")
+
+    assert get_job_timeout("run", ["some_model"]) == 1200
+    assert get_job_timeout("build", ["some_model", "small_model"]) == 1800
+    assert get_job_timeout("build", ["some_model", "big_model"]) == 7200
+
+
+def test_admissions_are_limited_by_action(event_loop, async_db_connection, empty_jobs_table):
+
+    async def admit(pool, i):
+        async with pool.acquire() as connection:
+            return await admit_job(connection, model_name=f"model_{i}", run_or_test="run", action_limit=5)
+
+    async def submit_concurrently():
+        pool = await asyncpg.create_pool(
+            database="postgres", user="postgres", password="postgres", host="localhost", min_size=10, max_size=10
+        )
+        admitted_jobs = await asyncio.gather(*[admit(pool, i) for i in range(30)])
+        await pool.close()
+        return admitted_jobs
+
+    admitted_jobs = event_loop.run_until_complete(submit_concurrently())
+    assert sum(job.created for job in admitted_jobs) == 5
+    assert {job.rejected_by for job in admitted_jobs if not job.created} == {"action"}
+    # the other actions have their own limit
+    job = event_loop.run_until_complete(admit_job(async_db_connection, model_name="model_0", run_or_test="test", action_limit=5))
+    assert job.created is True
+
+
+def test_low_priority_jobs_wait_in_a_bounded_queue(event_loop, async_db_connection, empty_jobs_table):
+
+    def admit(model_name, low_priority):
+        return event_loop.run_until_complete(admit_job(
+            async_db_connection, model_name=model_name, run_or_test="run", target_schema="marts",
+            low_priority=low_priority, action_limit=10, schema_limit=1, wait_queue_size=2
+        ))
+
+    # the queued low priority jobs are counted in the wait queue, admitted over a limit or not
+    assert admit("model_a", low_priority=True).created is True
+    assert admit("model_b", low_priority=False).rejected_by == "schema"
+    assert admit("model_c", low_priority=True).created is True
+    assert admit("model_d", low_priority=True).rejected_by == "wait_queue"
+
+    # the low priority jobs are claimed after the others
+    normal_job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="model_e", run_or_test="run"))
+    job = event_loop.run_until_complete(claim_job(async_db_connection, actions=["run"], worker_id="w"))
+    assert job["job_id"] == normal_job_id
+
+
+def test_concurrent_batches_and_single_admissions(event_loop, async_db_connection, empty_jobs_table):
+    models_names = [f"model_{i}" for i in range(10)]
+
+    async def admit_batch(pool, reverse):
+        submissions = [
+            JobSubmission(model_name=model_name, run_or_test=action, action_limit=100)
+            for model_name in (models_names[::-1] if reverse else models_names)
+            for action in ("run", "test")
+        ]
+        async with pool.acquire() as connection:
+            return await admit_jobs(connection, submissions)
+
+    async def admit_single(pool, model_name):
+        async with pool.acquire() as connection:
+            return [await admit_job(connection, model_name=model_name, run_or_test="run", action_limit=100)]
+
+    async def submit_concurrently():
+        pool = await asyncpg.create_pool(
+            database="postgres", user="postgres", password="postgres", host="localhost", min_size=10, max_size=10
+        )
+        admissions = await asyncio.gather(
+            *[admit_batch(pool, reverse=i % 2 == 1) for i in range(6)],
+            *[admit_single(pool, model_name) for model_name in models_names]
+        )
+        await pool.close()
+        return [job for jobs in admissions for job in jobs]
+
+    admitted_jobs = event_loop.run_until_complete(submit_concurrently())
+    assert sum(job.created for job in admitted_jobs) == 20
+    assert len({job.job_id for job in admitted_jobs}) == 20
+    assert event_loop.run_until_complete(async_db_connection.fetchval("SELECT COUNT(*) FROM dbt_jobs")) == 20
+
+
+def test_batch_admission_keeps_the_order_and_limits(event_loop, async_db_connection, empty_jobs_table):
+
+    submissions = [
+        JobSubmission(model_name="model_a", run_or_test="run", action_limit=2),
+        JobSubmission(model_name="model_a", run_or_test="run", action_limit=2),
+        JobSubmission(model_name="model_b", run_or_test="run", action_limit=2),
+        JobSubmission(model_name="model_c", run_or_test="run", action_limit=2),
+    ]
+    jobs = event_loop.run_until_complete(admit_jobs(async_db_connection, submissions))
+
+    assert [(job.created, job.status) for job in jobs] == [
+        (True, "queued"), (False, "queued"), (True, "queued"), (False, "rejected")
+    ]
+    # a model submitted twice has one job
+    assert jobs[0].job_id == jobs[1].job_id
+    assert jobs[3].rejected_by == "action"
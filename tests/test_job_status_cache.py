@@ -0,0 +1,46 @@
+import time
+
+from lib.job_status_cache import JobStatusCache
+
+
+def _cache(max_size=10, negative_ttl=60) -> JobStatusCache:
+    return JobStatusCache(terminal_statuses={"success", "failed"}, max_size=max_size, ttl=60, negative_ttl=negative_ttl)
+
+
+def test_only_terminal_statuses_and_unknown_jobs_are_cached():
+    cache = _cache()
+    cache.put("job-1", "success")
+    cache.put("job-2", "started")
+    cache.put("job-3", None)
+
+    assert cache.get("job-1") == (True, "success")
+    assert cache.get("job-2") == (False, None)
+    assert cache.get("job-3") == (True, None)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # a status written by the process replaces the cached one
+    cache.put("job-3", "started")
+    assert cache.get("job-3") == (False, None)
+
+
+def test_least_recently_used_jobs_are_dropped():
+    cache = _cache(max_size=3)
+    for i in range(3):
+        cache.put(f"job-{i}", "success")
+    cache.get("job-0")
+    cache.put("job-3", "failed")
+
+    assert len(cache) == 3
+    assert cache.get("job-1") == (False, None)
+    assert cache.get("job-0") == (True, "success")
+
+
+def test_entries_expire():
+    cache = _cache(negative_ttl=0.05)
+    cache.put("job-1", "success")
+    cache.put("unknown-job", None)
+    time.sleep(0.1)
+
+    assert cache.get("job-1") == (True, "success")
+    assert cache.get("unknown-job") == (False, None)
+    assert len(cache) == 1
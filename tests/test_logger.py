@@ -0,0 +1,114 @@
+import contextvars
+import logging
+import os
+import threading
+
+import pytest
+
+from lib.logger import BatchingHandler, ContextFieldsFilter, ProcessLocalHandler, install_batching_handler, log_context
+
+
+class ListHandler(logging.Handler):
+    """Local sink in place of Cloud Logging"""
+
+    def __init__(self, blocked: threading.Event = None):
+        super().__init__()
+        self.records = []
+        self.batches = 0
+        self.blocked = blocked
+
+    def emit(self, record):
+        if self.blocked is not None:
+            self.blocked.wait()
+        self.records.append(record)
+
+    def flush(self):
+        self.batches += 1
+
+
+@pytest.fixture()
+def test_logger():
+    logger = logging.getLogger("test_logger")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    yield logger
+    for handler in list(logger.handlers):
+        handler.close()
+        logger.removeHandler(handler)
+
+
+def test_records_are_written_by_batches_with_context_fields(test_logger, monkeypatch):
+    monkeypatch.setenv("LOG_BATCH_SIZE", "10")
+    sink = ListHandler()
+    handler = install_batching_handler(test_logger, sink)
+
+    with log_context(job_id="job-1", model_name="stg_orders"):
+        for i in range(25):
+            test_logger.info("record %s", i)
+        # the fields are kept in the threads run with a copy of the context, as the dbt commands of the jobs
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(test_logger.warning, "from thread"))
+        thread.start()
+        thread.join()
+    test_logger.info("outside of the job")
+    handler.flush()
+
+    assert [record.getMessage() for record in sink.records[:25]] == [f"record {i}" for i in range(25)]
+    assert sink.batches >= 3
+    assert sink.records[25].json_fields == {"job_id": "job-1", "model_name": "stg_orders"}
+    assert (sink.records[-1].job_id, sink.records[-1].model_name) == (None, None)
+
+
+def test_full_queue_drops_records_below_error(test_logger):
+    blocked = threading.Event()
+    sink = ListHandler(blocked=blocked)
+    handler = BatchingHandler(sink, queue_size=3, batch_size=1, flush_interval=0.01)
+    handler.addFilter(ContextFieldsFilter())
+    test_logger.addHandler(handler)
+
+    # the first record blocks the sink, the queue then holds 3 records
+    test_logger.info("written")
+    while handler.queue.qsize():
+        pass
+    for i in range(5):
+        test_logger.info("queued %s", i)
+    test_logger.error("error")
+    blocked.set()
+    handler.close()
+
+    messages = [record.getMessage() for record in sink.records]
+    assert messages == ["written", "3 log records were dropped, the logging queue was full", "queued 1", "queued 2", "error"]
+
+
+def test_close_writes_queued_records(test_logger):
+    sink = ListHandler()
+    handler = BatchingHandler(sink, queue_size=100, batch_size=100, flush_interval=60)
+    test_logger.addHandler(handler)
+    for i in range(50):
+        test_logger.info("record %s", i)
+
+    handler.close()
+    assert len(sink.records) == 50
+    # the records logged after the close are written directly
+    test_logger.info("late record")
+    assert sink.records[-1].getMessage() == "late record"
+
+
+def test_forked_process_writes_its_records(test_logger, tmp_path):
+    log_file = tmp_path / "records.log"
+    # each process opens its own file handler, as its own Cloud Logging client
+    handler = install_batching_handler(test_logger, ProcessLocalHandler(lambda: logging.FileHandler(log_file)))
+    test_logger.info("from parent")
+    handler.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            test_logger.info("from child")
+            handler.close()
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    os.waitpid(pid, 0)
+    test_logger.info("from parent after the fork")
+    handler.close()
+
+    assert log_file.read_text().splitlines() == ["from parent", "from child", "from parent after the fork"]
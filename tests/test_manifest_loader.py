@@ -0,0 +1,65 @@
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+import yaml
+
+import manifest_loader
+from dbt_selectors import ManifestSelector
+
+FIXTURE_PROJECT = Path(__file__).resolve().parent / "fixtures" / "dbt_selectors"
+
+
+@pytest.fixture()
+def manifest_path(tmp_path) -> str:
+    manifest_path = tmp_path / "manifest.json"
+    shutil.copy(FIXTURE_PROJECT / "manifest.json", manifest_path)
+    return str(manifest_path)
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_compact_manifest_selects_as_the_manifest(monkeypatch, manifest_path, streaming):
+    if streaming:
+        pytest.importorskip("ijson")
+    else:
+        monkeypatch.setattr(manifest_loader, "ijson", None)
+
+    compact_manifest = manifest_loader.load_manifest(manifest_path)
+
+    manifest = json.loads(Path(manifest_path).read_text())
+    assert compact_manifest["nodes"]["model.corpus.customers"] == {
+        "unique_id": "model.corpus.customers",
+        "resource_type": "model",
+        "package_name": "corpus",
+        "name": "customers",
+        "fqn": ["corpus", "marts", "customers"],
+        "tags": ["stats", "marts"],
+        "config": {"enabled": True},
+        "depends_on": {"nodes": manifest["nodes"]["model.corpus.customers"]["depends_on"]["nodes"]},
+    }
+    selectors = yaml.safe_load((FIXTURE_PROJECT / "selectors.yml").read_text())["selectors"]
+    expected_ls = json.loads((FIXTURE_PROJECT / "expected_ls.json").read_text())
+    manifest_selector = ManifestSelector(manifest=compact_manifest, selectors=selectors)
+    for selector_name, resources in expected_ls.items():
+        assert manifest_selector.list(selector_name) == resources
+
+
+def test_snapshot_is_used_for_the_same_manifest(monkeypatch, manifest_path, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    compact_manifest = manifest_loader.load_manifest(manifest_path, cache_dir=cache_dir)
+    assert len(list(Path(cache_dir).iterdir())) == 1
+
+    def read_manifest(manifest_path):
+        raise AssertionError("The manifest should not be parsed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(manifest_loader, "_read_manifest", read_manifest)
+        assert manifest_loader.load_manifest(manifest_path, cache_dir=cache_dir) == compact_manifest
+
+    # a new snapshot for a changed manifest
+    manifest = json.loads(Path(manifest_path).read_text())
+    del manifest["nodes"]["model.corpus.customer_ltv"]
+    Path(manifest_path).write_text(json.dumps(manifest))
+    assert "model.corpus.customer_ltv" not in manifest_loader.load_manifest(manifest_path, cache_dir=cache_dir)["nodes"]
+    assert len(list(Path(cache_dir).iterdir())) == 2
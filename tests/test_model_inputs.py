@@ -0,0 +1,109 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from lib.dbt_engine import ModelInputs, read_models_inputs
+from lib.jobs import _start_job, mark_job_as_success
+from lib.model_inputs import get_input_fingerprint
+
+
+def _node(name, resource_type, depends_on=(), materialized="table"):
+    return {
+        "name": name,
+        "resource_type": resource_type,
+        "schema": "corpus",
+        "checksum": {"name": "sha256", "checksum": f"{name}-checksum"},
+        "config": {"materialized": materialized},
+        "depends_on": {"macros": [], "nodes": list(depends_on)},
+    }
+
+
+def test_models_inputs_are_read_from_the_manifest(tmp_path):
+    manifest = {
+        "nodes": {
+            "model.corpus.stg_orders": _node("stg_orders", "model", ["source.corpus.raw.orders"]),
+            "seed.corpus.country_codes": _node("country_codes", "seed"),
+            "model.corpus.orders_daily": _node(
+                "orders_daily", "model", ["model.corpus.stg_orders", "seed.corpus.country_codes"]
+            ),
+            "model.corpus.stg_refunds": _node("stg_refunds", "model", materialized="ephemeral"),
+            "model.corpus.refunds_stats": _node("refunds_stats", "model", ["model.corpus.stg_refunds"]),
+        },
+        "sources": {
+            "source.corpus.raw.orders": {"relation_name": '"postgres"."raw"."orders"', "loaded_at_field": "loaded_at"},
+        },
+    }
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps(manifest))
+
+    models_inputs = read_models_inputs(str(manifest_path))
+    assert models_inputs["stg_orders"] == ModelInputs(
+        schema="corpus",
+        checksum="stg_orders-checksum",
+        sources=[('"postgres"."raw"."orders"', "loaded_at")],
+        models=[],
+        seeds=[],
+        opaque=False,
+    )
+    assert models_inputs["orders_daily"].models == ["stg_orders"]
+    assert models_inputs["orders_daily"].seeds == [("country_codes", "country_codes-checksum")]
+    # the changes of an ephemeral model are not known
+    assert models_inputs["refunds_stats"].opaque is True
+    assert "country_codes" not in models_inputs
+
+
+@pytest.fixture()
+def raw_orders(event_loop, db_connection):
+    cursor = db_connection.cursor()
+    cursor.execute("CREATE SCHEMA IF NOT EXISTS raw")
+    cursor.execute("DROP TABLE IF EXISTS raw.orders")
+    cursor.execute("CREATE TABLE raw.orders (id INTEGER, loaded_at TIMESTAMP)")
+    cursor.execute("INSERT INTO raw.orders VALUES (1, '2026-10-17 02:00')")
+    yield cursor
+    cursor.execute("DROP SCHEMA raw CASCADE")
+    cursor.close()
+
+
+def test_fingerprint_changes_with_the_inputs(event_loop, async_db_connection, raw_orders, monkeypatch):
+    from setup_db import run_setup_db
+    run_setup_db()
+    model_inputs = ModelInputs(
+        schema="corpus",
+        checksum="orders_daily-checksum",
+        sources=[("raw.orders", "loaded_at")],
+        models=["stg_customers"],
+        seeds=[],
+        opaque=False,
+    )
+    monkeypatch.setattr("lib.model_inputs.get_model_inputs", lambda model_name: model_inputs)
+    monkeypatch.setattr("lib.model_inputs.SOURCES_LOADED_AT", {})
+
+    def fingerprint():
+        return event_loop.run_until_complete(get_input_fingerprint(async_db_connection, "orders_daily"))
+
+    first_fingerprint = fingerprint()
+    assert first_fingerprint is not None
+    assert fingerprint() == first_fingerprint
+
+    raw_orders.execute("INSERT INTO raw.orders VALUES (2, %s)", (datetime(2026, 10, 18, 2),))
+    # the freshness of the source is read again once its cache entry expired
+    assert fingerprint() == first_fingerprint
+    monkeypatch.setattr("lib.model_inputs.SOURCE_FRESHNESS_CACHE_TTL", 0)
+    monkeypatch.setattr("lib.model_inputs.SOURCES_LOADED_AT", {})
+    second_fingerprint = fingerprint()
+    assert second_fingerprint != first_fingerprint
+
+    # a new build of an upstream model
+    job_id = event_loop.run_until_complete(_start_job(async_db_connection, model_name="stg_customers", run_or_test="run"))
+    event_loop.run_until_complete(mark_job_as_success(async_db_connection, job_id))
+    assert fingerprint() not in (first_fingerprint, second_fingerprint)
+    # the runs older than the retention days are not looked for
+    monkeypatch.setattr("lib.jobs.JOBS_RETENTION_DAYS", 0)
+    assert fingerprint() == second_fingerprint
+
+    # without freshness, a source can not tell whether it changed
+    monkeypatch.setattr("lib.model_inputs.get_model_inputs", lambda model_name: model_inputs._replace(
+        sources=[("raw.orders", None)]
+    ))
+    assert fingerprint() is None
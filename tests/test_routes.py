@@ -1,4 +1,15 @@
-from api.dbt_routes import _start_job, mark_job_as_success, mark_job_as_failed
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+import time
+
+import asyncpg
+import pytest
+
+from lib.dbt_engine import RUNNING_PROCESSES, ModelInputs, get_dbt_engine, use_warm_engine
+from lib.jobs import _start_job, mark_job_as_success, mark_job_as_failed
+from lib.model_timings import record_model_timings
 
 
 def test_default_route(client):
@@ -18,33 +29,351 @@ def test_get_job_when_unfound(client):
         assert response.status_code == 404
 
 
-def test_get_job_when_started(client, db_connection):
+def test_get_job_when_queued(client, event_loop, async_db_connection):
 
-    cursor = db_connection.cursor()
-    job_id = _start_job(cursor=cursor, model_name="some-model", run_or_test="test")
+    job_id = event_loop.run_until_complete(
+        _start_job(connection=async_db_connection, model_name="some-model", run_or_test="test")
+    )
     with client:
         response = client.get("/job", params={"job_id": job_id})
         assert response.status_code == 200
-        assert response.json()["job_status"] == "started"
+        assert response.json()["job_status"] == "queued"
 
 
-def test_get_job_when_succeeded(client, db_connection):
+def test_get_job_when_succeeded(client, event_loop, async_db_connection):
 
-    cursor = db_connection.cursor()
-    job_id = _start_job(cursor=cursor, model_name="some-model", run_or_test="test")
-    mark_job_as_success(cursor=cursor, job_id=job_id)
+    job_id = event_loop.run_until_complete(
+        _start_job(connection=async_db_connection, model_name="some-model", run_or_test="test")
+    )
+    event_loop.run_until_complete(mark_job_as_success(connection=async_db_connection, job_id=job_id))
     with client:
         response = client.get("/job", params={"job_id": job_id})
         assert response.status_code == 200
         assert response.json()["job_status"] == "success"
 
 
-def test_get_job_when_failed(client, db_connection):
+def test_get_job_when_failed(client, event_loop, async_db_connection):
 
-    cursor = db_connection.cursor()
-    job_id = _start_job(cursor=cursor, model_name="some-model", run_or_test="test")
-    mark_job_as_failed(cursor=cursor, job_id=job_id)
+    job_id = event_loop.run_until_complete(
+        _start_job(connection=async_db_connection, model_name="some-model", run_or_test="test")
+    )
+    event_loop.run_until_complete(mark_job_as_failed(connection=async_db_connection, job_id=job_id))
     with client:
         response = client.get("/job", params={"job_id": job_id})
         assert response.status_code == 200
-        assert response.json()["job_status"] == "failed"
\ No newline at end of file
+        assert response.json()["job_status"] == "failed"
+
+
+def test_cancel_job(client, event_loop, async_db_connection):
+
+    job_id = event_loop.run_until_complete(
+        _start_job(connection=async_db_connection, model_name="some-model", run_or_test="run")
+    )
+    with client:
+        response = client.post(f"/job/{job_id}/cancel")
+        assert response.status_code == 200
+        assert response.json() == {"job_status": "cancelled"}
+        assert client.get("/job", params={"job_id": job_id}).json()["job_status"] == "cancelled"
+
+        response = client.post(f"/job/{job_id}/cancel")
+        assert response.status_code == 409
+        assert response.json()["job_status"] == "cancelled"
+
+        assert client.post("/job/bad-job/cancel").status_code == 404
+
+
+def test_submissions_over_the_limits_are_rejected(client, monkeypatch):
+    from setup_db import run_setup_db
+    run_setup_db()
+    monkeypatch.setenv("DBT_RUN_MAX_ACTIVE_JOBS", "1")
+    monkeypatch.setenv("DBT_SCHEMAS_MAX_ACTIVE_JOBS", "marts=5")
+    monkeypatch.setenv("DBT_ADMISSION_RETRY_AFTER", "12")
+
+    with client:
+        assert client.post("/run_model", params={"model_name": "some-model"}).status_code == 201
+        response = client.post("/run_model", params={"model_name": "other-model"})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "12"
+        assert response.json()["rejected_by"] == "action"
+
+        # a low priority job waits instead
+        response = client.post("/run_model", params={"model_name": "other-model", "priority": "low"})
+        assert response.status_code == 201
+
+        capacity = client.get("/capacity").json()
+        assert capacity["actions"]["run"] == {"limit": 1, "queued": 2, "started": 0, "available": 0}
+        assert capacity["actions"]["test"]["available"] == 100
+        assert capacity["schemas"] == {"marts": {"limit": 5, "queued": 0, "started": 0, "available": 5}}
+        assert capacity["wait_queue"] == {"size": 100, "waiting": 1}
+        assert capacity["retry_after"] == 12
+
+        # a batch is answered 429 when all its jobs are rejected, the rejected jobs flagged otherwise
+        response = client.post("/jobs", json=[{"model_name": "model-a", "run_or_test": "run"}])
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "12"
+        response = client.post("/jobs", json=[
+            {"model_name": "model-a", "run_or_test": "run"}, {"model_name": "model-a", "run_or_test": "test"}
+        ])
+        assert response.status_code == 200
+        assert response.headers["Retry-After"] == "12"
+        assert [job.get("rejected_by") for job in response.json()["jobs"]] == ["action", None]
+
+
+def test_run_is_skipped_when_inputs_did_not_change(client, event_loop, async_db_connection, monkeypatch):
+    from setup_db import run_setup_db
+    run_setup_db()
+    model_inputs = ModelInputs(schema="corpus", checksum="c", sources=[], models=["stg_orders"], seeds=[], opaque=False)
+    monkeypatch.setattr("lib.model_inputs.get_model_inputs", lambda model_name: model_inputs)
+    params = {"model_name": "orders_daily", "skip_unchanged": "true"}
+
+    with client:
+        job_id = client.post("/run_model", params=params).json()["job_id"]
+        event_loop.run_until_complete(mark_job_as_success(connection=async_db_connection, job_id=job_id))
+        # older than the dedupe window
+        event_loop.run_until_complete(async_db_connection.execute(
+            "UPDATE dbt_jobs SET c_date = c_date - INTERVAL '1 day' WHERE job_id = $1", job_id
+        ))
+
+        response = client.post("/run_model", params=params).json()
+        assert (response["job_id"], response["skip_job"]) == (job_id, True)
+
+        # an upstream model was built since
+        upstream_job_id = event_loop.run_until_complete(
+            _start_job(connection=async_db_connection, model_name="stg_orders", run_or_test="run")
+        )
+        event_loop.run_until_complete(mark_job_as_success(connection=async_db_connection, job_id=upstream_job_id))
+        response = client.post("/run_model", params=params).json()
+        assert response["job_id"] != job_id
+        assert response["skip_job"] is False
+
+
+def test_jobs_batch_submission_and_statuses(client, event_loop, async_db_connection):
+    from setup_db import run_setup_db
+    run_setup_db()
+
+    with client:
+        response = client.post("/jobs", json=[
+            {"model_name": "some-model", "run_or_test": "run"},
+            {"model_name": "some-model", "run_or_test": "test", "priority": "low"},
+            {"model_name": "some-model  other-model", "run_or_test": "build"},
+        ])
+        assert response.status_code == 200
+        jobs = response.json()["jobs"]
+        assert [(job["model_name"], job["run_or_test"], job["skip_job"]) for job in jobs] == [
+            ("some-model", "run", False), ("some-model", "test", False), ("some-model other-model", "build", False)
+        ]
+        assert client.post("/jobs", json=[{"model_name": "some-model", "run_or_test": "seed"}]).status_code == 422
+
+        jobs_ids = [job["job_id"] for job in jobs]
+        response = client.get("/jobs", params={"ids": ",".join([*jobs_ids, "bad-job"])})
+        assert response.status_code == 200
+        assert response.json()["jobs"] == {**{job_id: "queued" for job_id in jobs_ids}, "bad-job": None}
+        etag = response.headers["ETag"]
+
+        response = client.get("/jobs", params={"ids": ",".join(jobs_ids)}, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+
+        response = client.get("/jobs", params={"ids": ",".join([*jobs_ids, "bad-job"])}, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+
+        event_loop.run_until_complete(mark_job_as_success(connection=async_db_connection, job_id=jobs_ids[0]))
+        response = client.get("/jobs", params={"ids": ",".join([*jobs_ids, "bad-job"])}, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json()["jobs"][jobs_ids[0]] == "success"
+
+
+def test_finished_job_status_is_cached(client, event_loop, async_db_connection):
+    from lib.job_status_cache import get_job_status_cache
+
+    job_id = event_loop.run_until_complete(
+        _start_job(connection=async_db_connection, model_name="some-model", run_or_test="test")
+    )
+    event_loop.run_until_complete(mark_job_as_success(connection=async_db_connection, job_id=job_id))
+    cache = get_job_status_cache()
+    with client:
+        assert client.get("/job", params={"job_id": job_id}).json()["job_status"] == "success"
+        # the next polls do not read the table
+        event_loop.run_until_complete(async_db_connection.execute("DELETE FROM dbt_jobs WHERE job_id = $1", job_id))
+        hits = cache.hits
+        assert client.get("/job", params={"job_id": job_id}).json()["job_status"] == "success"
+        assert client.get("/jobs", params={"ids": job_id}).json()["jobs"] == {job_id: "success"}
+        assert cache.hits == hits + 2
+
+
+def test_db_pool_is_shared_by_requests(client):
+    with client:
+        for _ in range(3):
+            client.get("/job", params={"job_id": "bad-job"})
+        response = client.get("/pool")
+        assert response.status_code == 200
+        pool_stats = response.json()
+        assert pool_stats["size"] <= pool_stats["max_size"]
+        assert pool_stats["in_use"] == 0
+
+
+def _mark_job_as_success_later(job_id: str, delay: float):
+
+    async def mark_job():
+        await asyncio.sleep(delay)
+        connection = await asyncpg.connect(
+            database="postgres", user="postgres", password="postgres", host="localhost", port=5432
+        )
+        await mark_job_as_success(connection=connection, job_id=job_id)
+        await connection.close()
+
+    thread = threading.Thread(target=asyncio.run, args=(mark_job(),))
+    thread.start()
+    return thread
+
+
+def test_get_job_waits_for_status_change(client, event_loop, async_db_connection):
+
+    job_id = event_loop.run_until_complete(
+        _start_job(connection=async_db_connection, model_name="some-model", run_or_test="run")
+    )
+    with client:
+        thread = _mark_job_as_success_later(job_id, delay=1)
+        start = time.monotonic()
+        response = client.get("/job", params={"job_id": job_id, "wait": 30})
+        thread.join()
+        assert response.status_code == 200
+        assert response.json()["job_status"] == "success"
+        assert time.monotonic() - start < 10
+
+
+def test_get_job_wait_times_out(client, event_loop, async_db_connection):
+
+    job_id = event_loop.run_until_complete(
+        _start_job(connection=async_db_connection, model_name="some-model", run_or_test="run")
+    )
+    with client:
+        response = client.get("/job", params={"job_id": job_id, "wait": 1})
+        assert response.status_code == 200
+        assert response.json()["job_status"] == "queued"
+
+
+def test_job_events_stream(client, event_loop, async_db_connection):
+
+    job_id = event_loop.run_until_complete(
+        _start_job(connection=async_db_connection, model_name="some-model", run_or_test="run")
+    )
+    with client:
+        thread = _mark_job_as_success_later(job_id, delay=1)
+        response = client.get("/job/events", params={"job_id": job_id})
+        thread.join()
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [line for line in response.text.splitlines() if line.startswith("data: ")]
+        assert events == ['data: {"job_status": "queued"}', 'data: {"job_status": "success"}']
+
+
+def test_job_events_when_unfound(client):
+    with client:
+        response = client.get("/job/events", params={"job_id": "bad-job"})
+        assert response.status_code == 404
+
+
+def test_build_models_job(client, event_loop, async_db_connection):
+    with client:
+        response = client.post("/build_model", params={"model_name": " stg_payments  int_order_payments"})
+        assert response.status_code == 201
+        job_id = response.json()["job_id"]
+        job = event_loop.run_until_complete(
+            async_db_connection.fetchrow("SELECT model_name, test_or_run FROM dbt_jobs WHERE job_id = $1", job_id)
+        )
+        assert dict(job) == {"model_name": "stg_payments int_order_payments", "test_or_run": "build"}
+
+        response = client.get("/job/nodes", params={"job_id": job_id})
+        assert response.status_code == 200
+        assert response.json() == {"nodes": []}
+
+        assert client.post("/build_model", params={"model_name": " "}).status_code == 422
+        assert client.get("/job/nodes", params={"job_id": "bad-job"}).status_code == 404
+
+
+def test_models_stats(client, event_loop, async_db_connection):
+    event_loop.run_until_complete(async_db_connection.execute("DELETE FROM dbt_model_timings"))
+    nodes_results = [
+        {"unique_id": f"model.corpus.{model_name}", "status": status, "execution_time": execution_time}
+        for model_name, status, execution_time in [
+            ("stg_orders", "success", 1.0),
+            ("stg_orders", "success", 3.0),
+            ("stg_orders", "error", 100.0),
+            ("fct_orders", "success", 10.0),
+        ]
+    ]
+    event_loop.run_until_complete(record_model_timings(async_db_connection, "some-job", nodes_results))
+    with client:
+        response = client.get("/stats/models")
+        assert response.status_code == 200
+        models = response.json()["models"]
+        assert [(model["model_name"], model["runs"], model["p50"]) for model in models] == [
+            ("fct_orders", 1, 10.0),
+            ("stg_orders", 2, 2.0),
+        ]
+        assert models[1]["p95"] == 2.9
+
+        response = client.get("/stats/models", params={"model_name": "stg_orders", "days": 1})
+        assert [model["model_name"] for model in response.json()["models"]] == ["stg_orders"]
+
+        # the project of the service has no model
+        response = client.get("/stats/selectors/stats")
+        assert response.status_code == 200
+        assert response.json()["models"] == []
+        assert client.get("/stats/selectors/unknown").status_code == 404
+
+
+def test_metrics(client, event_loop, async_db_connection):
+    event_loop.run_until_complete(_start_job(connection=async_db_connection, model_name="some-model", run_or_test="build"))
+    with client:
+        assert client.get("/job", params={"job_id": "bad-job"}).status_code == 404
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        metrics = response.text
+        assert 'dbt_http_request_duration_seconds_count{method="GET",route="/job",status_code="404"}' in metrics
+        assert 'dbt_jobs{action="build",status="queued"}' in metrics
+        assert "dbt_db_pool_acquire_duration_seconds_count" in metrics
+
+
+class _ExhaustedPool:
+    """No connection is released"""
+
+    @asynccontextmanager
+    async def acquire(self):
+        await asyncio.sleep(60)
+        yield
+
+
+def test_metrics_without_database_connection(client, monkeypatch):
+    monkeypatch.setattr("api.dbt_routes.METRICS_DB_TIMEOUT", 0.1)
+    with client:
+        monkeypatch.setattr("api.dbt_routes.get_pool", _ExhaustedPool)
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert "dbt_http_request_duration_seconds_count" in response.text
+        assert "dbt_jobs{" not in response.text
+
+
+def test_command_timeout_stops_the_dbt_process_with_the_warm_engine(client, monkeypatch, tmp_path):
+    assert use_warm_engine()
+    # a dbt command stuck until it is stopped, writing its pid
+    pid_file = tmp_path / "dbt.pid"
+    dbt = tmp_path / "dbt"
+    dbt.write_text(f"#!/bin/sh\necho $$ > {pid_file}\nexec sleep 60\n")
+    dbt.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}:{os.environ['PATH']}")
+    monkeypatch.setattr("api.dbt_routes.DBT_COMMAND_TIMEOUT", 1)
+    with client:
+        response = client.post("/command", params={"command": "run --select some-model"})
+        assert response.status_code == 504
+
+    pid = int(pid_file.read_text())
+    deadline = time.monotonic() + 5
+    while RUNNING_PROCESSES and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not RUNNING_PROCESSES
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+    # the warm engine was not used, the other commands are not queued behind the stopped one
+    assert not get_dbt_engine()._lock.locked()  # pylint: disable=protected-access